@@ -1,13 +1,42 @@
+import http
+import fastapi
+
+from storage.interface import Storage
 from coordinator.interface import (
     Status,
-    Coordinator
+    Coordinator,
+    num_shards_for
 )
 
-async def run(coordinator: Coordinator, job_id: str, agent_mode: bool) -> dict:
+# pylint: disable=too-many-arguments, too-many-positional-arguments
+async def run(
+    coordinator: Coordinator,
+    storage: Storage,
+    job_id: str,
+    agent_mode: bool,
+    streaming: bool
+) -> dict | fastapi.responses.JSONResponse:
+    # a retried ( or duplicated ) request must not touch the modes
+    # of a job that is already running ( start_job below is the
+    # atomic guard, this one only keeps the modes of the first )
+    if coordinator.get_status(job_id) is not None:
+        return already_queued(job_id)
+
     status = Status.WaitingForNativeParsing
-    coordinator.set_status(job_id, status)
+    num_shards = num_shards_for(await storage.count_files_in_db(job_id), streaming)
     coordinator.set_agent_mode(job_id, agent_mode)
+    # must be known before the first shard is claimed
+    coordinator.set_streaming_mode(job_id, streaming)
+    if not coordinator.start_job(job_id, status, num_shards):
+        return already_queued(job_id)
+
     return analysis_started(job_id)
 
 def analysis_started(job_id: str) -> dict:
     return {'status': 'ok', 'started_analyzing_job_id': job_id}
+
+def already_queued(job_id: str) -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        status_code=http.HTTPStatus.CONFLICT,
+        content={'detail': f'job(id) {job_id} is already queued'}
+    )
@@ -1,4 +1,25 @@
+import sqlalchemy
+
 from storage import models, db
 
+# tables created before their indexes were declared
+def create_missing_indexes() -> None:
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+# tables created before their ( nullable ) columns were declared
+def create_missing_columns() -> None:
+    inspector = sqlalchemy.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(sqlalchemy.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
 if __name__ == '__main__':
     models.Base.metadata.create_all(bind=db.engine)
+    create_missing_columns()
+    create_missing_indexes()
@@ -5,21 +5,32 @@ import fastapi
 import slowapi
 import logging
 import secrets
+import contextlib
 
 from logger.client import Logger
 from storage.current import get_current_storage_method
 
 from app import upload
 from app import status
+from app import progress
 from app import analyze
 from app import results
+from app import timeline
 from app import authentication
 
 from storage.interface import Storage
 from coordinator.interface import Coordinator
 from coordinator.current import get_coordinator_between_workers
 
+# the last log messages are shipped before the app exits
+@contextlib.asynccontextmanager
+async def lifespan(the_app: fastapi.FastAPI):
+    yield
+    if logger := getattr(the_app.state, 'logger', None):
+        await logger.close()
+
 app = fastapi.FastAPI(
+    lifespan=lifespan,
     docs_url=None,
     redoc_url=None,
     openapi_url=None,
@@ -33,6 +44,14 @@ API_UPLOAD_FILENAME_DESCRIPTION: typing.Final[str] = """
 relative filename with respect to the source directory root
 """
 
+API_UPLOAD_ARCHIVE_FORMAT_DESCRIPTION: typing.Final[str] = """
+tar | tar.gz | tar.zst | zip ( relative filenames as member names )
+"""
+
+API_UPLOAD_BASE_JOB_ID_DESCRIPTION: typing.Final[str] = """
+earlier job(id) of the same repository, whose unchanged files are reused
+"""
+
 API_ANALYZE_JOB_ID_DESCRIPTION: typing.Final[str] = """
 launch multi-step static code analysis
 """
@@ -41,10 +60,22 @@ API_ANALYZE_AGENT_MODE_DESCRIPTION: typing.Final[str] = """
 use an LLM agent for adaptive query planning
 """
 
+API_ANALYZE_STREAMING_DESCRIPTION: typing.Final[str] = """
+move every part of the job to the next stage as soon as it is done
+"""
+
 API_STATUS_JOB_ID_DESCRIPTION: typing.Final[str] = """
 launch multi-step static code analysis
 """
 
+API_PROGRESS_JOB_ID_DESCRIPTION: typing.Final[str] = """
+stream of status changes and per stage progress until the job is finished
+"""
+
+API_TIMELINE_JOB_ID_DESCRIPTION: typing.Final[str] = """
+stage by stage queue wait and active time of the job
+"""
+
 API_RESULTS_JOB_ID_DESCRIPTION: typing.Final[str] = """
 launch multi-step static code analysis
 """
@@ -78,6 +109,25 @@ def create_handlers(
     ):
         return await upload.run(request, storage, job_id, filename, logger)
 
+    @app.post(f'/api/{approved_url}/upload/archive')
+    async def _(
+        request: fastapi.Request,
+        job_id: str = fastapi.Query(..., description=API_UPLOAD_JOB_ID_DESCRIPTION),
+        archive_format: str = fastapi.Query(..., description=API_UPLOAD_ARCHIVE_FORMAT_DESCRIPTION),
+        _1=fastapi.Depends(authentication.check),
+        _2=fastapi.Depends(content_type_check),
+    ):
+        return await upload.run_archive(request, storage, job_id, archive_format)
+
+    @app.post(f'/api/{approved_url}/upload/manifest')
+    async def _(
+        request: fastapi.Request,
+        job_id: str = fastapi.Query(..., description=API_UPLOAD_JOB_ID_DESCRIPTION),
+        base_job_id: str = fastapi.Query(..., description=API_UPLOAD_BASE_JOB_ID_DESCRIPTION),
+        _=fastapi.Depends(authentication.check)
+    ):
+        return await upload.run_manifest(request, storage, job_id, base_job_id)
+
     # argument request IS used ( for authentication check )
     @app.post(f'/api/{approved_url}/analyze')
     @limiter.limit('100/minute')
@@ -85,9 +135,10 @@ def create_handlers(
         request: fastapi.Request,
         job_id: str = fastapi.Query(..., description=API_ANALYZE_JOB_ID_DESCRIPTION),
         agent_mode: bool = fastapi.Query(..., description=API_ANALYZE_AGENT_MODE_DESCRIPTION),
+        streaming: bool = fastapi.Query(False, description=API_ANALYZE_STREAMING_DESCRIPTION),
         _=fastapi.Depends(authentication.check)
     ):
-        return await analyze.run(coordinator, job_id, agent_mode)
+        return await analyze.run(coordinator, storage, job_id, agent_mode, streaming)
 
     # argument request IS used ( for authentication check )
     @app.post(f'/api/{approved_url}/status')
@@ -97,7 +148,27 @@ def create_handlers(
         job_id: str = fastapi.Query(..., description=API_STATUS_JOB_ID_DESCRIPTION),
         _=fastapi.Depends(authentication.check)
     ):
-        return await status.run(coordinator, job_id)
+        return await status.run(coordinator, storage, job_id)
+
+    # argument request IS used ( for authentication check )
+    @app.get(f'/api/{approved_url}/progress')
+    @limiter.limit('100/minute')
+    async def _(
+        request: fastapi.Request,
+        job_id: str = fastapi.Query(..., description=API_PROGRESS_JOB_ID_DESCRIPTION),
+        _=fastapi.Depends(authentication.check)
+    ):
+        return await progress.run(coordinator, storage, job_id)
+
+    # argument request IS used ( for authentication check )
+    @app.post(f'/api/{approved_url}/timeline')
+    @limiter.limit('100/minute')
+    async def _(
+        request: fastapi.Request,
+        job_id: str = fastapi.Query(..., description=API_TIMELINE_JOB_ID_DESCRIPTION),
+        _=fastapi.Depends(authentication.check)
+    ):
+        return await timeline.run(coordinator, storage, job_id)
 
     # argument request IS used ( for authentication check )
     @app.post(f'/api/{approved_url}/results')
@@ -138,6 +209,7 @@ def content_type_check(content_type: str = fastapi.Header(..., alias='Content-Ty
 
 def init() -> None:
     logger = Logger()
+    app.state.logger = logger
     if storage := get_current_storage_method(logger):
         if coordinator := get_coordinator_between_workers(logger):
             define_endpoints(storage, coordinator, logger)
@@ -0,0 +1,65 @@
+import json
+import typing
+import contextlib
+import fastapi
+
+from storage.interface import Storage
+from coordinator.interface import Coordinator, Event, Status, TimelineEntry
+
+# keeps idle connections ( and whatever proxies them ) alive,
+# and lets the client tell a slow stage from a dead connection
+NUM_SECONDS_BETWEEN_HEARTBEATS: typing.Final[float] = 15
+
+async def run(coordinator: Coordinator, storage: Storage, job_id: str) -> fastapi.responses.StreamingResponse:
+    return fastapi.responses.StreamingResponse(
+        events(coordinator, storage, job_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# server sent events: a progress event for every change of the job,
+# until it is finished ( and its results are ready to be fetched ),
+# or an error event once it has failed ( or was never there )
+async def events(coordinator: Coordinator, storage: Storage, job_id: str) -> typing.AsyncIterator[str]:
+
+    if coordinator.get_status(job_id) in (None, Status.Failed):
+        yield event('error', {'status': f'fatal error processing job(id): {job_id}'})
+        return
+
+    timeline: list[TimelineEntry] = []
+    async with contextlib.aclosing(coordinator.follow_timeline(job_id, NUM_SECONDS_BETWEEN_HEARTBEATS)) as batches:
+        async for batch in batches:
+            if not batch:
+                yield ': heartbeat\n\n'
+                continue
+
+            timeline.extend(batch)
+            if (status := coordinator.get_status(job_id)) in (None, Status.Failed):
+                yield event('error', {'status': f'fatal error processing job(id): {job_id}'})
+                return
+
+            manifest = await storage.load_job_manifest_from_db(job_id)
+            yield event('progress', {
+                'status': f'{status.value}',
+                **shards_progress(status, timeline),
+                'manifest': {
+                    m.stage: {'num_artifacts': m.num_artifacts, 'num_bytes': m.num_bytes}
+                    for m in manifest
+                }
+            })
+
+            if status == Status.Finished:
+                return
+
+# the shards of the current status ( in streaming mode the job
+# only moves on once all of its shards have left that status )
+def shards_progress(status: Status, timeline: list[TimelineEntry]) -> dict[str, int]:
+    entries = [entry for entry in timeline if entry.status == status]
+    finished = {entry.index for entry in entries if entry.event == Event.Finished}
+    return {
+        'num_shards': max((entry.num_shards for entry in entries), default=1),
+        'num_finished_shards': len(finished)
+    }
+
+def event(name: str, content: dict) -> str:
+    return f'event: {name}\ndata: {json.dumps(content)}\n\n'
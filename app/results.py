@@ -7,7 +7,14 @@ from coordinator.interface import Coordinator, Status
 
 async def run(coordinator: Coordinator, storage: Storage, job_id: str) -> dict | JSONResponse:
 
-    if coordinator.get_status(job_id) != Status.Finished:
+    status = coordinator.get_status(job_id)
+    if status == Status.Failed:
+        return JSONResponse(
+            status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR,
+            content={'detail': f'fatal error processing job(id): {job_id}'}
+        )
+
+    if status != Status.Finished:
         return JSONResponse(
             status_code=http.HTTPStatus.ACCEPTED,
             content={'detail': 'results are not ready yet ... stay tuned !'}
@@ -1,8 +1,17 @@
-from coordinator.interface import Coordinator
+from storage.interface import Storage
+from coordinator.interface import Coordinator, Status
 
-async def run(coordinator: Coordinator, job_id: str) -> dict:
+async def run(coordinator: Coordinator, storage: Storage, job_id: str) -> dict:
 
-    if status := coordinator.get_status(job_id):
-        return {'status': f'{status.value}'}
+    status = coordinator.get_status(job_id)
+    if status is not None and status != Status.Failed:
+        manifest = await storage.load_job_manifest_from_db(job_id)
+        return {
+            'status': f'{status.value}',
+            'manifest': {
+                m.stage: {'num_artifacts': m.num_artifacts, 'num_bytes': m.num_bytes}
+                for m in manifest
+            }
+        }
 
     return {'status': f'fatal error processing job(id): {job_id}'}
@@ -0,0 +1,130 @@
+import http
+import typing
+import aiohttp
+
+from storage.interface import Storage
+from coordinator.interface import Coordinator, Event, Status, TimelineEntry
+
+LOGGER_JOB_METRICS_URL: typing.Final[str] = 'http://logger_server:8000/metrics/jobs'
+NUM_SECONDS_TO_WAIT_FOR_LOGGER: typing.Final[float] = 2.0
+
+# the artifacts every stage produces ( job manifest ), and the
+# contexts its workers log for every file they process
+STAGES: typing.Final[dict[Status, tuple[typing.Optional[str], typing.Optional[str]]]] = {
+    Status.WaitingForNativeParsing: ('native_asts', 'NATIVE_PARSING'),
+    Status.WaitingForDhscannerParsing: ('dhscanner_asts', 'DHSCANNER_PARSING'),
+    Status.WaitingForCodegen: ('callables', 'CODEGEN'),
+    Status.WaitingForKbgen: ('knowledge_base_facts', 'KBGEN'),
+    Status.WaitingForQueryengine: ('results', 'QUERYENGINE'),
+    Status.WaitingForResultsGeneration: (None, None),
+}
+
+MAX_NUM_SLOWEST_FILES: typing.Final[int] = 5
+
+async def run(coordinator: Coordinator, storage: Storage, job_id: str) -> dict:
+
+    status = coordinator.get_status(job_id)
+    timeline = coordinator.get_timeline(job_id)
+    if status is None or not timeline:
+        return {'status': f'fatal error processing job(id): {job_id}'}
+
+    manifest = {m.stage: m for m in await storage.load_job_manifest_from_db(job_id)}
+    logged = await load_job_metrics_from_logger(job_id)
+
+    stages = []
+    for stage_status, (artifacts, context_prefix) in STAGES.items():
+        entries = [entry for entry in timeline if entry.status == stage_status]
+        if not entries:
+            continue
+
+        stage = summarize(stage_status, entries)
+        if artifacts is not None and artifacts in manifest:
+            stage['num_artifacts'] = manifest[artifacts].num_artifacts
+            stage['num_bytes'] = manifest[artifacts].num_bytes
+        if logged is not None and context_prefix is not None:
+            stage.update(summarize_logged_files(logged, context_prefix))
+        stages.append(stage)
+
+    started_at = min(entry.at for entry in timeline)
+    finished_at = max((entry.at for entry in timeline if entry.status == Status.Finished), default=None)
+
+    return {
+        'status': f'{status.value}',
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'total_seconds': None if finished_at is None else finished_at - started_at,
+        'queue_wait_seconds': sum(stage['queue_wait_seconds'] for stage in stages),
+        'active_seconds': sum(stage['active_seconds'] for stage in stages),
+        'stages': stages
+    }
+
+# - queue wait: from entering the queue until the first shard was claimed
+# - active: from the first claimed shard until the last finished one
+# - busy: the sum of the times every shard was held by a worker
+#   ( larger than the active time when shards run side by side )
+def summarize(status: Status, entries: list[TimelineEntry]) -> dict[str, typing.Any]:
+
+    entered = [entry.at for entry in entries if entry.event == Event.Entered]
+    claimed = [entry for entry in entries if entry.event == Event.Claimed]
+    finished = [entry for entry in entries if entry.event == Event.Finished]
+
+    entered_at = min(entered, default=None)
+    first_claimed_at = min((entry.at for entry in claimed), default=None)
+    last_finished_at = max((entry.at for entry in finished), default=None)
+
+    # a re-claimed shard is busy from its last claim
+    last_claim_of: dict[typing.Optional[int], float] = {}
+    busy_seconds = 0.0
+    for entry in sorted(claimed + finished, key=lambda entry: entry.at):
+        if entry.event == Event.Claimed:
+            last_claim_of[entry.index] = entry.at
+        elif (claimed_at := last_claim_of.pop(entry.index, None)) is not None:
+            busy_seconds += entry.at - claimed_at
+
+    queue_wait_seconds = 0.0
+    if entered_at is not None and first_claimed_at is not None:
+        queue_wait_seconds = max(0.0, first_claimed_at - entered_at)
+
+    active_seconds = 0.0
+    if first_claimed_at is not None and last_finished_at is not None:
+        active_seconds = max(0.0, last_finished_at - first_claimed_at)
+
+    return {
+        'stage': f'{status.value}',
+        'entered_at': entered_at,
+        'finished_at': last_finished_at,
+        'num_shards': max(entry.num_shards for entry in entries),
+        'num_reclaimed_shards': len(claimed) - len({entry.index for entry in claimed}),
+        'queue_wait_seconds': queue_wait_seconds,
+        'active_seconds': active_seconds,
+        'busy_seconds': busy_seconds
+    }
+
+def summarize_logged_files(logged: dict, context_prefix: str) -> dict[str, typing.Any]:
+
+    num_files = 0
+    slowest_files: list[dict] = []
+    for stage in logged.get('stages', []):
+        if stage.get('context', '').startswith(context_prefix):
+            num_files += stage.get('count', 0)
+            slowest_files.extend(stage.get('slowest_files', []))
+
+    slowest_files.sort(key=lambda f: f.get('seconds', 0), reverse=True)
+    return {
+        'num_files': num_files,
+        'slowest_files': slowest_files[:MAX_NUM_SLOWEST_FILES]
+    }
+
+# per file durations are aggregated by the logger server,
+# the timeline is still returned when it is unreachable
+async def load_job_metrics_from_logger(job_id: str) -> typing.Optional[dict]:
+    try:
+        timeout = aiohttp.ClientTimeout(total=NUM_SECONDS_TO_WAIT_FOR_LOGGER)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(f'{LOGGER_JOB_METRICS_URL}/{job_id}') as response:
+                if response.status == http.HTTPStatus.OK:
+                    return await response.json()
+    except (aiohttp.ClientError, TimeoutError):
+        pass
+
+    return None
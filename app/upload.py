@@ -1,3 +1,5 @@
+import os
+import http
 import json
 import typing
 import fastapi
@@ -5,26 +7,44 @@ import fastapi
 from datetime import timedelta
 
 from logger.client import Logger
+from common import compression
 from common.language import Language
 from storage.interface import Storage
+from storage.archive import ArchiveFormat, Manifest, is_valid_path_mappings
 from logger.models import Context, LogMessage
 
+# bounds both the received manifest, and what it decompresses into
+MAX_NUM_MANIFEST_BYTES: typing.Final[int] = int(os.getenv('MAX_NUM_MANIFEST_BYTES', str(64 * 1024 ** 2)))
+
+# bound what uploaded files ( and archives ) decompress into
+MAX_NUM_UPLOADED_FILE_BYTES: typing.Final[int] = int(os.getenv('MAX_NUM_UPLOADED_FILE_BYTES', str(256 * 1024 ** 2)))
+MAX_NUM_UPLOADED_ARCHIVE_BYTES: typing.Final[int] = int(os.getenv('MAX_NUM_UPLOADED_ARCHIVE_BYTES', str(8 * 1024 ** 3)))
+
 async def get_actual_file_content(request: fastapi.Request) -> typing.AsyncIterator[bytes]:
     return request.stream()
 
-def is_valid_path_mappings(candidate: typing.Any) -> bool:
-    if not isinstance(candidate, list):
-        return False
+# bodies may be compressed ( Content-Encoding: zstd | gzip ),
+# and are decompressed while they are received
+def content_encoding_of(request: fastapi.Request) -> typing.Optional[compression.Encoding]:
+    return compression.Encoding.from_raw_string(request.headers.get('Content-Encoding'))
+
+def unsupported_content_encoding(request: fastapi.Request) -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        status_code=http.HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+        content={'detail': f'unsupported content encoding: {request.headers.get("Content-Encoding")}'}
+    )
 
-    for item in candidate:
-        if not isinstance(item, dict):
-            return False
-        if set(item.keys()) != {'from', 'to'}:
-            return False
-        if not isinstance(item['from'], str) or not isinstance(item['to'], str):
-            return False
+def undecodable_content(request: fastapi.Request) -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        status_code=http.HTTPStatus.BAD_REQUEST,
+        content={'detail': f'could not decode the {request.headers.get("Content-Encoding")} request body'}
+    )
 
-    return True
+def too_large_content(max_num_bytes: int) -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        status_code=http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        content={'detail': f'request body exceeds {max_num_bytes} bytes ( once decompressed )'}
+    )
 
 async def run(
     request: fastapi.Request,
@@ -32,7 +52,12 @@ async def run(
     job_id: str,
     filename: str,
     logger: Logger
-) -> dict:
+) -> dict | fastapi.responses.JSONResponse:
+
+    try:
+        encoding = content_encoding_of(request)
+    except ValueError:
+        return unsupported_content_encoding(request)
 
     language = Language.from_filename(filename)
     if language is None:
@@ -61,6 +86,98 @@ async def run(
         except json.JSONDecodeError:
             path_mappings = None
 
-    content = await get_actual_file_content(request)
-    await storage.save_file(content, filename, job_id, gomod, github_url, path_mappings)
+    content = compression.decompressed(await get_actual_file_content(request), encoding, MAX_NUM_UPLOADED_FILE_BYTES)
+    try:
+        await storage.save_file(content, filename, job_id, gomod, github_url, path_mappings)
+    except compression.UNREADABLE_ENCODING_ERRORS:
+        return undecodable_content(request)
+    except compression.TooLargeContent:
+        return too_large_content(MAX_NUM_UPLOADED_FILE_BYTES)
+
     return {'status': 'ok', 'original_upload_filename': filename}
+
+# an entire repository in one request: a ( possibly compressed ) tar or zip,
+# whose optional manifest member replaces the headers of per file uploads
+async def run_archive(
+    request: fastapi.Request,
+    storage: Storage,
+    job_id: str,
+    raw_archive_format: str
+) -> dict | fastapi.responses.JSONResponse:
+
+    try:
+        encoding = content_encoding_of(request)
+    except ValueError:
+        return unsupported_content_encoding(request)
+
+    archive_format = ArchiveFormat.from_raw_string(raw_archive_format)
+    if archive_format is None:
+        return fastapi.responses.JSONResponse(
+            status_code=http.HTTPStatus.BAD_REQUEST,
+            content={'detail': f'unsupported archive format: {raw_archive_format}'}
+        )
+
+    content = compression.decompressed(await get_actual_file_content(request), encoding, MAX_NUM_UPLOADED_ARCHIVE_BYTES)
+    try:
+        saved_and_skipped = await storage.save_files_from_archive(content, archive_format, job_id)
+    except compression.UNREADABLE_ENCODING_ERRORS:
+        return undecodable_content(request)
+    except compression.TooLargeContent:
+        return too_large_content(MAX_NUM_UPLOADED_ARCHIVE_BYTES)
+
+    if saved_and_skipped:
+        num_saved, num_skipped = saved_and_skipped
+        return {'status': 'ok', 'num_saved_files': num_saved, 'num_skipped_files': num_skipped}
+
+    return fastapi.responses.JSONResponse(
+        status_code=http.HTTPStatus.UNPROCESSABLE_ENTITY,
+        content={'detail': f'could not read the uploaded {archive_format.value} archive'}
+    )
+
+# incremental uploads: the sha256 of every file ( with the archive manifest
+# fields ), answered with the files that changed since the base job
+async def run_manifest(
+    request: fastapi.Request,
+    storage: Storage,
+    job_id: str,
+    base_job_id: str
+) -> dict | fastapi.responses.JSONResponse:
+
+    try:
+        encoding = content_encoding_of(request)
+    except ValueError:
+        return unsupported_content_encoding(request)
+
+    body = await read_at_most(request, MAX_NUM_MANIFEST_BYTES)
+    try:
+        if body is not None and encoding is not None:
+            body = encoding.decompress_at_most(body, MAX_NUM_MANIFEST_BYTES)
+        if body is None:
+            return too_large_manifest()
+        content = json.loads(body)
+    except compression.UNREADABLE_ENCODING_ERRORS:
+        return undecodable_content(request)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return fastapi.responses.JSONResponse(
+            status_code=http.HTTPStatus.BAD_REQUEST,
+            content={'detail': 'invalid upload manifest'}
+        )
+
+    manifest = Manifest.fromjson(content)
+    num_reused, missing = await storage.save_files_by_content_hash(manifest, job_id, base_job_id)
+    return {'status': 'ok', 'num_reused_files': num_reused, 'missing': missing}
+
+# returns none once the body exceeds the bound ( the rest is never read )
+async def read_at_most(request: fastapi.Request, max_num_bytes: int) -> typing.Optional[bytes]:
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > max_num_bytes:
+            return None
+    return bytes(body)
+
+def too_large_manifest() -> fastapi.responses.JSONResponse:
+    return fastapi.responses.JSONResponse(
+        status_code=http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        content={'detail': f'upload manifest exceeds {MAX_NUM_MANIFEST_BYTES} bytes'}
+    )
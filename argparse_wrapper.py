@@ -33,6 +33,21 @@ CLI_WITH_AGENT: typing.Final[str] = """
 use an LLM agent for adaptive query planning
 """
 
+CLI_STREAMING: typing.Final[str] = """
+move every part of the scan to the next stage as soon as it is done
+( overlaps the analysis stages, faster on large repositories )
+"""
+
+CLI_UPLOAD_FILE_BY_FILE: typing.Final[str] = """
+upload every file with its own request, instead of a single archive
+( for servers without archive uploads )
+"""
+
+CLI_BASE_JOB_ID: typing.Final[str] = """
+rescan relative to an earlier scan of the same repository:
+only the files that changed since then are uploaded and analyzed again
+"""
+
 EXPLORE_WITH_AGENT_PROG_DESC: typing.Final[str] = """
 
 simple dev script to run kb api queries
@@ -111,6 +126,7 @@ def non_empty_kb_filename(kb_filename: str) -> str:
     return kb_filename
 
 
+# pylint: disable=too-many-instance-attributes
 @dataclasses.dataclass(frozen=True, kw_only=True)
 class CliArgparse:
     scan_dirname: pathlib.Path
@@ -118,6 +134,9 @@ class CliArgparse:
     save_sarif_to: typing.Optional[pathlib.Path]
     use_external_vps: typing.Optional[str]
     with_agent: bool
+    streaming: bool
+    upload_file_by_file: bool
+    base_job_id: typing.Optional[str]
 
     @staticmethod
     def run() -> CliArgparse:
@@ -163,6 +182,29 @@ class CliArgparse:
             help=CLI_WITH_AGENT,
         )
 
+        parser.add_argument(
+            '--streaming',
+            required=False,
+            default=False,
+            action='store_true',
+            help=CLI_STREAMING,
+        )
+
+        parser.add_argument(
+            '--upload_file_by_file',
+            required=False,
+            default=False,
+            action='store_true',
+            help=CLI_UPLOAD_FILE_BY_FILE,
+        )
+
+        parser.add_argument(
+            '--base_job_id',
+            required=False,
+            metavar='job id of an earlier scan',
+            help=CLI_BASE_JOB_ID,
+        )
+
         parsed_args = parser.parse_args()
 
         return CliArgparse(
@@ -171,6 +213,9 @@ class CliArgparse:
             save_sarif_to=parsed_args.save_sarif_to,
             use_external_vps=parsed_args.use_external_vps,
             with_agent=parsed_args.with_agent,
+            streaming=parsed_args.streaming,
+            upload_file_by_file=parsed_args.upload_file_by_file,
+            base_job_id=parsed_args.base_job_id,
         )
 
 
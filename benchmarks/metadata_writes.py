@@ -0,0 +1,89 @@
+import time
+import uuid
+import typing
+import asyncio
+import pathlib
+import argparse
+import tempfile
+import sqlalchemy
+
+from sqlalchemy.orm import sessionmaker
+
+from storage import db
+from storage import models
+from common.language import Language
+from storage.metadata_buffer import MetadataBuffer
+
+BENCHMARK_PROG_DESC: typing.Final[str] = """
+artifacts per second recorded in the metadata db:
+one transaction per artifact vs. write-behind bulk inserts
+"""
+
+BENCHMARK_METADATA_DB_URL_HELP: typing.Final[str] = """
+( e.g. a local postgres server ) defaults to a scratch sqlite file
+"""
+
+DEFAULT_NUM_ARTIFACTS: typing.Final[int] = 5000
+
+def mk_session_factory(metadata_db_url: str) -> sessionmaker:
+    engine = db.create_engine(metadata_db_url)
+    models.Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+def mk_native_ast_metadata(job_id: str) -> models.NativeAstMetadata:
+    return models.NativeAstMetadata(
+        native_ast_unique_id=f'{uuid.uuid4()}.py.native.ast',
+        job_id=job_id,
+        original_filename='some/dir/file.py',
+        language=Language.PY
+    )
+
+async def one_transaction_per_artifact(session_factory: sessionmaker, rows: list[models.Base]) -> None:
+
+    async def write(row: models.Base) -> None:
+        with session_factory() as session:
+            session.add(row)
+            session.commit()
+
+    await asyncio.gather(*[write(row) for row in rows])
+
+async def write_behind(session_factory: sessionmaker, rows: list[models.Base]) -> None:
+    buffer = MetadataBuffer(session_factory=session_factory)
+    await asyncio.gather(*[buffer.add(row) for row in rows])
+    await buffer.flush()
+
+async def measure(
+    name: str,
+    strategy: typing.Callable[[sessionmaker, list[models.Base]], typing.Awaitable[None]],
+    num_artifacts: int,
+    metadata_db_url: typing.Optional[str]
+) -> float:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scratch_db_url = f'sqlite:///{pathlib.Path(tmpdir) / "dhscanner.db"}'
+        session_factory = mk_session_factory(metadata_db_url or scratch_db_url)
+        job_id = uuid.uuid4().hex
+        rows: list[models.Base] = [mk_native_ast_metadata(job_id) for _ in range(num_artifacts)]
+        start = time.monotonic()
+        await strategy(session_factory, rows)
+        delta = time.monotonic() - start
+
+        with session_factory() as session:
+            condition_is_satisfied = models.NativeAstMetadata.job_id == job_id
+            stmt = sqlalchemy.select(sqlalchemy.func.count()).select_from(models.NativeAstMetadata).where(condition_is_satisfied)
+            assert session.execute(stmt).scalar_one() == num_artifacts
+
+    artifacts_per_second = num_artifacts / delta
+    print(f'{name:<32} {artifacts_per_second:>10.0f} artifacts/sec')
+    return artifacts_per_second
+
+async def main(num_artifacts: int, metadata_db_url: typing.Optional[str]) -> None:
+    before = await measure('one transaction per artifact', one_transaction_per_artifact, num_artifacts, metadata_db_url)
+    after = await measure('write-behind bulk inserts', write_behind, num_artifacts, metadata_db_url)
+    print(f'speedup: x{after / before:.1f}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=BENCHMARK_PROG_DESC)
+    parser.add_argument('--num_artifacts', type=int, default=DEFAULT_NUM_ARTIFACTS)
+    parser.add_argument('--metadata_db_url', required=False, help=BENCHMARK_METADATA_DB_URL_HELP)
+    parsed_args = parser.parse_args()
+    asyncio.run(main(parsed_args.num_artifacts, parsed_args.metadata_db_url))
@@ -3,17 +3,22 @@ from __future__ import annotations
 import os
 import sys
 import http
-import math
+import io
 import json
+import random
+import hashlib
 import time
 import typing
+import dataclasses
 import pathlib
+import tarfile
 import asyncio
 import subprocess
 import logging
 import aiofiles
 import aiohttp
 import requests
+import zstandard
 from argparse_wrapper import CliArgparse as Argparse
 
 LOCALHOST: typing.Final[str] = 'http://localhost'
@@ -24,10 +29,40 @@ SUFFIXES: typing.Final[set[str]] = {
 }
 
 MAX_ATTEMPTS_CONNECTING_TO_SERVER = 10
-UPLOAD_BATCH_SIZE = 100
-MAX_NUM_CHECKS = 200
 NUM_SECONDS_BETEEN_STEP_CHECK = 5
 
+# the progress stream ends with an error event once the job has failed,
+# older servers are polled, and a job that never finishes there fails the scan eventually
+MAX_NUM_SECONDS_PER_SCAN: typing.Final[float] = float(os.getenv('DHSCANNER_MAX_NUM_SECONDS_PER_SCAN', str(3 * 60 * 60)))
+
+# the server pushes every change of the job, and a heartbeat at least every
+# 15 seconds, so a silent connection is a dead one ( and is reconnected )
+NUM_SECONDS_TO_CONNECT_FOR_PROGRESS: typing.Final[float] = 10
+NUM_SECONDS_TO_WAIT_FOR_PROGRESS: typing.Final[float] = 60
+NUM_SECONDS_BETWEEN_PROGRESS_RECONNECTS: typing.Final[float] = 2
+MAX_NUM_CONSECUTIVE_PROGRESS_RECONNECTS: typing.Final[int] = 10
+
+# the entire repository travels as one streamed tar.zst, whose first
+# member carries what per file uploads send as headers
+ARCHIVE_FORMAT: typing.Final[str] = 'tar.zst'
+ARCHIVE_MANIFEST_MEMBER_NAME: typing.Final[str] = '.dhscanner.manifest.json'
+NUM_ARCHIVE_PROGRESS_REPORTS: typing.Final[int] = 10
+
+# file by file uploads: a sliding window of requests over a single
+# keep-alive session, where transient failures are retried with backoff
+MAX_NUM_UPLOADS_IN_FLIGHT: typing.Final[int] = 32
+MAX_NUM_UPLOAD_ATTEMPTS: typing.Final[int] = 5
+NUM_SECONDS_OF_FIRST_UPLOAD_BACKOFF: typing.Final[float] = 0.5
+NUM_SECONDS_PER_UPLOAD_ATTEMPT: typing.Final[float] = 300
+NUM_SECONDS_TO_KEEP_CONNECTIONS_ALIVE: typing.Final[float] = 60
+NUM_SECONDS_BETWEEN_UPLOAD_PROGRESS_REPORTS: typing.Final[float] = 2
+TRANSIENT_HTTP_STATUSES: typing.Final[set[int]] = {
+    http.HTTPStatus.TOO_MANY_REQUESTS,
+    http.HTTPStatus.BAD_GATEWAY,
+    http.HTTPStatus.SERVICE_UNAVAILABLE,
+    http.HTTPStatus.GATEWAY_TIMEOUT
+}
+
 HTTPS_PORT: typing.Final[int] = 443
 HTTPS_PREFIX: typing.Final[str] = 'https://'
 DOT_GIT_SUFFIX: typing.Final[str] = '.git'
@@ -308,6 +343,7 @@ async def check_response(response: aiohttp.ClientResponse, filename: str) -> boo
 
     return False
 
+# the file is streamed again on every attempt
 # pylint: disable=too-many-arguments,too-many-positional-arguments
 async def actual_upload(
     session: aiohttp.ClientSession,
@@ -318,12 +354,27 @@ async def actual_upload(
     f: pathlib.Path,
 ) -> bool:
 
-    try:
-        async with aiofiles.open(scan_dirname / f, 'rb') as content:
-            async with session.post(url, params=params, headers=headers, data=content) as response:
-                return await check_response(response, f.name)
-    except FileNotFoundError:
-        return False
+    for attempt in range(MAX_NUM_UPLOAD_ATTEMPTS):
+        try:
+            async with aiofiles.open(scan_dirname / f, 'rb') as content:
+                async with session.post(url, params=params, headers=headers, data=content) as response:
+                    if response.status not in TRANSIENT_HTTP_STATUSES:
+                        return await check_response(response, f.name)
+                    logging.warning('upload of %s got http status %s ( attempt %s )', f, response.status, attempt + 1)
+        except FileNotFoundError:
+            return False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning('upload of %s failed ( attempt %s ): %r', f, attempt + 1, e)
+
+        if attempt + 1 < MAX_NUM_UPLOAD_ATTEMPTS:
+            await asyncio.sleep(upload_backoff(attempt))
+
+    logging.error('upload failed for %s ( gave up after %s attempts )', f, MAX_NUM_UPLOAD_ATTEMPTS)
+    return False
+
+# exponential, with jitter ( so retries of concurrent uploads spread out )
+def upload_backoff(attempt: int) -> float:
+    return NUM_SECONDS_OF_FIRST_UPLOAD_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
 
 async def upload_single_file(
     session: aiohttp.ClientSession,
@@ -388,15 +439,67 @@ def get_path_mappings_header(
         return None
     return json.dumps(mappings)
 
-def create_upload_tasks(
-    session: aiohttp.ClientSession,
-    job_id: str,
+@dataclasses.dataclass
+class UploadProgress:
+
+    num_files: int
+    num_bytes: int
+    num_uploaded_files: int = 0
+    num_uploaded_bytes: int = 0
+    num_failed_files: int = 0
+    started_at: float = dataclasses.field(default_factory=time.monotonic)
+    reported_at: float = dataclasses.field(default_factory=time.monotonic)
+
+    @staticmethod
+    def of(scan_dirname: pathlib.Path, files: list[pathlib.Path]) -> UploadProgress:
+        num_bytes = sum(upload_size_of(scan_dirname, f) for f in files)
+        return UploadProgress(num_files=len(files), num_bytes=num_bytes)
+
+    def add(self, num_bytes: int, uploaded: bool) -> None:
+        if uploaded:
+            self.num_uploaded_files += 1
+            self.num_uploaded_bytes += num_bytes
+        else:
+            self.num_failed_files += 1
+
+        now = time.monotonic()
+        done = self.num_uploaded_files + self.num_failed_files == self.num_files
+        if done or now - self.reported_at >= NUM_SECONDS_BETWEEN_UPLOAD_PROGRESS_REPORTS:
+            self.reported_at = now
+            self.report(now - self.started_at)
+
+    def report(self, seconds: float) -> None:
+        percent = '%'
+        bytes_per_second = self.num_uploaded_bytes / seconds if seconds > 0 else 0.0
+        remaining_bytes = self.num_bytes - self.num_uploaded_bytes
+        eta = f'{remaining_bytes / bytes_per_second:.0f}s' if bytes_per_second > 0 else '?'
+        logging.info(
+            '[ step 3 ] uploaded %s/%s files ( %s%s ), %.2f MiB/s, eta %s',
+            self.num_uploaded_files,
+            self.num_files,
+            (100 * self.num_uploaded_files) // max(1, self.num_files),
+            percent,
+            bytes_per_second / (1024 * 1024),
+            eta
+        )
+
+def upload_size_of(scan_dirname: pathlib.Path, f: pathlib.Path) -> int:
+    try:
+        return (scan_dirname / f).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+# a fixed number of uploaders pull the next file as soon as they are
+# done with the previous one, so a slow file never holds back the rest
+# pylint: disable=too-many-locals
+async def upload(
     scan_dirname: pathlib.Path,
     files: list[pathlib.Path],
+    job_id: str,
     APPROVED_URL: str,
     BEARER_TOKEN: str,
     parsed_args: Argparse
-) -> list:
+) -> bool:
 
     module_name: typing.Optional[str] = None
     github_url = extract_github_url_from(scan_dirname)
@@ -406,25 +509,154 @@ def create_upload_tasks(
             break
 
     file_mappings = resolve_file_mappings(scan_dirname, files)
+    progress = UploadProgress.of(scan_dirname, files)
+    pending = iter(files)
 
-    return [
-        upload_single_file(
-            session,
-            job_id,
-            scan_dirname,
-            f,
-            APPROVED_URL,
-            BEARER_TOKEN,
-            module_name,
-            github_url,
-            get_path_mappings_header(file_mappings, f),
-            parsed_args
-        )
-        for f in files
-    ]
+    async def uploader(session: aiohttp.ClientSession) -> None:
+        for f in pending:
+            uploaded = await upload_single_file(
+                session,
+                job_id,
+                scan_dirname,
+                f,
+                APPROVED_URL,
+                BEARER_TOKEN,
+                module_name,
+                github_url,
+                get_path_mappings_header(file_mappings, f),
+                parsed_args
+            )
+            progress.add(upload_size_of(scan_dirname, f), uploaded)
 
-# pylint: disable=too-many-locals
-async def upload(
+    connector = aiohttp.TCPConnector(
+        limit=MAX_NUM_UPLOADS_IN_FLIGHT,
+        keepalive_timeout=NUM_SECONDS_TO_KEEP_CONNECTIONS_ALIVE
+    )
+    timeout = aiohttp.ClientTimeout(total=NUM_SECONDS_PER_UPLOAD_ATTEMPT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        num_uploaders = min(MAX_NUM_UPLOADS_IN_FLIGHT, len(files))
+        await asyncio.gather(*[uploader(session) for _ in range(num_uploaders)])
+
+    return progress.num_failed_files == 0
+
+def upload_archive_url(APPROVED_URL: str, parsed_args: Argparse) -> str:
+    return f'{upload_url(APPROVED_URL, parsed_args)}/archive'
+
+def upload_archive_headers(BEARER_TOKEN: str) -> dict:
+    return {
+        'Authorization': f'Bearer {BEARER_TOKEN}',
+        'Content-Type': 'application/octet-stream'
+    }
+
+def manifest_of(scan_dirname: pathlib.Path, files: list[pathlib.Path]) -> dict:
+
+    module_name: typing.Optional[str] = None
+    for f in files:
+        if f.name == 'go.mod':
+            module_name = extract_module_name_from(scan_dirname / f)
+            break
+
+    return {
+        'gomod': module_name,
+        'github_url': extract_github_url_from(scan_dirname),
+        'path_mappings': resolve_file_mappings(scan_dirname, files)
+    }
+
+def archive_manifest(scan_dirname: pathlib.Path, files: list[pathlib.Path]) -> bytes:
+    return json.dumps(manifest_of(scan_dirname, files)).encode('utf-8')
+
+# compressed tar chunks, produced while the archive is being sent:
+# the manifest covers all the files, even when only some are uploaded
+def archive_chunks(
+    scan_dirname: pathlib.Path,
+    files: list[pathlib.Path],
+    uploaded: list[pathlib.Path]
+) -> typing.Iterator[bytes]:
+
+    percent = '%'
+    buffer = io.BytesIO()
+    compressed = zstandard.ZstdCompressor().stream_writer(buffer, closefd=False)
+    with tarfile.open(fileobj=compressed, mode='w|') as tar:
+        manifest = archive_manifest(scan_dirname, files)
+        info = tarfile.TarInfo(ARCHIVE_MANIFEST_MEMBER_NAME)
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+
+        n = len(uploaded)
+        report_every = max(1, n // NUM_ARCHIVE_PROGRESS_REPORTS)
+        for i, f in enumerate(uploaded, start=1):
+            try:
+                tar.add(scan_dirname / f, arcname=f.as_posix(), recursive=False)
+            except FileNotFoundError:
+                logging.warning('[ step 3 ] file disappeared: %s', f)
+
+            if i % report_every == 0 or i == n:
+                logging.info('[ step 3 ] uploaded %s%s', (100 * i) // n, percent)
+
+            if chunk := buffer.getvalue():
+                buffer.seek(0)
+                buffer.truncate()
+                yield chunk
+
+    compressed.close()
+    if chunk := buffer.getvalue():
+        yield chunk
+
+def upload_manifest_url(APPROVED_URL: str, parsed_args: Argparse) -> str:
+    return f'{upload_url(APPROVED_URL, parsed_args)}/manifest'
+
+# hashes of large repositories compress well
+def upload_manifest_headers(BEARER_TOKEN: str) -> dict:
+    return {
+        'Authorization': f'Bearer {BEARER_TOKEN}',
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'zstd'
+    }
+
+def content_hashes(scan_dirname: pathlib.Path, files: list[pathlib.Path]) -> dict[str, str]:
+    hashes: dict[str, str] = {}
+    for f in files:
+        try:
+            with open(scan_dirname / f, 'rb') as fl:
+                hashes[f.as_posix()] = hashlib.file_digest(fl, 'sha256').hexdigest()
+        except FileNotFoundError:
+            logging.warning('[ step 3 ] file disappeared: %s', f)
+    return hashes
+
+# incremental uploads: the server registers every file that did not
+# change since the base job ( an earlier scan ), and only the rest is uploaded
+# pylint: disable=too-many-arguments, too-many-positional-arguments
+def files_missing_on_server(
+    scan_dirname: pathlib.Path,
+    files: list[pathlib.Path],
+    job_id: str,
+    base_job_id: str,
+    APPROVED_URL: str,
+    BEARER_TOKEN: str,
+    parsed_args: Argparse
+) -> list[pathlib.Path]:
+
+    params = {'job_id': job_id, 'base_job_id': base_job_id}
+    url = upload_manifest_url(APPROVED_URL, parsed_args)
+    headers = upload_manifest_headers(BEARER_TOKEN)
+    body = {**manifest_of(scan_dirname, files), 'content_hashes': content_hashes(scan_dirname, files)}
+    data = zstandard.ZstdCompressor().compress(json.dumps(body).encode('utf-8'))
+    with requests.post(url, params=params, headers=headers, data=data) as response:
+        if response.status_code == http.HTTPStatus.OK:
+            try:
+                content = response.json()
+                missing = content.get('missing')
+                if isinstance(missing, list):
+                    logging.info('[ step 3 ] %s files did not change since the base job', content.get('num_reused_files'))
+                    return [pathlib.Path(m) for m in missing if isinstance(m, str)]
+            except json.JSONDecodeError:
+                pass
+
+    # older servers: everything is uploaded
+    logging.info('[ step 3 ] incremental upload not available ( http status %s )', response.status_code)
+    return files
+
+def upload_archive(
     scan_dirname: pathlib.Path,
     files: list[pathlib.Path],
     job_id: str,
@@ -433,29 +665,39 @@ async def upload(
     parsed_args: Argparse
 ) -> bool:
 
-    n = len(files)
-    percent = '%'
-    batches = math.ceil(n / UPLOAD_BATCH_SIZE)
-    percentage_for_1_batch = math.floor(100 / batches)
-    for i in range(batches):
-        start = i * UPLOAD_BATCH_SIZE
-        end = (i + 1) * UPLOAD_BATCH_SIZE
-        async with aiohttp.ClientSession() as session:
-            results = await asyncio.gather(
-                *create_upload_tasks(
-                    session,
-                    job_id,
-                    scan_dirname,
-                    files[start:end],
-                    APPROVED_URL,
-                    BEARER_TOKEN,
-                    parsed_args
-                )
+    uploaded = files
+    if base_job_id := parsed_args.base_job_id:
+        uploaded = files_missing_on_server(scan_dirname, files, job_id, base_job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)
+    if not uploaded:
+        logging.info('[ step 3 ] nothing changed since the base job')
+        return True
+
+    params = {'job_id': job_id, 'archive_format': ARCHIVE_FORMAT}
+    url = upload_archive_url(APPROVED_URL, parsed_args)
+    headers = upload_archive_headers(BEARER_TOKEN)
+    data = archive_chunks(scan_dirname, files, uploaded)
+    with requests.post(url, params=params, headers=headers, data=data) as response:
+        if response.status_code in (http.HTTPStatus.NOT_FOUND, http.HTTPStatus.METHOD_NOT_ALLOWED):
+            # older servers: one request per file
+            logging.info('[ step 3 ] archive upload not available ( http status %s )', response.status_code)
+            return asyncio.run(upload(scan_dirname, uploaded, job_id, APPROVED_URL, BEARER_TOKEN, parsed_args))
+
+        if response.status_code != http.HTTPStatus.OK:
+            logging.error('archive upload failed: http status %s', response.status_code)
+            return False
+
+        try:
+            content = response.json()
+            logging.info(
+                '[ step 3 ] server saved %s files ( skipped %s )',
+                content.get('num_saved_files'),
+                content.get('num_skipped_files')
             )
-        overall_percentage = min(100, (i + 1) * percentage_for_1_batch)
-        logging.info('[ step 3 ] uploaded %s%s', overall_percentage, percent)
+            return content.get('status') == 'ok'
+        except json.JSONDecodeError:
+            logging.error('invalid archive upload response')
 
-    return all(results)
+    return False
 
 def analyze_url(APPROVED_URL: str, parsed_args: Argparse) -> str:
     host = parsed_args.use_external_vps if parsed_args.use_external_vps is not None else LOCALHOST
@@ -463,7 +705,11 @@ def analyze_url(APPROVED_URL: str, parsed_args: Argparse) -> str:
     return f'{host}:{port}/api/{APPROVED_URL}/analyze'
 
 def analyze(job_id: str, APPROVED_URL: str, APPROVED_BEARER_TOKEN: str, parsed_args: Argparse, directories: list[str], filenames: list[str]) -> bool:
-    params = {'job_id': job_id, 'agent_mode': str(parsed_args.with_agent).lower()}
+    params = {
+        'job_id': job_id,
+        'agent_mode': str(parsed_args.with_agent).lower(),
+        'streaming': str(parsed_args.streaming).lower()
+    }
     url = analyze_url(APPROVED_URL, parsed_args)
     headers = analyze_headers(APPROVED_BEARER_TOKEN)
     body = { 'directories': directories, 'filenames': filenames }
@@ -492,6 +738,125 @@ def check(job_id: str, APPROVED_URL: str, APPROVED_BEARER_TOKEN: str, parsed_arg
 
         return 'invalid status response'
 
+def progress_url(APPROVED_URL, parsed_args: Argparse) -> str:
+    host = parsed_args.use_external_vps if parsed_args.use_external_vps is not None else LOCALHOST
+    port = HTTPS_PORT if parsed_args.use_external_vps is not None else PORT
+    return f'{host}:{port}/api/{APPROVED_URL}/progress'
+
+# ( event name, json data ) pairs, comments are heartbeats
+def server_sent_events(response: requests.Response) -> typing.Iterator[tuple[str, dict]]:
+    name, data = 'message', []
+    for raw_line in response.iter_lines():
+        line = raw_line.decode('utf-8', errors='replace')
+        if line.startswith(':'):
+            continue
+        if line.startswith('event:'):
+            name = line.removeprefix('event:').strip()
+        elif line.startswith('data:'):
+            data.append(line.removeprefix('data:').strip())
+        elif not line and data:
+            try:
+                yield name, json.loads('\n'.join(data))
+            except json.JSONDecodeError:
+                pass
+            name, data = 'message', []
+
+def progress_report(content: dict) -> str:
+    status = content.get('status')
+    num_finished_shards = content.get('num_finished_shards', 0)
+    num_shards = content.get('num_shards', 1)
+    artifacts = ', '.join(
+        f'{stage}: {stats.get("num_artifacts", 0)}'
+        for stage, stats in content.get('manifest', {}).items()
+    )
+    if num_shards > 1:
+        status = f'{status} ( {num_finished_shards}/{num_shards} shards )'
+    return f'{status} {artifacts}'.strip()
+
+def follow_progress(
+    job_id: str,
+    APPROVED_URL: str,
+    APPROVED_BEARER_TOKEN: str,
+    parsed_args: Argparse
+) -> typing.Optional[bool]:
+    '''
+    follow the job until it is finished, reported the moment it happens
+
+    ---
+
+    - `True`: finished, the results are ready
+    - `False`: the job failed, or the server stayed unreachable
+    - `None`: the server has no progress stream ( older servers )
+    '''
+    params = {'job_id': job_id}
+    url = progress_url(APPROVED_URL, parsed_args)
+    headers = status_headers(APPROVED_BEARER_TOKEN)
+    timeout = (NUM_SECONDS_TO_CONNECT_FOR_PROGRESS, NUM_SECONDS_TO_WAIT_FOR_PROGRESS)
+
+    last_report = None
+    num_consecutive_reconnects = 0
+    while num_consecutive_reconnects < MAX_NUM_CONSECUTIVE_PROGRESS_RECONNECTS:
+        try:
+            with requests.get(url, params=params, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code in (http.HTTPStatus.NOT_FOUND, http.HTTPStatus.METHOD_NOT_ALLOWED):
+                    return None
+                if response.status_code != http.HTTPStatus.OK:
+                    logging.warning('[ step 4 ] progress stream http status %s', response.status_code)
+                for name, content in server_sent_events(response):
+                    num_consecutive_reconnects = 0
+                    if name == 'error':
+                        logging.error('[ step 4 ] %s', content.get('status'))
+                        return False
+                    if name == 'progress':
+                        if (report := progress_report(content)) != last_report:
+                            logging.info('[ step 4 ] now %s', report)
+                            last_report = report
+                        if content.get('status') == 'Finished':
+                            return True
+        except requests.exceptions.RequestException as e:
+            logging.warning('[ step 4 ] progress stream interrupted: %s', e)
+
+        num_consecutive_reconnects += 1
+        time.sleep(NUM_SECONDS_BETWEEN_PROGRESS_RECONNECTS)
+
+    logging.warning('[ step 4 ] lost connection to server')
+    return False
+
+# older servers: poll for as long as the job is still running
+def poll_until_finished(
+    job_id: str,
+    APPROVED_URL: str,
+    APPROVED_BEARER_TOKEN: str,
+    parsed_args: Argparse,
+    deadline: float
+) -> bool:
+    while (what_should_happen_next := check(job_id, APPROVED_URL, APPROVED_BEARER_TOKEN, parsed_args)) != 'Finished':
+        if what_should_happen_next.startswith('fatal error'):
+            logging.error('[ step 4 ] %s', what_should_happen_next)
+            return False
+        if time.monotonic() > deadline:
+            return gave_up_waiting(what_should_happen_next)
+        logging.info('[ step 4 ] now %s', what_should_happen_next)
+        time.sleep(NUM_SECONDS_BETEEN_STEP_CHECK)
+    return True
+
+def gave_up_waiting(last_report: typing.Optional[str]) -> bool:
+    logging.error(
+        '[ step 4 ] the job did not finish within %.0f seconds ( last seen: %s ), giving up'
+        ' ( see DHSCANNER_MAX_NUM_SECONDS_PER_SCAN )',
+        MAX_NUM_SECONDS_PER_SCAN,
+        last_report
+    )
+    return False
+
+def wait_until_finished(job_id: str, APPROVED_URL: str, APPROVED_BEARER_TOKEN: str, parsed_args: Argparse) -> bool:
+    finished = follow_progress(job_id, APPROVED_URL, APPROVED_BEARER_TOKEN, parsed_args)
+    if finished is None:
+        logging.info('[ step 4 ] progress stream not available, polling instead')
+        deadline = time.monotonic() + MAX_NUM_SECONDS_PER_SCAN
+        return poll_until_finished(job_id, APPROVED_URL, APPROVED_BEARER_TOKEN, parsed_args, deadline)
+    return finished
+
 def results_url(APPROVED_URL, parsed_args: Argparse) -> str:
     host = parsed_args.use_external_vps if parsed_args.use_external_vps is not None else LOCALHOST
     port = HTTPS_PORT if parsed_args.use_external_vps is not None else PORT
@@ -554,7 +919,12 @@ def upload_files_succeeded(
     parsed_args: Argparse
 ) -> bool:
     logging.info('[ step 3 ] uploaded started')
-    if asyncio.run(upload(scan_dirname, files, job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)):
+    if parsed_args.upload_file_by_file:
+        uploaded = asyncio.run(upload(scan_dirname, files, job_id, APPROVED_URL, BEARER_TOKEN, parsed_args))
+    else:
+        uploaded = upload_archive(scan_dirname, files, job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)
+
+    if uploaded:
         logging.info('[ step 3 ] uploaded finished')
         return True
 
@@ -589,31 +959,26 @@ def main(parsed_args: Argparse, APPROVED_URL: str, BEARER_TOKEN: str) -> None:
                 parsed_args
             ):
                 if analyze(job_id, APPROVED_URL, BEARER_TOKEN, parsed_args, directories, filenames):
-                    for _ in range(MAX_NUM_CHECKS):
-                        what_should_happen_next = check(job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)
-                        if what_should_happen_next != 'Finished':
-                            logging.info('[ step 4 ] now %s', what_should_happen_next)
-                            time.sleep(NUM_SECONDS_BETEEN_STEP_CHECK)
-                        else:
-                            logging.info('[ step 5 ] finished 🙂')
-                            if parsed_args.with_agent:
-                                results = get_results(job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)
-                                kb_location = results.get('kb_location')
-                                if isinstance(kb_location, str):
-                                    logging.info('[ step 6 ] kb filename: %s', kb_location)
-                                    logging.info('[ step 6 ] copy this filename for agent mode continuation')
-                                else:
-                                    logging.warning('[ step 6 ] missing kb filename in results: %s', results)
-                                break
-
+                    if wait_until_finished(job_id, APPROVED_URL, BEARER_TOKEN, parsed_args):
+                        logging.info('[ step 5 ] finished 🙂')
+                        logging.info('[ step 5 ] later rescans: --base_job_id %s', job_id)
+                        if parsed_args.with_agent:
                             results = get_results(job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)
-                            if output := parsed_args.save_sarif_to:
-                                logging.info('[ step 6 ] saved sarif to: %s', output)
-                                with open(output, 'w', encoding='utf-8') as fl:
-                                    json.dump(results, fl)
+                            kb_location = results.get('kb_location')
+                            if isinstance(kb_location, str):
+                                logging.info('[ step 6 ] kb filename: %s', kb_location)
+                                logging.info('[ step 6 ] copy this filename for agent mode continuation')
                             else:
-                                logging.info('[ step 6 ] received sarif:\n%s', results)
-                            break
+                                logging.warning('[ step 6 ] missing kb filename in results: %s', results)
+                            return
+
+                        results = get_results(job_id, APPROVED_URL, BEARER_TOKEN, parsed_args)
+                        if output := parsed_args.save_sarif_to:
+                            logging.info('[ step 6 ] saved sarif to: %s', output)
+                            with open(output, 'w', encoding='utf-8') as fl:
+                                json.dump(results, fl)
+                        else:
+                            logging.info('[ step 6 ] received sarif:\n%s', results)
 
 if __name__ == "__main__":
     if args := Argparse.run():
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import io
+import zlib
+import enum
+import typing
+import zstandard
+import dataclasses
+
+ZSTD_LEVEL: typing.Final[int] = 3
+
+# gzip framing ( rather than a raw zlib stream )
+GZIP_WBITS: typing.Final[int] = 31
+
+# neither is a valid utf-8 prefix, so compressed artifacts
+# are told apart from ( older ) uncompressed ones on load
+ZSTD_MAGIC: typing.Final[bytes] = b'\x28\xb5\x2f\xfd'
+GZIP_MAGIC: typing.Final[bytes] = b'\x1f\x8b'
+
+DECOMPRESSION_CHUNK_NUM_BYTES: typing.Final[int] = 1024 * 1024
+
+# received bodies are decompressed slice by slice, and every slice decompresses into a bounded
+# output ( a zstd block of 128 KiB takes as little as 4 bytes ), so a bomb is caught early on
+DECOMPRESSION_SLICE_NUM_BYTES: typing.Final[int] = 1024
+
+class TruncatedContent(Exception):
+    '''the content ended before its last frame did'''
+
+class TooLargeContent(Exception):
+    '''the content decompresses into more than it is allowed to'''
+
+# a single frame ( or gzip member ), whatever follows it is left in unused data
+class Decompressor(typing.Protocol):
+
+    @property
+    def eof(self) -> bool:
+        ...
+
+    @property
+    def unused_data(self) -> bytes:
+        ...
+
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+class Encoding(str, enum.Enum):
+
+    ZSTD = 'zstd'
+    GZIP = 'gzip'
+
+    # an absent header, or 'identity', means uncompressed
+    @staticmethod
+    def from_raw_string(raw: typing.Optional[str]) -> typing.Optional[Encoding]:
+        if raw is None or raw.strip().lower() in ('', 'identity', 'none'):
+            return None
+        return Encoding(raw.strip().lower())
+
+    def compress(self, content: bytes) -> bytes:
+        match self:
+            case Encoding.ZSTD:
+                return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+            case Encoding.GZIP:
+                compressor = zlib.compressobj(wbits=GZIP_WBITS)
+                return compressor.compress(content) + compressor.flush()
+
+    # untrusted content ( say a decompression bomb ) is never decompressed
+    # beyond the bound: returns none once the output would exceed it
+    def decompress_at_most(self, content: bytes, max_num_bytes: int) -> typing.Optional[bytes]:
+        match self:
+            case Encoding.ZSTD:
+                output = io.BytesIO()
+                decompressor = zstandard.ZstdDecompressor()
+                with decompressor.stream_reader(content, read_across_frames=True) as reader:
+                    while chunk := reader.read(min(max_num_bytes + 1, DECOMPRESSION_CHUNK_NUM_BYTES)):
+                        output.write(chunk)
+                        if output.tell() > max_num_bytes:
+                            return None
+                return output.getvalue()
+            case Encoding.GZIP:
+                decompressobj = zlib.decompressobj(wbits=GZIP_WBITS)
+                decompressed_content = decompressobj.decompress(content, max_num_bytes + 1)
+                if len(decompressed_content) > max_num_bytes or decompressobj.unconsumed_tail:
+                    return None
+                return decompressed_content
+
+    def decompressor(self) -> Decompressor:
+        match self:
+            case Encoding.ZSTD:
+                return zstandard.ZstdDecompressor().decompressobj()
+            case Encoding.GZIP:
+                return zlib.decompressobj(wbits=GZIP_WBITS)
+
+@dataclasses.dataclass
+class Frames:
+    '''
+    concatenated frames ( or gzip members ), decompressed one after the other
+
+    ---
+
+    the content is complete only once its last frame has ended ( `eof` )
+    '''
+
+    encoding: Encoding
+    decompressor: Decompressor = dataclasses.field(init=False)
+
+    def __post_init__(self) -> None:
+        self.decompressor = self.encoding.decompressor()
+
+    @property
+    def eof(self) -> bool:
+        return self.decompressor.eof
+
+    def decompress(self, data: bytes) -> bytes:
+        output = []
+        while data:
+            if self.decompressor.eof:
+                self.decompressor = self.encoding.decompressor()
+            output.append(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data if self.decompressor.eof else b''
+        return b''.join(output)
+
+# corrupted, truncated, or not compressed with the declared encoding
+UNREADABLE_ENCODING_ERRORS: typing.Final[tuple[type[Exception], ...]] = (
+    zstandard.ZstdError,
+    zlib.error,
+    TruncatedContent
+)
+
+def compress(content: bytes, encoding: typing.Optional[Encoding]) -> bytes:
+    if encoding is None:
+        return content
+    return encoding.compress(content)
+
+def encoding_of(content: bytes) -> typing.Optional[Encoding]:
+    if content.startswith(ZSTD_MAGIC):
+        return Encoding.ZSTD
+    if content.startswith(GZIP_MAGIC):
+        return Encoding.GZIP
+    return None
+
+# whatever was written by compress ( with any encoding, or none at all )
+def decompress(content: bytes) -> bytes:
+    if encoding := encoding_of(content):
+        frames = Frames(encoding)
+        decompressed_content = frames.decompress(content)
+        if not frames.eof:
+            raise TruncatedContent()
+        return decompressed_content
+    return content
+
+# untrusted content is never decompressed ( or received ) beyond the bound
+async def decompressed(
+    chunks: typing.AsyncIterator[bytes],
+    encoding: typing.Optional[Encoding],
+    max_num_bytes: int
+) -> typing.AsyncIterator[bytes]:
+    num_bytes = 0
+    if encoding is None:
+        async for chunk in chunks:
+            num_bytes += len(chunk)
+            if num_bytes > max_num_bytes:
+                raise TooLargeContent()
+            yield chunk
+        return
+
+    frames = Frames(encoding)
+    async for chunk in chunks:
+        pieces = []
+        for start in range(0, len(chunk), DECOMPRESSION_SLICE_NUM_BYTES):
+            pieces.append(frames.decompress(chunk[start:start + DECOMPRESSION_SLICE_NUM_BYTES]))
+            num_bytes += len(pieces[-1])
+            if num_bytes > max_num_bytes:
+                raise TooLargeContent()
+        if content := b''.join(pieces):
+            yield content
+
+    if not frames.eof:
+        raise TruncatedContent()
@@ -2,11 +2,25 @@ from __future__ import annotations
 
 import abc
 import enum
+import math
 import typing
 import dataclasses
 
 from logger.client import Logger
 
+# a claimed job that is not heartbeated for that long
+# is considered abandoned and gets re-claimed by others
+NUM_SECONDS_PER_LEASE: typing.Final[int] = 60
+
+# large jobs are split into shards that any worker replica can claim
+MAX_NUM_FILES_PER_SHARD: typing.Final[int] = 500
+
+# in streaming mode every shard moves to the next stage as soon
+# as it is done, so small shards keep all the stages busy together
+MAX_NUM_FILES_PER_STREAMING_SHARD: typing.Final[int] = 20
+
+T = typing.TypeVar('T')
+
 class Status(str, enum.Enum):
 
     WaitingForNativeParsing = 'WaitingForNativeParsing'
@@ -16,6 +30,7 @@ class Status(str, enum.Enum):
     WaitingForQueryengine = 'WaitingForQueryengine'
     WaitingForResultsGeneration = 'WaitingForResultsGeneration'
     Finished = 'Finished'
+    Failed = 'Failed'
 
     @staticmethod
     def from_raw_string(raw: str) -> typing.Optional[Status]:
@@ -24,6 +39,93 @@ class Status(str, enum.Enum):
         except ValueError:
             return None
 
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Shard:
+
+    job_id: str
+    index: int
+    num_shards: int
+
+    @staticmethod
+    def whole(job_id: str) -> Shard:
+        return Shard(job_id=job_id, index=0, num_shards=1)
+
+    def select(self, rows: list[T]) -> list[T]:
+        '''
+        every shard takes a contiguous slice of the
+        ( identically ordered ) rows of the entire job
+        '''
+        n = len(rows)
+        start = (self.index * n) // self.num_shards
+        end = ((self.index + 1) * n) // self.num_shards
+        return rows[start:end]
+
+class Event(str, enum.Enum):
+
+    Entered = 'Entered'
+    Claimed = 'Claimed'
+    Finished = 'Finished'
+
+    @staticmethod
+    def from_raw_string(raw: str) -> typing.Optional[Event]:
+        try:
+            return Event(raw)
+        except ValueError:
+            return None
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class TimelineEntry:
+    '''
+    a single step of a job through the status queues
+
+    ---
+
+    - `event`: entered ( a status queue ), claimed, or finished ( by a worker )
+    - `status`: the status whose queue it is
+    - `index`: the shard, or `None` when the entire job entered the queue
+    - `num_shards`: the number of shards of the job at that status
+    - `at`: seconds since the epoch
+    '''
+
+    event: Event
+    status: Status
+    index: typing.Optional[int]
+    num_shards: int
+    at: float
+
+    def tojson(self) -> dict:
+        return {
+            'event': self.event.value,
+            'status': self.status.value,
+            'index': self.index,
+            'num_shards': self.num_shards,
+            'at': self.at
+        }
+
+    @staticmethod
+    def fromjson(content: dict) -> typing.Optional[TimelineEntry]:
+        try:
+            event = Event.from_raw_string(content['event'])
+            status = Status.from_raw_string(content['status'])
+            if event is None or status is None:
+                return None
+            index = content['index']
+            return TimelineEntry(
+                event=event,
+                status=status,
+                index=None if index is None else int(index),
+                num_shards=int(content['num_shards']),
+                at=float(content['at'])
+            )
+        except KeyError: # missing field(s)
+            return None
+        except (TypeError, ValueError): # int / float conversion failed
+            return None
+
+def num_shards_for(num_files: int, streaming: bool = False) -> int:
+    max_num_files_per_shard = MAX_NUM_FILES_PER_STREAMING_SHARD if streaming else MAX_NUM_FILES_PER_SHARD
+    return max(1, math.ceil(num_files / max_num_files_per_shard))
+
 @dataclasses.dataclass(frozen=True)
 class Coordinator(abc.ABC):
 
@@ -33,8 +135,21 @@ class Coordinator(abc.ABC):
     def get_status(self, job_id: str) -> typing.Optional[Status]:
         ...
 
+    # moves the entire job forward, by the worker holding its last shard
+    # ( returns false once that claim is gone: the job belongs to another worker,
+    # and once the job has failed: it never moves forward again )
+    @abc.abstractmethod
+    async def set_status(self, shard: Shard, status: Status, num_shards: int = 1) -> bool:
+        ...
+
+    # enqueues a new job, at most once per job id
+    # ( returns false for a job that is already known )
+    @abc.abstractmethod
+    def start_job(self, job_id: str, status: Status, num_shards: int = 1) -> bool:
+        ...
+
     @abc.abstractmethod
-    def set_status(self, job_id: str, status: Status) -> None:
+    def get_num_shards(self, job_id: str) -> int:
         ...
 
     @abc.abstractmethod
@@ -45,6 +160,14 @@ class Coordinator(abc.ABC):
     def set_agent_mode(self, job_id: str, agent_mode: bool) -> None:
         ...
 
+    @abc.abstractmethod
+    def get_streaming_mode(self, job_id: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def set_streaming_mode(self, job_id: str, streaming: bool) -> None:
+        ...
+
     @abc.abstractmethod
     def get_kb_location(self, job_id: str) -> typing.Optional[str]:
         ...
@@ -54,5 +177,40 @@ class Coordinator(abc.ABC):
         ...
 
     @abc.abstractmethod
-    async def get_jobs_waiting_for(self, desired_status: Status) -> list[str]:
+    async def get_shards_waiting_for(self, desired_status: Status, max_num_shards: int) -> list[Shard]:
+        ...
+
+    @abc.abstractmethod
+    async def renew_lease(self, shard: Shard) -> bool:
+        ...
+
+    # returns true for the last shard of the current status,
+    # whose worker should then move the entire job forward
+    @abc.abstractmethod
+    async def mark_shard_finished(self, shard: Shard) -> bool:
+        ...
+
+    # every status transition ( and every claimed / finished shard )
+    # of the job, in the order they happened
+    @abc.abstractmethod
+    def get_timeline(self, job_id: str) -> list[TimelineEntry]:
+        ...
+
+    # the entire timeline so far, and then every batch of new entries
+    # the moment it is recorded ( or an empty batch every `timeout` seconds
+    # without news ), until the caller stops iterating
+    @abc.abstractmethod
+    def follow_timeline(self, job_id: str, timeout: float) -> typing.AsyncGenerator[list[TimelineEntry], None]:
+        ...
+
+    # a shard whose worker failed on it is left
+    # for a later delivery ( to any worker )
+    @abc.abstractmethod
+    async def abandon_shard(self, shard: Shard) -> None:
+        ...
+
+    # streaming mode: the shard moves on to the next status on its own,
+    # and the job status follows once all of its shards have moved on
+    @abc.abstractmethod
+    async def forward_shard(self, shard: Shard, next_status: Status) -> None:
         ...
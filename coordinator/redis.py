@@ -1,9 +1,14 @@
+import os
 import json
+import time
 import redis
+import socket
 import typing
+import asyncio
 import dataclasses
 
 from datetime import timedelta
+from redis import asyncio as aioredis
 
 from coordinator import interface
 from common.language import Language
@@ -12,6 +17,146 @@ from logger.models import Context, LogMessage
 REDIS_HOST: typing.Final[str] = 'mq'
 REDIS_PORT: typing.Final[int] = 6379
 
+# every status has its own work queue ( a redis stream )
+# shared by all the workers waiting for that status
+CONSUMER_GROUP: typing.Final[str] = 'workers'
+BLOCK_WAITING_FOR_JOBS_MS: typing.Final[int] = 5000
+NUM_SECONDS_TO_WAIT_WHEN_NOT_RESPONDING: typing.Final[int] = 1
+LEASE_DURATION_MS: typing.Final[int] = interface.NUM_SECONDS_PER_LEASE * 1000
+
+# a shard that keeps failing ( or crashing its workers ) is moved aside
+# to the dead letter queue instead of being re-delivered forever
+MAX_NUM_DELIVERIES_PER_SHARD: typing.Final[int] = int(os.getenv('MAX_NUM_DELIVERIES_PER_SHARD', '5'))
+DEAD_LETTER_QUEUE: typing.Final[str] = 'queue:dead'
+
+# the status and timeline of a job expire that long after its last change
+NUM_SECONDS_TO_KEEP_JOB_STATUS: typing.Final[int] = int(os.getenv('NUM_SECONDS_TO_KEEP_JOB_STATUS', str(7 * 24 * 60 * 60)))
+
+StreamEntries = list[tuple[bytes, list[tuple[bytes, dict[bytes, bytes]]]]]
+
+# a claim is owned by the consumer holding the entry in the group's
+# pending entries list, so every lease operation first checks that
+# the entry is still pending for this very consumer
+
+# KEYS: [ queue ]
+# ARGV: [ group, message id, consumer ]
+RENEW_LEASE: typing.Final[str] = """
+local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[2], ARGV[2], 1, ARGV[3])
+if #pending == 0 then
+    return 0
+end
+redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[3], 0, ARGV[2], 'JUSTID')
+return 1
+"""
+
+# the last shard keeps its claim, it is
+# released by the transition of the entire job
+#
+# KEYS: [ queue, finished shards ]
+# ARGV: [ group, message id, consumer, shard index, num shards ]
+FINISH_SHARD: typing.Final[str] = """
+local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[2], ARGV[2], 1, ARGV[3])
+if #pending == 0 then
+    return -1
+end
+redis.call('SADD', KEYS[2], ARGV[4])
+if redis.call('SCARD', KEYS[2]) < tonumber(ARGV[5]) then
+    redis.call('XACK', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('XDEL', KEYS[1], ARGV[2])
+    return 0
+end
+return 1
+"""
+
+# a failed job never moves forward again, its
+# remaining shards just leave the queues they are in
+#
+# KEYS: [ job status, claimed queue, finished shards, ( optional ) next queue ]
+# ARGV: [ group, message id, consumer, status, job id, num shards, ttl ]
+TRANSITION: typing.Final[str] = """
+local pending = redis.call('XPENDING', KEYS[2], ARGV[1], ARGV[2], ARGV[2], 1, ARGV[3])
+if #pending == 0 then
+    return 0
+end
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['status'] == 'Failed' then
+    redis.call('XACK', KEYS[2], ARGV[1], ARGV[2])
+    redis.call('XDEL', KEYS[2], ARGV[2])
+    redis.call('DEL', KEYS[3])
+    return 2
+end
+redis.call('SET', KEYS[1], ARGV[4], 'EX', ARGV[7])
+redis.call('XACK', KEYS[2], ARGV[1], ARGV[2])
+redis.call('XDEL', KEYS[2], ARGV[2])
+redis.call('DEL', KEYS[3])
+if #KEYS == 4 then
+    for i = 0, tonumber(ARGV[6]) - 1 do
+        redis.call('XADD', KEYS[4], '*', 'job_id', ARGV[5], 'index', i, 'num_shards', ARGV[6])
+    end
+end
+return 1
+"""
+
+# a job is enqueued at most once, so a retried ( or duplicated )
+# analyze request cannot hand out the same shards twice
+#
+# KEYS: [ job status, queue ]
+# ARGV: [ status, job id, num shards, ttl ]
+START_JOB: typing.Final[str] = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[4]) then
+    return 0
+end
+for i = 0, tonumber(ARGV[3]) - 1 do
+    redis.call('XADD', KEYS[2], '*', 'job_id', ARGV[2], 'index', i, 'num_shards', ARGV[3])
+end
+return 1
+"""
+
+# the job of a dead lettered shard can never finish,
+# so it fails ( and its followers hear about it ) right away
+#
+# KEYS: [ queue, dead letter queue, job status, timeline, progress ]
+# ARGV: [ group, message id, consumer, job id, shard index, num shards, status, num deliveries, failed status, timeline entry, ttl ]
+DEAD_LETTER: typing.Final[str] = """
+local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[2], ARGV[2], 1, ARGV[3])
+if #pending == 0 then
+    return 0
+end
+redis.call('XACK', KEYS[1], ARGV[1], ARGV[2])
+redis.call('XDEL', KEYS[1], ARGV[2])
+redis.call('XADD', KEYS[2], '*', 'job_id', ARGV[4], 'index', ARGV[5], 'num_shards', ARGV[6], 'status', ARGV[7], 'num_deliveries', ARGV[8])
+redis.call('SET', KEYS[3], ARGV[9], 'EX', ARGV[11])
+redis.call('RPUSH', KEYS[4], ARGV[10])
+redis.call('EXPIRE', KEYS[4], ARGV[11])
+redis.call('PUBLISH', KEYS[5], 1)
+return 1
+"""
+
+# the job status only moves forward once the last shard has moved on
+#
+# KEYS: [ claimed queue, finished shards, next queue, job status ]
+# ARGV: [ group, message id, consumer, shard index, num shards, job id, next status, ttl ]
+FORWARD_SHARD: typing.Final[str] = """
+local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[2], ARGV[2], 1, ARGV[3])
+if #pending == 0 then
+    return 0
+end
+redis.call('XACK', KEYS[1], ARGV[1], ARGV[2])
+redis.call('XDEL', KEYS[1], ARGV[2])
+local current = redis.call('GET', KEYS[4])
+if current and cjson.decode(current)['status'] == 'Failed' then
+    return 2
+end
+redis.call('XADD', KEYS[3], '*', 'job_id', ARGV[6], 'index', ARGV[4], 'num_shards', ARGV[5])
+redis.call('SADD', KEYS[2], ARGV[4])
+if redis.call('SCARD', KEYS[2]) >= tonumber(ARGV[5]) then
+    redis.call('SET', KEYS[4], ARGV[7], 'EX', ARGV[8])
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+# pylint: disable=too-many-instance-attributes, too-many-public-methods
 @dataclasses.dataclass(frozen=True)
 class RedisCoordinator(interface.Coordinator):
 
@@ -20,28 +165,109 @@ class RedisCoordinator(interface.Coordinator):
 
     redis_client: redis.Redis = dataclasses.field(init=False)
 
+    # only the app follows timelines ( it connects on first use )
+    async_redis_client: aioredis.Redis = dataclasses.field(init=False)
+
+    consumer: str = dataclasses.field(default_factory=socket.gethostname, init=False)
+    consumer_groups: set[interface.Status] = dataclasses.field(default_factory=set, init=False)
+    claims: dict[interface.Shard, tuple[interface.Status, bytes]] = dataclasses.field(default_factory=dict, init=False)
+
+    renew_lease_script: typing.Any = dataclasses.field(init=False)
+    finish_shard_script: typing.Any = dataclasses.field(init=False)
+    transition_script: typing.Any = dataclasses.field(init=False)
+    start_job_script: typing.Any = dataclasses.field(init=False)
+    dead_letter_script: typing.Any = dataclasses.field(init=False)
+    forward_shard_script: typing.Any = dataclasses.field(init=False)
+
     def __post_init__(self):
         object.__setattr__(self, 'redis_client', redis.Redis(
             host=self.host,
             port=self.port
         ))
+        object.__setattr__(self, 'async_redis_client', aioredis.Redis(
+            host=self.host,
+            port=self.port
+        ))
+        object.__setattr__(self, 'renew_lease_script', self.redis_client.register_script(RENEW_LEASE))
+        object.__setattr__(self, 'finish_shard_script', self.redis_client.register_script(FINISH_SHARD))
+        object.__setattr__(self, 'transition_script', self.redis_client.register_script(TRANSITION))
+        object.__setattr__(self, 'start_job_script', self.redis_client.register_script(START_JOB))
+        object.__setattr__(self, 'dead_letter_script', self.redis_client.register_script(DEAD_LETTER))
+        object.__setattr__(self, 'forward_shard_script', self.redis_client.register_script(FORWARD_SHARD))
 
     @typing.override
     def get_status(self, job_id: str) -> typing.Optional[interface.Status]:
-        if raw_bytes := self.get_status_bytes(job_id):
-            if raw_str := self.get_status_string(raw_bytes):
-                if json_content := self.get_status_json(raw_str):
-                    if 'status' in json_content:
-                        value = json_content['status']
-                        return interface.Status.from_raw_string(value)
+        if json_content := self.get_status_json_content(job_id):
+            if 'status' in json_content:
+                value = json_content['status']
+                return interface.Status.from_raw_string(value)
         return None
 
     @typing.override
-    def set_status(self, job_id: str, status: interface.Status) -> None:
-        status_as_dict = {'status': f'{status.value}'}
-        status_str = json.dumps(status_as_dict)
-        status_bytes = status_str.encode('utf-8')
-        self.redis_client.set(job_id, status_bytes)
+    async def set_status(self, shard: interface.Shard, status: interface.Status, num_shards: int = 1) -> bool:
+        if (claim := self.claims.pop(shard, None)) is None:
+            await self.logger.warning(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id=shard.job_id,
+                    context=Context.JOB_LEASE_LOST,
+                    original_filename='*',
+                    language=Language.ALL,
+                    duration=timedelta(0),
+                    more_details=f'shard({shard.index+1}/{shard.num_shards}) not claimed by {self.consumer}, not moved to {status.value}'
+                )
+            )
+            return False
+
+        # the job leaves the queue it was claimed from in the same
+        # transaction that moves it forward. A claim whose lease was
+        # lost is left untouched: the job belongs to another worker now
+        claimed_status, message_id = claim
+        keys = [shard.job_id, self.queue(claimed_status), self.finished_shards(shard, claimed_status)]
+        if status != interface.Status.Finished:
+            keys.append(self.queue(status))
+        transitioned = self.transition_script(
+            keys=keys,
+            args=[
+                CONSUMER_GROUP,
+                message_id,
+                self.consumer,
+                self.status_bytes(status, num_shards),
+                shard.job_id,
+                num_shards,
+                NUM_SECONDS_TO_KEEP_JOB_STATUS
+            ]
+        )
+        if transitioned == 2:
+            return False
+        if not transitioned:
+            await self.lease_lost(shard, claimed_status)
+            return False
+
+        self.record(shard.job_id, [self.timeline_entry(interface.Event.Entered, status, None, num_shards)])
+        return True
+
+    @typing.override
+    def start_job(self, job_id: str, status: interface.Status, num_shards: int = 1) -> bool:
+        started = self.start_job_script(
+            keys=[job_id, self.queue(status)],
+            args=[
+                self.status_bytes(status, num_shards),
+                job_id,
+                0 if status == interface.Status.Finished else num_shards,
+                NUM_SECONDS_TO_KEEP_JOB_STATUS
+            ]
+        )
+        if started:
+            self.record(job_id, [self.timeline_entry(interface.Event.Entered, status, None, num_shards)])
+        return bool(started)
+
+    @typing.override
+    def get_num_shards(self, job_id: str) -> int:
+        if json_content := self.get_status_json_content(job_id):
+            if 'num_shards' in json_content:
+                return int(json_content['num_shards'])
+        return 1
 
     @typing.override
     def get_agent_mode(self, job_id: str) -> bool:
@@ -56,10 +282,41 @@ class RedisCoordinator(interface.Coordinator):
         self.redis_client.set(key, str(agent_mode))
 
     @typing.override
-    async def get_jobs_waiting_for(self, desired_status: interface.Status) -> list[str]:
+    def get_streaming_mode(self, job_id: str) -> bool:
+        key = self.get_streaming_mode_key(job_id)
+        if raw_bytes := self.redis_client.get(key):
+            return raw_bytes.decode('utf-8') == 'True'
+        return False
+
+    @typing.override
+    def set_streaming_mode(self, job_id: str, streaming: bool) -> None:
+        key = self.get_streaming_mode_key(job_id)
+        self.redis_client.set(key, str(streaming))
+
+    @typing.override
+    async def get_shards_waiting_for(
+        self,
+        desired_status: interface.Status,
+        max_num_shards: int
+    ) -> list[interface.Shard]:
 
+        queue = self.queue(desired_status)
         try:
-            keys = self.redis_client.keys('*')
+            self.create_consumer_group_if_needed(desired_status)
+            reclaimed = await self.dead_letter_undeliverable(
+                desired_status,
+                self.reclaim_expired_leases(desired_status, max_num_shards)
+            )
+            response: StreamEntries = []
+            if len(reclaimed) < max_num_shards:
+                response = typing.cast(StreamEntries, await asyncio.to_thread(
+                    self.redis_client.xreadgroup,
+                    CONSUMER_GROUP,
+                    self.consumer,
+                    {queue: '>'},
+                    count=max_num_shards - len(reclaimed),
+                    block=BLOCK_WAITING_FOR_JOBS_MS
+                ))
         except redis.exceptions.RedisError:
             await self.logger.warning(
                 LogMessage(
@@ -71,16 +328,343 @@ class RedisCoordinator(interface.Coordinator):
                     duration=timedelta(0)
                 )
             )
+            await asyncio.sleep(NUM_SECONDS_TO_WAIT_WHEN_NOT_RESPONDING)
             return []
 
-        job_ids = []
-        for key in keys:
-            job_id = key.decode('utf-8')
-            if job_status := self.get_status(job_id):
-                if job_status == desired_status:
-                    job_ids.append(job_id)
+        for _, shard in reclaimed:
+            await self.logger.warning(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id=shard.job_id,
+                    context=Context.JOB_LEASE_EXPIRED_RECLAIMED,
+                    original_filename='*',
+                    language=Language.ALL,
+                    duration=timedelta(0),
+                    more_details=f'{desired_status.value} shard({shard.index+1}/{shard.num_shards}) reclaimed by {self.consumer}'
+                )
+            )
+
+        claimed = list(reclaimed)
+        for _, messages in response or []:
+            for message_id, fields in messages:
+                claimed.append((message_id, RedisCoordinator.shard_from_fields(fields)))
+
+        shards = []
+        for message_id, shard in claimed:
+            self.claims[shard] = (desired_status, message_id)
+            shards.append(shard)
+            self.record(shard.job_id, [
+                self.timeline_entry(interface.Event.Claimed, desired_status, shard.index, shard.num_shards)
+            ])
+
+        return shards
+
+    @typing.override
+    async def renew_lease(self, shard: interface.Shard) -> bool:
+        if (claim := self.claims.get(shard)) is None:
+            return False
+
+        claimed_status, message_id = claim
+        try:
+            renewed = self.renew_lease_script(
+                keys=[self.queue(claimed_status)],
+                args=[CONSUMER_GROUP, message_id, self.consumer]
+            )
+        except redis.exceptions.RedisError:
+            # the lease cannot be verified right now, it expires
+            # on its own if the coordinator stays unreachable
+            return True
+
+        if renewed:
+            return True
+
+        self.claims.pop(shard, None)
+        await self.lease_lost(shard, claimed_status)
+        return False
+
+    @typing.override
+    async def mark_shard_finished(self, shard: interface.Shard) -> bool:
+        if (claim := self.claims.get(shard)) is None:
+            return False
+
+        claimed_status, message_id = claim
+        finished = self.finish_shard_script(
+            keys=[self.queue(claimed_status), self.finished_shards(shard, claimed_status)],
+            args=[CONSUMER_GROUP, message_id, self.consumer, shard.index, shard.num_shards]
+        )
+
+        if finished in (0, 1):
+            self.record(shard.job_id, [
+                self.timeline_entry(interface.Event.Finished, claimed_status, shard.index, shard.num_shards)
+            ])
+
+        if finished == 1:
+            return True
 
-        return job_ids
+        self.claims.pop(shard, None)
+        if finished == -1:
+            await self.lease_lost(shard, claimed_status)
+
+        return False
+
+    # the entry stays pending, so the shard is re-claimed
+    # ( by any worker ) once its lease expires
+    @typing.override
+    async def abandon_shard(self, shard: interface.Shard) -> None:
+        self.claims.pop(shard, None)
+
+    @typing.override
+    async def forward_shard(self, shard: interface.Shard, next_status: interface.Status) -> None:
+        if (claim := self.claims.pop(shard, None)) is None:
+            return
+
+        claimed_status, message_id = claim
+        forwarded = self.forward_shard_script(
+            keys=[
+                self.queue(claimed_status),
+                self.finished_shards(shard, claimed_status),
+                self.queue(next_status),
+                shard.job_id
+            ],
+            args=[
+                CONSUMER_GROUP,
+                message_id,
+                self.consumer,
+                shard.index,
+                shard.num_shards,
+                shard.job_id,
+                self.status_bytes(next_status, shard.num_shards),
+                NUM_SECONDS_TO_KEEP_JOB_STATUS
+            ]
+        )
+
+        if forwarded == 2:
+            return
+
+        if not forwarded:
+            await self.lease_lost(shard, claimed_status)
+            return
+
+        self.record(shard.job_id, [
+            self.timeline_entry(interface.Event.Finished, claimed_status, shard.index, shard.num_shards),
+            self.timeline_entry(interface.Event.Entered, next_status, shard.index, shard.num_shards)
+        ])
+
+    @typing.override
+    def get_timeline(self, job_id: str) -> list[interface.TimelineEntry]:
+        return self.timeline_entries(typing.cast(list[bytes], self.redis_client.lrange(self.timeline(job_id), 0, -1)))
+
+    # every recorded batch is announced on the progress channel of the job,
+    # and the timeline is re-read from the last known entry ( also when the
+    # wait times out, so a missed announcement only delays the entries )
+    # pylint: disable=invalid-overridden-method
+    @typing.override
+    async def follow_timeline(
+        self,
+        job_id: str,
+        timeout: float
+    ) -> typing.AsyncGenerator[list[interface.TimelineEntry], None]:
+
+        pubsub = self.async_redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(self.progress(job_id))
+            num_known_entries = 0
+            while True:
+                raw = await self.async_redis_client.lrange(self.timeline(job_id), num_known_entries, -1)
+                num_known_entries += len(raw)
+                yield self.timeline_entries(typing.cast(list[bytes], raw))
+                await pubsub.get_message(timeout=timeout)
+        except redis.exceptions.RedisError:
+            await self.logger.warning(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id=job_id,
+                    context=Context.COORDINATOR_NOT_RESPONDING,
+                    original_filename='*',
+                    language=Language.ALL,
+                    duration=timedelta(0)
+                )
+            )
+        finally:
+            await pubsub.aclose()
+
+    # the timeline only serves diagnostics,
+    # so it never fails the job it describes
+    def record(self, job_id: str, entries: list[interface.TimelineEntry]) -> None:
+        try:
+            with self.redis_client.pipeline() as pipe:
+                pipe.rpush(self.timeline(job_id), *[self.timeline_entry_bytes(e) for e in entries])
+                pipe.expire(self.timeline(job_id), NUM_SECONDS_TO_KEEP_JOB_STATUS)
+                pipe.publish(self.progress(job_id), len(entries))
+                pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def timeline_entries(self, raw: list[bytes]) -> list[interface.TimelineEntry]:
+        timeline = []
+        for raw_bytes in raw:
+            if raw_str := self.get_status_string(raw_bytes):
+                if json_content := self.get_status_json(raw_str):
+                    if entry := interface.TimelineEntry.fromjson(json_content):
+                        timeline.append(entry)
+        return timeline
+
+    async def lease_lost(self, shard: interface.Shard, claimed_status: interface.Status) -> None:
+        await self.logger.warning(
+            LogMessage(
+                file_unique_id='*',
+                job_id=shard.job_id,
+                context=Context.JOB_LEASE_LOST,
+                original_filename='*',
+                language=Language.ALL,
+                duration=timedelta(0),
+                more_details=f'{claimed_status.value} shard({shard.index+1}/{shard.num_shards}) lease lost by {self.consumer}'
+            )
+        )
+
+    def reclaim_expired_leases(
+        self,
+        status: interface.Status,
+        max_num_shards: int
+    ) -> list[tuple[bytes, interface.Shard]]:
+        response = self.redis_client.xautoclaim(
+            self.queue(status),
+            CONSUMER_GROUP,
+            self.consumer,
+            min_idle_time=LEASE_DURATION_MS,
+            start_id='0-0',
+            count=max_num_shards
+        )
+        _, messages, *_ = typing.cast(list, response)
+
+        reclaimed = []
+        for message_id, fields in messages:
+            # entries deleted while pending come back without fields
+            if fields:
+                reclaimed.append((message_id, RedisCoordinator.shard_from_fields(fields)))
+
+        return reclaimed
+
+    # every reclaim counts as another delivery, including
+    # the ones of shards whose workers crashed on them
+    async def dead_letter_undeliverable(
+        self,
+        status: interface.Status,
+        reclaimed: list[tuple[bytes, interface.Shard]]
+    ) -> list[tuple[bytes, interface.Shard]]:
+        if not reclaimed:
+            return []
+
+        queue = self.queue(status)
+        with self.redis_client.pipeline() as pipe:
+            for message_id, _ in reclaimed:
+                pipe.xpending_range(queue, CONSUMER_GROUP, min=message_id, max=message_id, count=1)
+            pending = pipe.execute()
+
+        deliverable = []
+        for (message_id, shard), entries in zip(reclaimed, pending):
+            num_deliveries = entries[0]['times_delivered'] if entries else 0
+            if num_deliveries <= MAX_NUM_DELIVERIES_PER_SHARD:
+                deliverable.append((message_id, shard))
+                continue
+
+            failed = self.timeline_entry(interface.Event.Entered, interface.Status.Failed, shard.index, shard.num_shards)
+            dead_lettered = self.dead_letter_script(
+                keys=[queue, DEAD_LETTER_QUEUE, shard.job_id, self.timeline(shard.job_id), self.progress(shard.job_id)],
+                args=[
+                    CONSUMER_GROUP,
+                    message_id,
+                    self.consumer,
+                    shard.job_id,
+                    shard.index,
+                    shard.num_shards,
+                    status.value,
+                    num_deliveries,
+                    self.status_bytes(interface.Status.Failed, shard.num_shards),
+                    self.timeline_entry_bytes(failed),
+                    NUM_SECONDS_TO_KEEP_JOB_STATUS
+                ]
+            )
+            if dead_lettered:
+                await self.logger.error(
+                    LogMessage(
+                        file_unique_id='*',
+                        job_id=shard.job_id,
+                        context=Context.JOB_SHARD_DEAD_LETTERED,
+                        original_filename='*',
+                        language=Language.ALL,
+                        duration=timedelta(0),
+                        more_details=f'{status.value} shard({shard.index+1}/{shard.num_shards}) delivered {num_deliveries} times'
+                    )
+                )
+
+        return deliverable
+
+    def create_consumer_group_if_needed(self, status: interface.Status) -> None:
+        if status in self.consumer_groups:
+            return
+
+        try:
+            self.redis_client.xgroup_create(
+                self.queue(status),
+                CONSUMER_GROUP,
+                id='0',
+                mkstream=True
+            )
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+        self.consumer_groups.add(status)
+
+    @staticmethod
+    def shard_from_fields(fields: dict[bytes, bytes]) -> interface.Shard:
+        return interface.Shard(
+            job_id=fields[b'job_id'].decode('utf-8'),
+            index=int(fields.get(b'index', 0)),
+            num_shards=int(fields.get(b'num_shards', 1))
+        )
+
+    @staticmethod
+    def status_bytes(status: interface.Status, num_shards: int) -> bytes:
+        status_as_dict = {'status': f'{status.value}', 'num_shards': num_shards}
+        status_str = json.dumps(status_as_dict)
+        return status_str.encode('utf-8')
+
+    @staticmethod
+    def timeline_entry(
+        event: interface.Event,
+        status: interface.Status,
+        index: typing.Optional[int],
+        num_shards: int
+    ) -> interface.TimelineEntry:
+        return interface.TimelineEntry(event=event, status=status, index=index, num_shards=num_shards, at=time.time())
+
+    @staticmethod
+    def timeline_entry_bytes(entry: interface.TimelineEntry) -> bytes:
+        return json.dumps(entry.tojson()).encode('utf-8')
+
+    @staticmethod
+    def timeline(job_id: str) -> str:
+        return f'{job_id}:timeline'
+
+    @staticmethod
+    def progress(job_id: str) -> str:
+        return f'{job_id}:progress'
+
+    @staticmethod
+    def queue(status: interface.Status) -> str:
+        return f'queue:{status.value}'
+
+    @staticmethod
+    def finished_shards(shard: interface.Shard, status: interface.Status) -> str:
+        return f'{shard.job_id}:finished_shards:{status.value}'
+
+    def get_status_json_content(self, job_id: str) -> typing.Optional[dict]:
+        if raw_bytes := self.get_status_bytes(job_id):
+            if raw_str := self.get_status_string(raw_bytes):
+                return self.get_status_json(raw_str)
+        return None
 
     def get_status_bytes(self, job_id: str) -> typing.Optional[bytes]:
         return self.redis_client.get(job_id)
@@ -109,3 +693,6 @@ class RedisCoordinator(interface.Coordinator):
 
     def get_agent_mode_key(self, job_id: str) -> str:
         return f'{job_id}:agent_mode'
+
+    def get_streaming_mode_key(self, job_id: str) -> str:
+        return f'{job_id}:streaming'
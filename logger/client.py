@@ -1,50 +1,160 @@
 from __future__ import annotations
 
 import http
+import json
 import typing
 import aiohttp
 import asyncio
+import contextlib
+import collections
+import dataclasses
 
 from logger.models import Level, LogMessage
 
 MAX_RETRIES: typing.Final[int] = 3
 RETRY_DELAY: typing.Final[float] = 0.5
-LOGGER_URL:typing.Final[str] = 'http://logger_server:8000/log'
+LOGGER_URL:typing.Final[str] = 'http://logger_server:8000/log/batch'
 
+# messages wait in a bounded ring buffer, and a background task
+# ships them in batches ( nobody awaits the logger server inline )
+MAX_NUM_BUFFERED_MESSAGES: typing.Final[int] = 20000
+MAX_NUM_MESSAGES_PER_BATCH: typing.Final[int] = 2000
+NUM_SECONDS_BETWEEN_FLUSHES: typing.Final[float] = 0.5
+NUM_SECONDS_PER_BATCH: typing.Final[float] = 10
+
+# backpressure: once the buffer is half full, only one out of every few
+# debug / info messages is kept ( warnings and errors are always kept ),
+# and when it is completely full the oldest messages are dropped
+KEEP_ONE_SAMPLED_MESSAGE_OUT_OF: typing.Final[int] = 10
+
+# pylint: disable=too-many-instance-attributes
+@dataclasses.dataclass
 class Logger:
 
-    @staticmethod
-    async def send_attempt(message: LogMessage, _level: Level):
-        url = LOGGER_URL
-        data = message.tojson()
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=data) as response:
-                    return response.status == http.HTTPStatus.OK
-        except aiohttp.ClientError:
-            return False
+    max_num_buffered_messages: int = MAX_NUM_BUFFERED_MESSAGES
+
+    messages: collections.deque[dict] = dataclasses.field(init=False)
+    pending: typing.Optional[asyncio.Event] = dataclasses.field(default=None, init=False)
+    flusher: typing.Optional[asyncio.Task] = dataclasses.field(default=None, init=False)
+    session: typing.Optional[aiohttp.ClientSession] = dataclasses.field(default=None, init=False)
+
+    num_sampled: int = dataclasses.field(default=0, init=False)
+    num_dropped: int = dataclasses.field(default=0, init=False)
+
+    def __post_init__(self):
+        self.messages = collections.deque(maxlen=self.max_num_buffered_messages)
+
+    def enqueue(self, message: LogMessage, level: Level) -> None:
+        sampling = len(self.messages) >= self.max_num_buffered_messages // 2
+        if sampling and level in (Level.DEBUG, Level.INFO):
+            self.num_sampled += 1
+            if self.num_sampled % KEEP_ONE_SAMPLED_MESSAGE_OUT_OF != 0:
+                self.num_dropped += 1
+                return
+
+        if len(self.messages) == self.max_num_buffered_messages:
+            self.num_dropped += 1
+
+        self.messages.append(message.tojson())
+        self.start_flusher_if_needed()
+        if len(self.messages) >= MAX_NUM_MESSAGES_PER_BATCH and self.pending is not None:
+            self.pending.set()
+
+    def start_flusher_if_needed(self) -> None:
+        if self.flusher is None or self.flusher.done():
+            self.session = None
+            self.pending = asyncio.Event()
+            self.flusher = asyncio.create_task(self.flush_forever())
 
-    @staticmethod
-    async def send(message: LogMessage, level: Level):
+    async def flush_forever(self) -> None:
+        while True:
+            if self.pending is not None:
+                try:
+                    await asyncio.wait_for(self.pending.wait(), NUM_SECONDS_BETWEEN_FLUSHES)
+                except asyncio.TimeoutError:
+                    pass
+                self.pending.clear()
+
+            # the flusher never dies with the messages that are yet to come
+            # ( whatever the send failure, its batch is counted as dropped )
+            try:
+                await self.flush()
+            except Exception: # pylint: disable=broad-exception-caught
+                pass
+
+    async def flush(self) -> None:
+        while self.messages:
+            n = min(len(self.messages), MAX_NUM_MESSAGES_PER_BATCH)
+            batch = [self.messages.popleft() for _ in range(n)]
+            try:
+                await self.send(batch)
+            except asyncio.CancelledError:
+                # shipped by whoever flushes next ( see close )
+                self.messages.extendleft(reversed(batch))
+                raise
+            except Exception:
+                self.num_dropped += len(batch)
+                raise
+
+    # the messages still buffered are shipped before shutting down
+    async def close(self) -> None:
+        if self.flusher is not None:
+            self.flusher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.flusher
+            self.flusher = None
+        await self.flush()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def send(self, batch: list[dict]) -> None:
         reactive_delay = RETRY_DELAY
         for _ in range(MAX_RETRIES):
-            if await Logger.send_attempt(message, level):
-                break
+            batch = await self.send_attempt(batch)
+            if not batch:
+                return
             await asyncio.sleep(reactive_delay)
             reactive_delay *= 2
 
-    @staticmethod
-    async def error(message: LogMessage):
-        await Logger.send(message, Level.ERROR)
+        self.num_dropped += len(batch)
+
+    # returns the messages that still need to be sent
+    async def send_attempt(self, batch: list[dict]) -> list[dict]:
+        try:
+            async with self.get_session().post(
+                LOGGER_URL,
+                json=batch,
+                timeout=aiohttp.ClientTimeout(total=NUM_SECONDS_PER_BATCH)
+            ) as response:
+                if response.status == http.HTTPStatus.OK:
+                    # rejected messages are invalid, sending them again is pointless
+                    result = await response.json()
+                    if isinstance(result, dict):
+                        self.num_dropped += len(result.get('rejected', []))
+                    return []
+        except aiohttp.ClientError:
+            pass
+        except TimeoutError:
+            pass
+        except json.JSONDecodeError:
+            return []
+
+        return batch
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def error(self, message: LogMessage):
+        self.enqueue(message, Level.ERROR)
 
-    @staticmethod
-    async def info(message: LogMessage):
-        await Logger.send(message, Level.INFO)
+    async def info(self, message: LogMessage):
+        self.enqueue(message, Level.INFO)
 
-    @staticmethod
-    async def warning(message: LogMessage):
-        await Logger.send(message, Level.WARNING)
+    async def warning(self, message: LogMessage):
+        self.enqueue(message, Level.WARNING)
 
-    @staticmethod
-    async def debug(message: LogMessage):
-        await Logger.send(message, Level.DEBUG)
+    async def debug(self, message: LogMessage):
+        self.enqueue(message, Level.DEBUG)
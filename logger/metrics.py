@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import math
+import heapq
+import typing
+import threading
+import collections
+import dataclasses
+
+from common.language import Language
+from logger.models import Context, LogMessage
+
+# every bucket is a few percents wider than the one before it,
+# so any quantile is estimated within that relative error,
+# regardless of the durations range ( microseconds to hours )
+RELATIVE_ERROR: typing.Final[float] = 0.02
+GAMMA: typing.Final[float] = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+MIN_TRACKED_DURATION_SECONDS: typing.Final[float] = 1e-6
+
+QUANTILES: typing.Final[tuple[float, ...]] = (0.5, 0.95, 0.99)
+
+# the per job summaries of the least recently logged jobs are evicted
+MAX_NUM_TRACKED_JOBS: typing.Final[int] = 256
+MAX_NUM_SLOWEST_FILES_PER_STAGE: typing.Final[int] = 5
+
+METRICS_PREFIX: typing.Final[str] = 'dhscanner_stage'
+
+@dataclasses.dataclass
+class Histogram:
+    '''
+    streaming histogram of durations ( with their byte sizes )
+
+    ---
+
+    sparse log scale buckets: only buckets that were
+    actually hit are stored, and histograms are mergeable
+    '''
+
+    buckets: dict[int, int] = dataclasses.field(default_factory=dict)
+    num_zeros: int = 0
+    count: int = 0
+    sum_seconds: float = 0.0
+    num_bytes: int = 0
+
+    def add(self, seconds: float, num_bytes: int) -> None:
+        self.count += 1
+        self.sum_seconds += seconds
+        self.num_bytes += num_bytes
+        if seconds < MIN_TRACKED_DURATION_SECONDS:
+            self.num_zeros += 1
+            return
+        i = math.ceil(math.log(seconds, GAMMA))
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def merge(self, other: Histogram) -> None:
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.num_zeros += other.num_zeros
+        self.count += other.count
+        self.sum_seconds += other.sum_seconds
+        self.num_bytes += other.num_bytes
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+
+        rank = q * (self.count - 1)
+        seen = self.num_zeros
+        if rank < seen:
+            return 0.0
+
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if rank < seen:
+                # the bucket ( GAMMA^(i-1), GAMMA^i ] is represented by
+                # the value whose relative distance to both ends is equal
+                return 2 * GAMMA ** i / (GAMMA + 1)
+
+        return 2 * GAMMA ** max(self.buckets) / (GAMMA + 1)
+
+    # processing throughput: bytes over the time spent processing them
+    def bytes_per_second(self) -> float:
+        if self.sum_seconds == 0:
+            return 0.0
+        return self.num_bytes / self.sum_seconds
+
+    def summary(self) -> dict[str, typing.Any]:
+        return {
+            'count': self.count,
+            'sum_seconds': self.sum_seconds,
+            **{f'p{round(q * 100)}': self.quantile(q) for q in QUANTILES},
+            'bytes': self.num_bytes,
+            'bytes_per_second': self.bytes_per_second()
+        }
+
+Stage = tuple[Context, Language]
+
+@dataclasses.dataclass
+class JobMetrics:
+
+    stages: dict[Stage, Histogram] = dataclasses.field(default_factory=dict)
+
+    # min heaps: the fastest of the slowest files is the one replaced
+    slowest_files: dict[Stage, list[tuple[float, str]]] = dataclasses.field(default_factory=dict)
+
+    def add(self, stage: Stage, seconds: float, num_bytes: int, original_filename: str) -> None:
+        self.stages.setdefault(stage, Histogram()).add(seconds, num_bytes)
+        slowest_files = self.slowest_files.setdefault(stage, [])
+        if len(slowest_files) < MAX_NUM_SLOWEST_FILES_PER_STAGE:
+            heapq.heappush(slowest_files, (seconds, original_filename))
+        else:
+            heapq.heappushpop(slowest_files, (seconds, original_filename))
+
+    def summary_of(self, stage: Stage) -> dict[str, typing.Any]:
+        context, language = stage
+        return {
+            'context': context.value,
+            'language': language.value,
+            **self.stages[stage].summary(),
+            'slowest_files': [
+                {'original_filename': original_filename, 'seconds': seconds}
+                for seconds, original_filename in sorted(self.slowest_files[stage], reverse=True)
+            ]
+        }
+
+@dataclasses.dataclass
+class Metrics:
+    '''
+    per stage ( context x language ) histograms of every logged message
+
+    ---
+
+    kept in memory, so the metrics never query the raw logs table
+    ( they start over whenever the logger server restarts )
+    '''
+
+    max_num_tracked_jobs: int = MAX_NUM_TRACKED_JOBS
+
+    stages: dict[Stage, Histogram] = dataclasses.field(default_factory=dict, init=False)
+    jobs: collections.OrderedDict[str, JobMetrics] = dataclasses.field(
+        default_factory=collections.OrderedDict,
+        init=False
+    )
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, init=False)
+
+    def record(self, msgs: list[LogMessage]) -> None:
+        with self.lock:
+            for msg in msgs:
+                self.record_single_message(msg)
+
+    def record_single_message(self, msg: LogMessage) -> None:
+        stage = (msg.context, msg.language)
+        seconds = msg.duration.total_seconds()
+        num_bytes = msg.corresponding_byte_size or 0
+        self.stages.setdefault(stage, Histogram()).add(seconds, num_bytes)
+
+        if msg.job_id not in self.jobs:
+            self.jobs[msg.job_id] = JobMetrics()
+            if len(self.jobs) > self.max_num_tracked_jobs:
+                self.jobs.popitem(last=False)
+        self.jobs.move_to_end(msg.job_id)
+        self.jobs[msg.job_id].add(stage, seconds, num_bytes, msg.original_filename)
+
+    def job_summary(self, job_id: str) -> typing.Optional[dict[str, typing.Any]]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+
+            total = Histogram()
+            for histogram in job.stages.values():
+                total.merge(histogram)
+
+            return {
+                'job_id': job_id,
+                'stages': [job.summary_of(stage) for stage in sorted(job.stages)],
+                'total': total.summary()
+            }
+
+    # prometheus text exposition format
+    def exposition(self) -> str:
+        with self.lock:
+            stages = sorted(self.stages.items())
+
+            lines = [
+                f'# HELP {METRICS_PREFIX}_duration_seconds duration of logged operations per context and language',
+                f'# TYPE {METRICS_PREFIX}_duration_seconds summary'
+            ]
+            for stage, histogram in stages:
+                for q in QUANTILES:
+                    lines.append(f'{METRICS_PREFIX}_duration_seconds{{{labels(stage, quantile=q)}}} {histogram.quantile(q)}')
+                lines.append(f'{METRICS_PREFIX}_duration_seconds_sum{{{labels(stage)}}} {histogram.sum_seconds}')
+                lines.append(f'{METRICS_PREFIX}_duration_seconds_count{{{labels(stage)}}} {histogram.count}')
+
+            lines.append(f'# HELP {METRICS_PREFIX}_bytes_total bytes of logged operations per context and language')
+            lines.append(f'# TYPE {METRICS_PREFIX}_bytes_total counter')
+            for stage, histogram in stages:
+                lines.append(f'{METRICS_PREFIX}_bytes_total{{{labels(stage)}}} {histogram.num_bytes}')
+
+            lines.append(f'# HELP {METRICS_PREFIX}_bytes_per_second bytes over the time spent processing them')
+            lines.append(f'# TYPE {METRICS_PREFIX}_bytes_per_second gauge')
+            for stage, histogram in stages:
+                lines.append(f'{METRICS_PREFIX}_bytes_per_second{{{labels(stage)}}} {histogram.bytes_per_second()}')
+
+            return '\n'.join(lines) + '\n'
+
+def labels(stage: Stage, quantile: typing.Optional[float] = None) -> str:
+    context, language = stage
+    pairs = [f'context="{context.value}"', f'language="{language.value}"']
+    if quantile is not None:
+        pairs.append(f'quantile="{quantile}"')
+    return ','.join(pairs)
@@ -0,0 +1,11 @@
+import sqlalchemy
+
+from logger import db
+from logger import models
+
+# sqlalchemy stores enums by their names, and never alters an existing enum type,
+# so contexts introduced since the type was created are added to it on startup
+def add_missing_contexts() -> None:
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for context in models.Context:
+            conn.execute(sqlalchemy.text(f"ALTER TYPE context ADD VALUE IF NOT EXISTS '{context.name}'"))
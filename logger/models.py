@@ -3,7 +3,7 @@ from __future__ import annotations
 import enum
 import dataclasses
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 import typing
 
 import sqlalchemy
@@ -24,7 +24,12 @@ class Context(str, enum.Enum):
     UPLOADED_FILE_RECEIVED = 'UPLOADED_FILE_RECEIVED'
     UPLOADED_FILE_SAVED = 'UPLOADED_FILE_SAVED'
     UPLOADED_FILE_SKIPPED_UNKNOWN_LANGUAGE = 'UPLOADED_FILE_SKIPPED_UNKNOWN_LANGUAGE'
+    UPLOADED_FILE_REUSED = 'UPLOADED_FILE_REUSED'
     COORDINATOR_NOT_RESPONDING = 'COORDINATOR_NOT_RESPONDING'
+    JOB_LEASE_LOST = 'JOB_LEASE_LOST'
+    JOB_LEASE_EXPIRED_RECLAIMED = 'JOB_LEASE_EXPIRED_RECLAIMED'
+    JOB_SHARD_FAILED = 'JOB_SHARD_FAILED'
+    JOB_SHARD_DEAD_LETTERED = 'JOB_SHARD_DEAD_LETTERED'
     READ_SOURCE_FILE_FAILED = 'READ_SOURCE_FILE_FAILED'
     READ_SOURCE_FILE_SUCCEEDED = 'READ_SOURCE_FILE_SUCCEEDED'
     DELETE_SOURCE_FILE_FAILED = 'DELETE_SOURCE_FILE_FAILED'
@@ -43,6 +48,8 @@ class Context(str, enum.Enum):
     DHSCANNER_PARSING_SUCCEEDED = 'DHSCANNER_PARSING_SUCCEEDED'
     DHSCANNER_PARSING_FAILED = 'DHSCANNER_PARSING_FAILED'
     DHSCANNER_PARSING_SYSTEM_FAILURE = 'DHSCANNER_PARSING_SYSTEM_FAILURE'
+    DHSCANNER_LAYOUT_REGISTERED = 'DHSCANNER_LAYOUT_REGISTERED'
+    DHSCANNER_LAYOUT_REGISTRATION_FAILED = 'DHSCANNER_LAYOUT_REGISTRATION_FAILED'
     READ_CALLABLE_i_FILE_FAILED = 'READ_CALLABLES_FILES_FAILED'
     READ_CALLABLE_i_FILE_SUCCEEDED = 'READ_CALLABLES_FILES_SUCCEEDED'
     DELETE_CALLABLE_i_FAILED = 'DELETE_CALLABLE_i_FAILED'
@@ -64,6 +71,19 @@ class Context(str, enum.Enum):
     DELETE_RESULTS_FAILED = 'DELETE_RESULTS_FAILED'
     DELETE_RESULTS_SUCCEEDED = 'DELETE_RESULTS_SUCCEEDED'
     RESULTS = 'RESULTS'
+    NATIVE_AST_CACHE_HIT = 'NATIVE_AST_CACHE_HIT'
+    NATIVE_AST_CACHE_MISS = 'NATIVE_AST_CACHE_MISS'
+    DHSCANNER_AST_CACHE_HIT = 'DHSCANNER_AST_CACHE_HIT'
+    DHSCANNER_AST_CACHE_MISS = 'DHSCANNER_AST_CACHE_MISS'
+    CALLABLES_CACHE_HIT = 'CALLABLES_CACHE_HIT'
+    CALLABLES_CACHE_MISS = 'CALLABLES_CACHE_MISS'
+    FACTS_CACHE_HIT = 'FACTS_CACHE_HIT'
+    FACTS_CACHE_MISS = 'FACTS_CACHE_MISS'
+    ARTIFACT_CACHE_STATS = 'ARTIFACT_CACHE_STATS'
+    UPSTREAM_STATS = 'UPSTREAM_STATS'
+    UPSTREAM_CIRCUIT_OPENED = 'UPSTREAM_CIRCUIT_OPENED'
+    UPSTREAM_CIRCUIT_CLOSED = 'UPSTREAM_CIRCUIT_CLOSED'
+    UPSTREAM_UNAVAILABLE_REQUEUED = 'UPSTREAM_UNAVAILABLE_REQUEUED'
 
 # pylint: disable=too-few-public-methods
 class Base(DeclarativeBase):
@@ -75,7 +95,20 @@ class LogMessage(Base):
 
     __tablename__ = 'logs'
 
+    # daily partitions ( see logger/partitions.py ), whose primary key
+    # must include the partition key ( the insertion timestamp )
+    __table_args__ = (
+        sqlalchemy.Index('ix_logs_job_id_context', 'job_id', 'context'),
+        sqlalchemy.Index('ix_logs_created_at', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
     msg: Mapped[int] = mapped_column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(
+        sqlalchemy.DateTime(timezone=True),
+        primary_key=True,
+        server_default=sqlalchemy.func.now()
+    )
     file_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     context: Mapped[Context] = mapped_column(sqlalchemy.Enum(Context), nullable=False)
@@ -125,3 +158,5 @@ class LogMessage(Base):
             return None
         except ValueError: # Enum(s) conversion failed | int conversion failed
             return None
+        except TypeError: # field(s) of the wrong type
+            return None
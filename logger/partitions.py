@@ -0,0 +1,111 @@
+import os
+import typing
+import logging
+import datetime
+import sqlalchemy
+
+from logger import db
+from logger import models
+from logger import migrations
+
+LOG_RETENTION_DAYS: typing.Final[int] = int(os.getenv('LOG_RETENTION_DAYS', '14'))
+NUM_DAYS_OF_PARTITIONS_AHEAD: typing.Final[int] = 3
+NUM_SECONDS_BETWEEN_MAINTENANCES: typing.Final[int] = 3600
+
+LOGS: typing.Final[str] = models.LogMessage.__tablename__
+LEGACY_LOGS: typing.Final[str] = f'{LOGS}_legacy'
+DAILY_PARTITION_PREFIX: typing.Final[str] = f'{LOGS}_p'
+DAILY_PARTITION_FORMAT: typing.Final[str] = '%Y%m%d'
+
+IS_PARTITIONED: typing.Final[str] = """
+SELECT EXISTS (
+    SELECT 1 FROM pg_partitioned_table pt
+    JOIN pg_class c ON c.oid = pt.partrelid
+    WHERE c.relname = :table
+)
+"""
+
+EXISTS: typing.Final[str] = """
+SELECT to_regclass(:table) IS NOT NULL
+"""
+
+PARTITIONS: typing.Final[str] = """
+SELECT c.relname FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+WHERE p.relname = :table
+"""
+
+logger = logging.getLogger(__name__)
+
+def prepare() -> None:
+    '''
+    called once, when the logger server starts
+
+    ---
+
+    - moves aside a ( pre partitioning ) plain `logs` table
+    - creates the partitioned `logs` table and its indexes
+    - adds the contexts that were introduced since the enum type was created
+    '''
+    with db.engine.begin() as conn:
+        move_aside_legacy_logs_table_if_needed(conn)
+    models.Base.metadata.create_all(bind=db.engine)
+    migrations.add_missing_contexts()
+    maintain()
+
+def maintain() -> None:
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    with db.engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f'CREATE TABLE IF NOT EXISTS {LOGS}_default PARTITION OF {LOGS} DEFAULT'))
+
+    for i in range(NUM_DAYS_OF_PARTITIONS_AHEAD + 1):
+        create_daily_partition_if_needed(today + datetime.timedelta(days=i))
+
+    drop_daily_partitions_older_than(today - datetime.timedelta(days=LOG_RETENTION_DAYS))
+
+def create_daily_partition_if_needed(day: datetime.date) -> None:
+    partition = daily_partition(day)
+    start = day.isoformat()
+    end = (day + datetime.timedelta(days=1)).isoformat()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(sqlalchemy.text(
+                f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {LOGS} "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            ))
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        # rows of that day already landed in the default partition
+        logger.warning('could not create log partition %s: %s', partition, e)
+
+def drop_daily_partitions_older_than(oldest_day_to_keep: datetime.date) -> None:
+    with db.engine.begin() as conn:
+        partitions = conn.execute(sqlalchemy.text(PARTITIONS), {'table': LOGS}).scalars().all()
+        for partition in partitions:
+            if day := day_of_daily_partition(partition):
+                if day < oldest_day_to_keep:
+                    conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {partition}'))
+
+def move_aside_legacy_logs_table_if_needed(conn: sqlalchemy.Connection) -> None:
+    if not conn.execute(sqlalchemy.text(EXISTS), {'table': LOGS}).scalar():
+        return
+    if conn.execute(sqlalchemy.text(IS_PARTITIONED), {'table': LOGS}).scalar():
+        return
+
+    # its primary key and sequence names would collide with the new table ones
+    conn.execute(sqlalchemy.text(f'ALTER TABLE {LOGS} RENAME TO {LEGACY_LOGS}'))
+    conn.execute(sqlalchemy.text(f'ALTER TABLE {LEGACY_LOGS} RENAME CONSTRAINT {LOGS}_pkey TO {LEGACY_LOGS}_pkey'))
+    conn.execute(sqlalchemy.text(f'ALTER SEQUENCE IF EXISTS {LOGS}_msg_seq RENAME TO {LEGACY_LOGS}_msg_seq'))
+    logger.warning('plain %s table renamed to %s', LOGS, LEGACY_LOGS)
+
+def daily_partition(day: datetime.date) -> str:
+    return f'{DAILY_PARTITION_PREFIX}{day.strftime(DAILY_PARTITION_FORMAT)}'
+
+def day_of_daily_partition(partition: str) -> typing.Optional[datetime.date]:
+    if not partition.startswith(DAILY_PARTITION_PREFIX):
+        return None
+    try:
+        raw = partition.removeprefix(DAILY_PARTITION_PREFIX)
+        return datetime.datetime.strptime(raw, DAILY_PARTITION_FORMAT).date()
+    except ValueError:
+        return None
@@ -1,3 +1,6 @@
+import io
+import csv
+import json
 import typing
 import asyncio
 import fastapi
@@ -6,10 +9,30 @@ import contextlib
 
 from logger import db
 from logger import models
+from logger import metrics
+from logger import partitions
 
 MAX_NUM_ATTEMPTS_CONNECTING_TO_LOGGER: typing.Final[int] = 10
 NUM_SECONDS_TO_WAIT_BETWEEN_ATTEMPTS: typing.Final[int] = 1
 
+NDJSON_CONTENT_TYPE: typing.Final[str] = 'application/x-ndjson'
+PROMETHEUS_CONTENT_TYPE: typing.Final[str] = 'text/plain; version=0.0.4'
+
+# sqlalchemy stores enums ( like the context ) by their names,
+# and every string is quoted so that an empty one is never a NULL
+COPY_LOGS: typing.Final[str] = """
+COPY logs (
+    file_unique_id,
+    job_id,
+    context,
+    original_filename,
+    language,
+    duration,
+    more_details,
+    corresponding_byte_size
+) FROM STDIN WITH ( FORMAT csv )
+"""
+
 async def logger_to_be_ready():
     for _ in range(MAX_NUM_ATTEMPTS_CONNECTING_TO_LOGGER):
         try:
@@ -31,14 +54,23 @@ async def logger_to_be_ready():
         detail="logger service is unreachable"
     )
 
+async def maintain_partitions_forever():
+    while True:
+        await asyncio.sleep(partitions.NUM_SECONDS_BETWEEN_MAINTENANCES)
+        await asyncio.to_thread(partitions.maintain)
+
 @contextlib.asynccontextmanager
 async def lifespan(_: fastapi.FastAPI):
     await logger_to_be_ready()
-    models.Base.metadata.create_all(bind=db.engine)
+    await asyncio.to_thread(partitions.prepare)
+    maintenance = asyncio.create_task(maintain_partitions_forever())
     yield
+    maintenance.cancel()
 
 app = fastapi.FastAPI(lifespan=lifespan)
 
+stage_metrics = metrics.Metrics()
+
 @app.post("/log")
 def log(serialized_msg: dict) -> fastapi.Response:
 
@@ -49,8 +81,109 @@ def log(serialized_msg: dict) -> fastapi.Response:
             content={'detail': 'invalid LogMessage received'}
         )
 
+    stage_metrics.record([msg])
     with db.SessionLocal() as session:
         session.add(msg)
         session.commit()
 
     return fastapi.Response(status_code=200)
+
+# a json array ( or ndjson ) of log messages,
+# inserted with a single COPY, invalid ones are reported back
+@app.post("/log/batch")
+async def log_batch(request: fastapi.Request) -> fastapi.Response:
+
+    body = await request.body()
+    content_type = request.headers.get('content-type', '')
+    payloads = parse_batch(body, ndjson=content_type.startswith(NDJSON_CONTENT_TYPE))
+    if payloads is None:
+        return fastapi.responses.JSONResponse(
+            status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={'detail': 'expected a json array ( or ndjson ) of LogMessage'}
+        )
+
+    msgs: list[models.LogMessage] = []
+    rejected: list[dict[str, typing.Any]] = []
+    for i, payload in enumerate(payloads):
+        msg = models.LogMessage.fromjson(payload) if isinstance(payload, dict) else None
+        if msg is None:
+            rejected.append({'index': i, 'detail': 'invalid LogMessage received'})
+            continue
+        msgs.append(msg)
+
+    if msgs:
+        await asyncio.to_thread(copy_into_logs, msgs)
+        stage_metrics.record(msgs)
+
+    return fastapi.responses.JSONResponse(
+        status_code=fastapi.status.HTTP_200_OK,
+        content={'num_accepted': len(msgs), 'rejected': rejected}
+    )
+
+@app.get("/metrics")
+def get_metrics() -> fastapi.Response:
+    return fastapi.responses.PlainTextResponse(
+        content=stage_metrics.exposition(),
+        media_type=PROMETHEUS_CONTENT_TYPE
+    )
+
+@app.get("/metrics/jobs/{job_id}")
+def get_job_metrics(job_id: str) -> fastapi.Response:
+
+    summary = stage_metrics.job_summary(job_id)
+    if summary is None:
+        return fastapi.responses.JSONResponse(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            content={'detail': f'no metrics for job {job_id}'}
+        )
+
+    return fastapi.responses.JSONResponse(
+        status_code=fastapi.status.HTTP_200_OK,
+        content=summary
+    )
+
+# None for an unreadable body, while unreadable ndjson lines are
+# kept as they are, and rejected one by one like any invalid message
+def parse_batch(body: bytes, ndjson: bool) -> typing.Optional[list[typing.Any]]:
+    try:
+        if ndjson:
+            return [parse_ndjson_line(line) for line in body.splitlines() if line.strip()]
+        payloads = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+    if isinstance(payloads, list):
+        return payloads
+
+    return None
+
+def parse_ndjson_line(line: bytes) -> typing.Any:
+    try:
+        return json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return line
+
+def copy_into_logs(msgs: list[models.LogMessage]) -> None:
+    rows = io.StringIO()
+    writer = csv.writer(rows, quoting=csv.QUOTE_NONNUMERIC)
+    for msg in msgs:
+        writer.writerow([
+            msg.file_unique_id,
+            msg.job_id,
+            msg.context.name,
+            msg.original_filename,
+            msg.language.name,
+            f'{msg.duration.total_seconds():f} seconds',
+            msg.more_details,
+            msg.corresponding_byte_size
+        ])
+    rows.seek(0)
+
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.copy_expert(COPY_LOGS, rows)
+        cursor.close()
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import io
+import re
+import enum
+import json
+import queue
+import shutil
+import typing
+import tarfile
+import zipfile
+import tempfile
+import dataclasses
+import zstandard
+
+# the ( optional ) first member of an uploaded archive, with what
+# per file uploads send as headers: go.mod module name, github url,
+# and the path mappings of every file ( keyed by its path in the repo )
+MANIFEST_MEMBER_NAME: typing.Final[str] = '.dhscanner.manifest.json'
+
+# a zip lists its members at its very end, so it is spooled first
+MAX_NUM_BYTES_OF_ZIP_IN_MEMORY: typing.Final[int] = 64 * 1024 * 1024
+MAX_NUM_PENDING_CHUNKS: typing.Final[int] = 64
+
+CONTENT_HASH: typing.Final[re.Pattern] = re.compile(r'[0-9a-f]{64}')
+NUM_SECONDS_BETWEEN_FEED_ATTEMPTS: typing.Final[float] = 0.1
+
+# truncated, corrupted, or not an archive of the declared format at all
+# ( gzip errors are OSErrors, and so are disk errors while extracting )
+UNREADABLE_ARCHIVE_ERRORS: typing.Final[tuple[type[Exception], ...]] = (
+    tarfile.TarError,
+    zipfile.BadZipFile,
+    zstandard.ZstdError,
+    EOFError,
+    OSError
+)
+
+class ArchiveFormat(str, enum.Enum):
+
+    TAR = 'tar'
+    TAR_GZ = 'tar.gz'
+    TAR_ZST = 'tar.zst'
+    ZIP = 'zip'
+
+    @staticmethod
+    def from_raw_string(raw: str) -> typing.Optional[ArchiveFormat]:
+        try:
+            return ArchiveFormat(raw)
+        except ValueError:
+            return None
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Manifest:
+
+    gomod: typing.Optional[str] = None
+    github_url: typing.Optional[str] = None
+    path_mappings: dict[str, list[dict[str, str]]] = dataclasses.field(default_factory=dict)
+
+    # sha256 of every file ( keyed by its path in the repo ),
+    # sent ahead of incremental uploads ( ignored in archives )
+    content_hashes: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def fromjson(content: typing.Any) -> Manifest:
+        if not isinstance(content, dict):
+            return Manifest()
+
+        gomod = content.get('gomod')
+        github_url = content.get('github_url')
+        path_mappings = content.get('path_mappings')
+        content_hashes = content.get('content_hashes')
+        return Manifest(
+            gomod=gomod if isinstance(gomod, str) else None,
+            github_url=github_url if isinstance(github_url, str) else None,
+            path_mappings={
+                filename: mappings
+                for filename, mappings in (path_mappings or {}).items()
+                if is_valid_path_mappings(mappings)
+            } if isinstance(path_mappings, dict) else {},
+            content_hashes={
+                filename: content_hash
+                for filename, content_hash in (content_hashes or {}).items()
+                if isinstance(content_hash, str) and CONTENT_HASH.fullmatch(content_hash)
+            } if isinstance(content_hashes, dict) else {}
+        )
+
+def is_valid_path_mappings(candidate: typing.Any) -> bool:
+    if not isinstance(candidate, list):
+        return False
+
+    for item in candidate:
+        if not isinstance(item, dict):
+            return False
+        if set(item.keys()) != {'from', 'to'}:
+            return False
+        if not isinstance(item['from'], str) or not isinstance(item['to'], str):
+            return False
+
+    return True
+
+class ChunksReader(io.RawIOBase):
+    '''
+    blocking file object over chunks fed from the event loop
+
+    ---
+
+    the archive is extracted in a thread while it is still being
+    received, and the bounded queue throttles the upload whenever
+    the extraction falls behind
+    '''
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: queue.Queue[typing.Optional[bytes]] = queue.Queue(maxsize=MAX_NUM_PENDING_CHUNKS)
+        self.current = b''
+        self.offset = 0
+        self.eof = False
+        self.abandoned = False
+
+    # called from the event loop side ( in a thread ), None marks the end
+    def feed(self, chunk: typing.Optional[bytes]) -> None:
+        while not self.abandoned:
+            try:
+                self.chunks.put(chunk, timeout=NUM_SECONDS_BETWEEN_FEED_ATTEMPTS)
+                return
+            except queue.Full:
+                pass
+
+    # the extraction never reads again once it is over ( or failed ),
+    # so whatever is still fed is dropped instead of blocking forever
+    def abandon(self) -> None:
+        self.abandoned = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: typing.Any) -> int:
+        while self.offset == len(self.current):
+            if self.eof:
+                return 0
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.eof = True
+                return 0
+            self.current, self.offset = chunk, 0
+
+        n = min(len(buffer), len(self.current) - self.offset)
+        buffer[:n] = self.current[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+Member = tuple[str, typing.IO[bytes]]
+
+# regular files only, in the order they appear in the archive
+def members(fileobj: typing.IO[bytes], archive_format: ArchiveFormat) -> typing.Iterator[Member]:
+    match archive_format:
+        case ArchiveFormat.TAR:
+            yield from tar_members(fileobj, 'r|')
+        case ArchiveFormat.TAR_GZ:
+            yield from tar_members(fileobj, 'r|gz')
+        case ArchiveFormat.TAR_ZST:
+            decompressed = zstandard.ZstdDecompressor().stream_reader(fileobj)
+            yield from tar_members(typing.cast(typing.IO[bytes], decompressed), 'r|')
+        case ArchiveFormat.ZIP:
+            yield from zip_members(fileobj)
+
+def tar_members(fileobj: typing.IO[bytes], mode: typing.Literal['r|', 'r|gz']) -> typing.Iterator[Member]:
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for member in tar:
+            if member.isfile():
+                if content := tar.extractfile(member):
+                    yield normalized(member.name), content
+
+def zip_members(fileobj: typing.IO[bytes]) -> typing.Iterator[Member]:
+    with tempfile.SpooledTemporaryFile(max_size=MAX_NUM_BYTES_OF_ZIP_IN_MEMORY) as spooled:
+        shutil.copyfileobj(fileobj, spooled)
+        spooled.seek(0)
+        with zipfile.ZipFile(spooled) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as content:
+                        yield normalized(info.filename), content
+
+def normalized(name: str) -> str:
+    return name.removeprefix('./')
+
+def read_manifest(content: typing.IO[bytes]) -> Manifest:
+    try:
+        return Manifest.fromjson(json.load(content))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return Manifest()
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import os
+import enum
+import json
+import time
+import typing
+import hashlib
+import pathlib
+import threading
+import collections
+import dataclasses
+
+from common import compression
+
+# shared by the app and all the workers ( like the jobs dirs ),
+# and outlives the jobs: a rescan reuses whatever did not change
+CACHE_DIR: typing.Final[pathlib.Path] = pathlib.Path(
+    '/app/transient_storage/dhscanner_cache'
+)
+
+MAX_NUM_BYTES: typing.Final[int] = int(os.getenv('ARTIFACT_CACHE_MAX_NUM_BYTES', str(10 * 1024 ** 3)))
+
+# part of every key: bumping it ( e.g. on a parsers upgrade )
+# makes all the previously cached stage outputs unreachable
+VERSION: typing.Final[str] = os.getenv('ARTIFACT_CACHE_VERSION', '1')
+
+# eviction scans the entire cache, so it only runs once in a while,
+# and then leaves some room before the next one is needed
+NUM_PUTS_BETWEEN_EVICTION_CHECKS: typing.Final[int] = 1000
+EVICT_DOWN_TO_FRACTION: typing.Final[float] = 0.9
+
+NUM_SECONDS_BETWEEN_STATS_REPORTS: typing.Final[float] = 60
+
+class CachedStage(str, enum.Enum):
+
+    SOURCES = 'sources'
+    NATIVE_AST = 'native_ast'
+    DHSCANNER_AST = 'dhscanner_ast'
+    CALLABLES = 'callables'
+    FACTS = 'facts'
+
+def cache_key(*parts: typing.Any) -> str:
+    serialized = json.dumps([VERSION, *parts], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+# every stage output is keyed by the key of its input, and by whatever
+# else the stage reads: the chain starts from the source content hash
+def native_ast_key(content_hash: str, language: str, original_filename: str) -> str:
+    return cache_key(CachedStage.NATIVE_AST.value, content_hash, language, original_filename)
+
+# imports are resolved against the entire repository layout
+def dhscanner_ast_key(
+    native_ast_key_: str,
+    github_url: typing.Optional[str],
+    path_mappings: typing.Optional[list[dict[str, str]]],
+    layout_key_: str
+) -> str:
+    return cache_key(CachedStage.DHSCANNER_AST.value, native_ast_key_, github_url, path_mappings, layout_key_)
+
+# everything the dhscanner ast depends on, except for the layout of the entire job:
+# a rescan relative to a base job reuses the dhscanner ast ( and all that follows it )
+# of every file whose inputs are unchanged since then, even though the layout changed
+def file_inputs_key(
+    native_ast_key_: str,
+    github_url: typing.Optional[str],
+    path_mappings: typing.Optional[list[dict[str, str]]]
+) -> str:
+    return cache_key(CachedStage.DHSCANNER_AST.value, native_ast_key_, github_url, path_mappings)
+
+# files are listed in ( random ) stored names order
+def layout_key(directories: list[str], filenames: list[str]) -> str:
+    return cache_key(sorted(directories), sorted(filenames))
+
+def callables_key(dhscanner_ast_key_: str) -> str:
+    return cache_key(CachedStage.CALLABLES.value, dhscanner_ast_key_)
+
+def facts_key(callables_key_: str, i: int) -> str:
+    return cache_key(CachedStage.FACTS.value, callables_key_, i)
+
+# pylint: disable=too-many-instance-attributes
+@dataclasses.dataclass
+class ArtifactCache:
+    '''
+    content addressed, size bounded cache of stage outputs ( and sources )
+
+    ---
+
+    - blobs are written atomically, so concurrent workers never read half a blob
+    - every hit touches its blob, and eviction drops the least recently used ones
+    - hits and misses are counted per stage ( per process ), and reported once in a while
+    - stage outputs are stored compressed ( sources are not, they are linked )
+    '''
+
+    root: pathlib.Path = CACHE_DIR
+    max_num_bytes: int = MAX_NUM_BYTES
+    encoding: typing.Optional[compression.Encoding] = None
+
+    hits: collections.Counter[CachedStage] = dataclasses.field(default_factory=collections.Counter, init=False)
+    misses: collections.Counter[CachedStage] = dataclasses.field(default_factory=collections.Counter, init=False)
+    num_puts_since_eviction_check: int = dataclasses.field(default=0, init=False)
+    last_stats_report_at: float = dataclasses.field(default_factory=time.monotonic, init=False)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, init=False)
+
+    def stats(self) -> list[dict[str, typing.Any]]:
+        return [
+            {
+                'stage': stage.value,
+                'num_hits': self.hits[stage],
+                'num_misses': self.misses[stage],
+                'hit_ratio': self.hits[stage] / (self.hits[stage] + self.misses[stage])
+            }
+            for stage in CachedStage
+            if self.hits[stage] + self.misses[stage] > 0
+        ]
+
+    # none until the next report is due
+    def stats_if_needed(self) -> typing.Optional[list[dict[str, typing.Any]]]:
+        now = time.monotonic()
+        if now - self.last_stats_report_at < NUM_SECONDS_BETWEEN_STATS_REPORTS:
+            return None
+
+        self.last_stats_report_at = now
+        return self.stats()
+
+    def path(self, stage: CachedStage, key: str) -> pathlib.Path:
+        return self.root / stage.value / key[:2] / key
+
+    def get(self, stage: CachedStage, key: str) -> typing.Optional[bytes]:
+        blob = self.path(stage, key)
+        try:
+            content = compression.decompress(blob.read_bytes())
+        except FileNotFoundError:
+            self.misses[stage] += 1
+            return None
+        except compression.UNREADABLE_ENCODING_ERRORS:
+            self.misses[stage] += 1
+            return None
+
+        self.hits[stage] += 1
+        touch_if_exists(blob)
+        return content
+
+    def put(self, stage: CachedStage, key: str, content: bytes) -> None:
+        blob = self.path(stage, key)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        partial = blob.with_name(f'{blob.name}.{os.getpid()}.{threading.get_ident()}.partial')
+        partial.write_bytes(compression.compress(content, self.encoding))
+        os.replace(partial, blob)
+        self.evict_if_needed()
+
+    def adopt_source(self, stored_filename: pathlib.Path, content_hash: str) -> None:
+        '''
+        identical sources share a single copy on disk
+
+        ---
+
+        the stored file of the job becomes a hard link to the blob of its
+        content, so deleting it ( once parsed ) never affects other jobs
+        '''
+        blob = self.path(CachedStage.SOURCES, content_hash)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(stored_filename, blob)
+            self.evict_if_needed()
+            return
+        except FileExistsError:
+            pass
+        except OSError:
+            # no hard links there, the stored file simply keeps its own copy
+            return
+
+        touch_if_exists(blob)
+        linked = stored_filename.with_name(f'{stored_filename.name}.linked')
+        try:
+            os.link(blob, linked)
+            os.replace(linked, stored_filename)
+        except OSError:
+            # evicted meanwhile, same as above
+            linked.unlink(missing_ok=True)
+
+    # a source some earlier job uploaded, registered without uploading it again
+    def link_source(self, content_hash: str, stored_filename: pathlib.Path) -> bool:
+        blob = self.path(CachedStage.SOURCES, content_hash)
+        try:
+            os.link(blob, stored_filename)
+        except OSError:
+            return False
+
+        touch_if_exists(blob)
+        return True
+
+    def evict_if_needed(self) -> None:
+        with self.lock:
+            self.num_puts_since_eviction_check += 1
+            if self.num_puts_since_eviction_check < NUM_PUTS_BETWEEN_EVICTION_CHECKS:
+                return
+            self.num_puts_since_eviction_check = 0
+
+        self.evict()
+
+    # returns the number of evicted blobs, and their total size
+    def evict(self) -> tuple[int, int]:
+        blobs: list[tuple[float, int, str]] = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, filename)))
+                total += stat.st_size
+
+        if total <= self.max_num_bytes:
+            return 0, 0
+
+        num_evicted, num_evicted_bytes = 0, 0
+        for _, size, blob in sorted(blobs):
+            if total - num_evicted_bytes <= self.max_num_bytes * EVICT_DOWN_TO_FRACTION:
+                break
+            try:
+                os.remove(blob)
+            except FileNotFoundError:
+                pass
+            num_evicted += 1
+            num_evicted_bytes += size
+
+        return num_evicted, num_evicted_bytes
+
+# the last use of a blob is its modification time
+def touch_if_exists(blob: pathlib.Path) -> None:
+    try:
+        os.utime(blob)
+    except FileNotFoundError:
+        pass
+
+# streamed uploads are hashed while they are written
+def new_content_hash() -> typing.Any:
+    return hashlib.sha256()
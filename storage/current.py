@@ -14,7 +14,7 @@ def get_current_storage_method(logger: Logger) -> typing.Optional[Storage]:
     for _ in range(MAX_NUM_ATTEMPS_CONNECTING_TO_STORAGE_MANAGER):
         try:
             with db.SessionLocal() as session:
-                session.execute(sqlalchemy.text('PRAGMA table_info(files);'))
+                session.execute(sqlalchemy.text('SELECT 1'))
             return LocalStorage(logger)
         except sqlalchemy.exc.OperationalError:
             time.sleep(1)
@@ -1,10 +1,67 @@
+import os
+import typing
+import asyncio
+import functools
 import sqlalchemy
+import concurrent.futures
 
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import sqlite, postgresql
 
-engine = sqlalchemy.create_engine(
-    'sqlite:///transient_storage/dhscanner.db',
-    connect_args={'check_same_thread': False}
-)
+P = typing.ParamSpec('P')
+R = typing.TypeVar('R')
+
+MAX_NUM_DB_THREADS: typing.Final[int] = int(os.getenv('MAX_NUM_DB_THREADS', '8'))
+
+# sqlite ( the default ) is shared by everyone over the transient storage volume,
+# set METADATA_DB_URL=postgresql+psycopg2://... to use a postgres server instead
+DEFAULT_METADATA_DB_URL: typing.Final[str] = 'sqlite:///transient_storage/dhscanner.db'
+METADATA_DB_URL: typing.Final[str] = os.getenv('METADATA_DB_URL', DEFAULT_METADATA_DB_URL)
+
+# every db thread holds at most one connection at a time
+POSTGRES_POOL_SIZE: typing.Final[int] = MAX_NUM_DB_THREADS
+POSTGRES_POOL_MAX_OVERFLOW: typing.Final[int] = 4
+POSTGRES_POOL_RECYCLE_SECONDS: typing.Final[int] = 1800
+
+def create_engine(url: str) -> sqlalchemy.Engine:
+    if url.startswith('sqlite'):
+        return sqlalchemy.create_engine(
+            url,
+            connect_args={'check_same_thread': False}
+        )
+
+    return sqlalchemy.create_engine(
+        url,
+        pool_size=POSTGRES_POOL_SIZE,
+        max_overflow=POSTGRES_POOL_MAX_OVERFLOW,
+        pool_recycle=POSTGRES_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=True
+    )
+
+engine = create_engine(METADATA_DB_URL)
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+# bulk upserts: rows that already exist are skipped
+def insert(model: typing.Any, dialect_name: str) -> typing.Any:
+    if dialect_name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# metadata queries are blocking, so they run on their own threads
+# and never stall the event loop ( or the default executor used for files )
+executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_NUM_DB_THREADS,
+    thread_name_prefix='db'
+)
+
+def off_the_event_loop(
+    f: typing.Callable[P, R]
+) -> typing.Callable[P, typing.Coroutine[typing.Any, typing.Any, R]]:
+
+    @functools.wraps(f)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(f, *args, **kwargs))
+
+    return wrapper
@@ -5,15 +5,28 @@ import dataclasses
 
 from logger.client import Logger
 from storage import db
+from storage.archive import ArchiveFormat, Manifest
+from storage.cache import CachedStage
 from storage.models import (
     CallablesMetadata,
     DhscannerAstMetadata,
     FileMetadata,
     FactsMetadata,
+    JobManifest,
     NativeAstMetadata,
     ResultsMetadata,
 )
 
+# the manifest outlives the job as its ( tiny ) record
+JOB_METADATA_MODELS: typing.Final[list[typing.Any]] = [
+    FileMetadata,
+    NativeAstMetadata,
+    DhscannerAstMetadata,
+    CallablesMetadata,
+    FactsMetadata,
+    ResultsMetadata,
+]
+
 # pylint: disable=too-many-public-methods
 @dataclasses.dataclass(frozen=True)
 class Storage(abc.ABC):
@@ -33,6 +46,31 @@ class Storage(abc.ABC):
     ) -> None:
         ...
 
+    # an entire repository in a single streamed archive, registered in one
+    # bulk insert: returns the number of saved and of skipped files, or None
+    # when the archive could not be read ( nothing is registered then )
+    @abc.abstractmethod
+    async def save_files_from_archive(
+        self,
+        content: typing.AsyncIterator[bytes],
+        archive_format: ArchiveFormat,
+        job_id: str
+    ) -> typing.Optional[tuple[int, int]]:
+        ...
+
+    # incremental uploads: files unchanged since the base job ( same name, content
+    # and everything else they are parsed with ) are registered right away, without
+    # uploading them again, and reuse the dhscanner asts ( and facts ) of the base job:
+    # returns the number of registered files, and the names of all the others
+    @abc.abstractmethod
+    async def save_files_by_content_hash(
+        self,
+        manifest: Manifest,
+        job_id: str,
+        base_job_id: str
+    ) -> tuple[int, list[str]]:
+        ...
+
     @abc.abstractmethod
     async def load_file(self, f: FileMetadata) -> typing.Optional[bytes]:
         ...
@@ -42,7 +80,7 @@ class Storage(abc.ABC):
         ...
 
     @abc.abstractmethod
-    async def save_native_ast(self, content: str, f: FileMetadata) -> None:
+    async def save_native_ast(self, content: str, f: FileMetadata, cache_key: typing.Optional[str] = None) -> None:
         ...
 
     @abc.abstractmethod
@@ -54,7 +92,7 @@ class Storage(abc.ABC):
         ...
 
     @abc.abstractmethod
-    async def save_dhscanner_ast(self, content: dict, a: NativeAstMetadata) -> None:
+    async def save_dhscanner_ast(self, content: bytes, a: NativeAstMetadata, cache_key: typing.Optional[str] = None) -> None:
         ...
 
     @abc.abstractmethod
@@ -66,7 +104,7 @@ class Storage(abc.ABC):
         ...
 
     @abc.abstractmethod
-    async def save_callables(self, content: list[dict], a: DhscannerAstMetadata) -> None:
+    async def save_callables(self, content: list[dict], a: DhscannerAstMetadata, cache_key: typing.Optional[str] = None) -> None:
         ...
 
     @abc.abstractmethod
@@ -113,15 +151,54 @@ class Storage(abc.ABC):
     async def delete_output(self, job_id: str) -> None:
         ...
 
+    # stage outputs outlive their jobs, keyed by the content they were
+    # computed from ( see storage/cache.py ): None when not cached ( yet )
+    @abc.abstractmethod
+    async def load_cached_artifact(self, stage: CachedStage, key: str) -> typing.Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    async def save_cached_artifact(self, stage: CachedStage, key: str, content: bytes) -> None:
+        ...
+
+    # metadata may be written behind, every stage
+    # flushes it before the next stage can start
+    @abc.abstractmethod
+    async def flush_metadata(self) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def load_native_asts_metadata_of_files_from_db(self, files: list[FileMetadata]) -> list[NativeAstMetadata]:
+        ...
+
+    @abc.abstractmethod
+    async def load_dhscanner_asts_metadata_of_files_from_db(self, files: list[FileMetadata]) -> list[DhscannerAstMetadata]:
+        ...
+
+    @abc.abstractmethod
+    async def load_callables_metadata_of_files_from_db(self, files: list[FileMetadata]) -> list[CallablesMetadata]:
+        ...
+
+    # ordered, so that every shard of the job selects the same files
     @staticmethod
+    @db.off_the_event_loop
     def load_files_metadata_from_db(job_id: str) -> list[FileMetadata]:
         with db.SessionLocal() as session:
             condition_is_satisfied = FileMetadata.job_id == job_id
-            stmt = sqlalchemy.select(FileMetadata).where(condition_is_satisfied)
+            stmt = sqlalchemy.select(FileMetadata).where(condition_is_satisfied).order_by(FileMetadata.file_unique_id)
             result = session.execute(stmt).scalars().all()
             return typing.cast(list[FileMetadata], result)
 
     @staticmethod
+    @db.off_the_event_loop
+    def count_files_in_db(job_id: str) -> int:
+        with db.SessionLocal() as session:
+            condition_is_satisfied = FileMetadata.job_id == job_id
+            stmt = sqlalchemy.select(sqlalchemy.func.count()).select_from(FileMetadata).where(condition_is_satisfied)
+            return session.execute(stmt).scalar_one()
+
+    @staticmethod
+    @db.off_the_event_loop
     def load_native_asts_metadata_from_db(job_id: str) -> list[NativeAstMetadata]:
         with db.SessionLocal() as session:
             condition_is_satisfied = NativeAstMetadata.job_id == job_id
@@ -130,6 +207,7 @@ class Storage(abc.ABC):
             return typing.cast(list[NativeAstMetadata], result)
 
     @staticmethod
+    @db.off_the_event_loop
     def load_dhscanner_asts_metadata_from_db(job_id: str) -> list[DhscannerAstMetadata]:
         with db.SessionLocal() as session:
             condition_is_satisfied = DhscannerAstMetadata.job_id == job_id
@@ -138,6 +216,7 @@ class Storage(abc.ABC):
             return typing.cast(list[DhscannerAstMetadata], result)
 
     @staticmethod
+    @db.off_the_event_loop
     def load_callables_metadata_from_db(job_id: str) -> list[CallablesMetadata]:
         with db.SessionLocal() as session:
             condition_is_satisfied = CallablesMetadata.job_id == job_id
@@ -146,6 +225,7 @@ class Storage(abc.ABC):
             return typing.cast(list[CallablesMetadata], result)
 
     @staticmethod
+    @db.off_the_event_loop
     def load_facts_metadata_from_db(job_id: str) -> list[FactsMetadata]:
         with db.SessionLocal() as session:
             condition_is_satisfied = FactsMetadata.job_id == job_id
@@ -154,9 +234,29 @@ class Storage(abc.ABC):
             return typing.cast(list[FactsMetadata], result)
 
     @staticmethod
+    @db.off_the_event_loop
     def load_results_metadata_from_db(job_id: str) -> ResultsMetadata:
         with db.SessionLocal() as session:
             condition_is_satisfied = ResultsMetadata.job_id == job_id
             stmt = sqlalchemy.select(ResultsMetadata).where(condition_is_satisfied)
             result = session.execute(stmt).scalars().first()
             return typing.cast(ResultsMetadata, result)
+
+    @staticmethod
+    @db.off_the_event_loop
+    def load_job_manifest_from_db(job_id: str) -> list[JobManifest]:
+        with db.SessionLocal() as session:
+            condition_is_satisfied = JobManifest.job_id == job_id
+            stmt = sqlalchemy.select(JobManifest).where(condition_is_satisfied)
+            result = session.execute(stmt).scalars().all()
+            return typing.cast(list[JobManifest], result)
+
+    # nothing reads the metadata of a finished job anymore
+    @staticmethod
+    @db.off_the_event_loop
+    def delete_job_metadata_from_db(job_id: str) -> None:
+        with db.SessionLocal() as session:
+            for model in JOB_METADATA_MODELS:
+                condition_is_satisfied = model.job_id == job_id
+                session.execute(sqlalchemy.delete(model).where(condition_is_satisfied))
+            session.commit()
@@ -1,3 +1,5 @@
+# pylint: disable=too-many-lines
+import io
 import os
 import json
 import uuid
@@ -6,13 +8,19 @@ import typing
 import pathlib
 import asyncio
 import aiofiles
+import sqlalchemy
+import dataclasses
 
 from datetime import timedelta
 
 from storage import db
 from storage import models
 
+from storage import archive
+from storage import cache
 from storage import interface
+from storage.metadata_buffer import MetadataBuffer
+from common import compression
 from common.language import Language
 from logger.models import (
     Context,
@@ -23,9 +31,24 @@ BASEDIR: typing.Final[pathlib.Path] = pathlib.Path(
     '/app/transient_storage/dhscanner_jobs'
 )
 
+COPY_CHUNK_NUM_BYTES: typing.Final[int] = 1024 * 1024
+
+# stage outputs ( asts, callables, facts ) are compressed on disk,
+# and decompressed on load whatever they were compressed with
+ARTIFACTS_ENCODING: typing.Final[typing.Optional[compression.Encoding]] = compression.Encoding.from_raw_string(
+    os.getenv('TRANSIENT_STORAGE_COMPRESSION', 'zstd')
+)
+
 # pylint: disable=too-many-public-methods
+@dataclasses.dataclass(frozen=True)
 class LocalStorage(interface.Storage):
 
+    metadata: MetadataBuffer = dataclasses.field(default_factory=MetadataBuffer, init=False)
+    artifacts: cache.ArtifactCache = dataclasses.field(
+        default_factory=lambda: cache.ArtifactCache(encoding=ARTIFACTS_ENCODING),
+        init=False
+    )
+
     # pylint: disable=too-many-arguments, too-many-positional-arguments
     @typing.override
     async def save_file(
@@ -41,8 +64,10 @@ class LocalStorage(interface.Storage):
         job_dir = LocalStorage.mk_jobdir_if_needed(job_id)
         if language := Language.from_filename(original_filename_in_repo):
             stored_filename = LocalStorage.mk_stored_filename(job_dir, language)
-            await LocalStorage.save_on_disk(content, stored_filename)
-            LocalStorage.store_file_metadata_in_db(
+            num_bytes, content_hash = await LocalStorage.save_on_disk(content, stored_filename)
+            await asyncio.to_thread(self.artifacts.adopt_source, stored_filename, content_hash)
+            # the upload is acknowledged only once its metadata is committed
+            await self.metadata.add_and_wait(
                 models.FileMetadata(
                     file_unique_id=str(stored_filename),
                     job_id=job_id,
@@ -50,8 +75,10 @@ class LocalStorage(interface.Storage):
                     language=language,
                     module_name_resolver=gomod,
                     github_url=github_url,
-                    path_mappings=path_mappings
-                )
+                    path_mappings=path_mappings,
+                    content_hash=content_hash
+                ),
+                num_bytes
             )
             end = time.monotonic()
             delta = end - start
@@ -80,6 +107,90 @@ class LocalStorage(interface.Storage):
             )
         )
 
+    @typing.override
+    async def save_files_from_archive(
+        self,
+        content: typing.AsyncIterator[bytes],
+        archive_format: archive.ArchiveFormat,
+        job_id: str
+    ) -> typing.Optional[tuple[int, int]]:
+        job_dir = LocalStorage.mk_jobdir_if_needed(job_id)
+        reader = archive.ChunksReader()
+        extraction = asyncio.create_task(asyncio.to_thread(
+            LocalStorage.extract_archive, reader, archive_format, job_dir, job_id, self.artifacts
+        ))
+
+        try:
+            async for chunk in content:
+                if not reader.abandoned:
+                    await asyncio.to_thread(reader.feed, chunk)
+        finally:
+            await asyncio.to_thread(reader.feed, None)
+            await asyncio.gather(extraction, return_exceptions=True)
+
+        try:
+            saved, skipped = extraction.result()
+        except archive.UNREADABLE_ARCHIVE_ERRORS:
+            return None
+
+        await self.metadata.add_all([(f, num_bytes) for f, num_bytes, _ in saved])
+
+        for f, _, delta in saved:
+            await self.logger.info(
+                LogMessage(
+                    file_unique_id=f.file_unique_id,
+                    job_id=job_id,
+                    context=Context.UPLOADED_FILE_SAVED,
+                    original_filename=f.original_filename,
+                    language=f.language,
+                    duration=timedelta(seconds=delta)
+                )
+            )
+
+        for original_filename_in_repo in skipped:
+            await self.logger.info(
+                LogMessage(
+                    file_unique_id=LocalStorage.get_unique_id(),
+                    job_id=job_id,
+                    context=Context.UPLOADED_FILE_SKIPPED_UNKNOWN_LANGUAGE,
+                    original_filename=original_filename_in_repo,
+                    language=Language.UNKNOWN,
+                    duration=timedelta(0)
+                )
+            )
+
+        return len(saved), len(skipped)
+
+    @typing.override
+    async def save_files_by_content_hash(
+        self,
+        manifest: archive.Manifest,
+        job_id: str,
+        base_job_id: str
+    ) -> tuple[int, list[str]]:
+        scanned = await LocalStorage.load_scanned_files_of_job_from_db(base_job_id)
+        job_dir = LocalStorage.mk_jobdir_if_needed(job_id)
+        reused, missing = await asyncio.to_thread(
+            LocalStorage.link_known_sources, manifest, job_dir, job_id, scanned, self.artifacts
+        )
+
+        await self.metadata.add_all([(f, num_bytes) for f, num_bytes, _ in reused])
+
+        for f, num_bytes, delta in reused:
+            await self.logger.info(
+                LogMessage(
+                    file_unique_id=f.file_unique_id,
+                    job_id=job_id,
+                    context=Context.UPLOADED_FILE_REUSED,
+                    original_filename=f.original_filename,
+                    language=f.language,
+                    duration=timedelta(seconds=delta),
+                    corresponding_byte_size=num_bytes
+                )
+            )
+
+        return len(reused), missing
+
     @typing.override
     async def load_file(self, f: models.FileMetadata) -> typing.Optional[bytes]:
         try:
@@ -157,13 +268,17 @@ class LocalStorage(interface.Storage):
         )
 
     @typing.override
-    async def save_native_ast(self, content: str, f: models.FileMetadata) -> None:
+    async def save_native_ast(
+        self,
+        content: str,
+        f: models.FileMetadata,
+        cache_key: typing.Optional[str] = None
+    ) -> None:
 
-        native_ast = f'{f.file_unique_id}.native.ast'
-        async with aiofiles.open(native_ast, 'wt') as fl:
-            await fl.write(content)
+        native_ast = LocalStorage.native_ast_unique_id(f)
+        await LocalStorage.save_artifact_on_disk(native_ast, content.encode('utf-8'))
 
-        LocalStorage.store_native_ast_metadata_in_db(
+        await self.metadata.add(
             models.NativeAstMetadata(
                 native_ast_unique_id=native_ast,
                 job_id=f.job_id,
@@ -171,8 +286,10 @@ class LocalStorage(interface.Storage):
                 language=f.language,
                 module_name_resolver=f.module_name_resolver,
                 github_url=f.github_url,
-                path_mappings=f.path_mappings
-            )
+                path_mappings=f.path_mappings,
+                cache_key=cache_key
+            ),
+            len(content)
         )
 
     @typing.override
@@ -180,7 +297,7 @@ class LocalStorage(interface.Storage):
         try:
             start = time.monotonic()
             async with aiofiles.open(a.native_ast_unique_id, 'rb') as fl:
-                content = await fl.read()
+                content = await asyncio.to_thread(compression.decompress, await fl.read())
                 end = time.monotonic()
                 delta = end - start
                 await self.logger.warning(
@@ -199,6 +316,8 @@ class LocalStorage(interface.Storage):
             pass
         except PermissionError:
             pass
+        except compression.UNREADABLE_ENCODING_ERRORS:
+            pass
 
         end = time.monotonic()
         delta = end - start
@@ -220,6 +339,7 @@ class LocalStorage(interface.Storage):
         try:
             start = time.monotonic()
             await asyncio.to_thread(os.remove, a.native_ast_unique_id)
+            await self.metadata.delete(a)
             end = time.monotonic()
             delta = end - start
             await self.logger.info(
@@ -252,29 +372,45 @@ class LocalStorage(interface.Storage):
         )
 
     @typing.override
-    async def save_dhscanner_ast(self, content: dict, a: models.NativeAstMetadata) -> None:
+    async def save_dhscanner_ast(
+        self,
+        content: bytes,
+        a: models.NativeAstMetadata,
+        cache_key: typing.Optional[str] = None
+    ) -> None:
 
         unique_file_id = a.native_ast_unique_id.removesuffix('.native.ast')
         dhscanner_ast = f'{unique_file_id}.dhscanner.ast'
-        async with aiofiles.open(dhscanner_ast, 'wt') as fl:
-            content_as_str = json.dumps(content)
-            await fl.write(content_as_str)
+        await LocalStorage.save_artifact_on_disk(dhscanner_ast, content)
 
-        LocalStorage.store_dhscanner_ast_metadata_in_db(
+        # the base of later rescans ( see save_files_by_content_hash )
+        if cache_key is not None and a.cache_key is not None:
+            await self.metadata.add(
+                models.ScannedFileMetadata(
+                    scanned_file_unique_id=dhscanner_ast,
+                    job_id=a.job_id,
+                    inputs_key=cache.file_inputs_key(a.cache_key, a.github_url, a.path_mappings),
+                    cache_key=cache_key
+                )
+            )
+
+        await self.metadata.add(
             models.DhscannerAstMetadata(
                 dhscanner_ast_unique_id=dhscanner_ast,
                 job_id=a.job_id,
                 original_filename=a.original_filename,
-                language=a.language
-            )
+                language=a.language,
+                cache_key=cache_key
+            ),
+            len(content)
         )
 
     @typing.override
     async def load_dhscanner_ast(self, a: models.DhscannerAstMetadata) -> typing.Optional[str]:
         try:
             start = time.monotonic()
-            async with aiofiles.open(a.dhscanner_ast_unique_id, 'rt', encoding='utf-8') as fl:
-                content = await fl.read()
+            async with aiofiles.open(a.dhscanner_ast_unique_id, 'rb') as fl:
+                content = (await asyncio.to_thread(compression.decompress, await fl.read())).decode('utf-8')
                 end = time.monotonic()
                 delta = end - start
                 await self.logger.warning(
@@ -293,6 +429,10 @@ class LocalStorage(interface.Storage):
             pass
         except PermissionError:
             pass
+        except UnicodeDecodeError:
+            pass
+        except compression.UNREADABLE_ENCODING_ERRORS:
+            pass
 
         end = time.monotonic()
         delta = end - start
@@ -314,6 +454,7 @@ class LocalStorage(interface.Storage):
         try:
             start = time.monotonic()
             await asyncio.to_thread(os.remove, a.dhscanner_ast_unique_id)
+            await self.metadata.delete(a)
             end = time.monotonic()
             delta = end - start
             await self.logger.info(
@@ -346,23 +487,31 @@ class LocalStorage(interface.Storage):
         )
 
     @typing.override
-    async def save_callables(self, content: list[dict], a: models.DhscannerAstMetadata) -> None:
+    async def save_callables(
+        self,
+        content: list[dict],
+        a: models.DhscannerAstMetadata,
+        cache_key: typing.Optional[str] = None
+    ) -> None:
 
+        num_bytes = 0
         for i, _callable in enumerate(content):
             unique_file_id = a.dhscanner_ast_unique_id.removesuffix('.dhscanner.ast')
             callable_name = f'{unique_file_id}.callable.{i}'
-            async with aiofiles.open(callable_name, 'wt') as fl:
-                content_as_str = json.dumps(_callable)
-                await fl.write(content_as_str)
+            content_as_str = json.dumps(_callable)
+            await LocalStorage.save_artifact_on_disk(callable_name, content_as_str.encode('utf-8'))
+            num_bytes += len(content_as_str)
 
-        LocalStorage.store_callables_metadata_in_db(
+        await self.metadata.add(
             models.CallablesMetadata(
                 callable_unique_id=unique_file_id,
                 num_callables=len(content),
                 job_id=a.job_id,
                 original_filename=a.original_filename,
-                language=a.language
-            )
+                language=a.language,
+                cache_key=cache_key
+            ),
+            num_bytes
         )
 
     @typing.override
@@ -371,8 +520,8 @@ class LocalStorage(interface.Storage):
         try:
             start = time.monotonic()
             fileanme = f'{c.callable_unique_id}.callable.{i}'
-            async with aiofiles.open(fileanme, 'rt') as fl:
-                content = await fl.read()
+            async with aiofiles.open(fileanme, 'rb') as fl:
+                content = await asyncio.to_thread(compression.decompress, await fl.read())
                 _callable = json.loads(content)
                 end = time.monotonic()
                 delta = end - start
@@ -395,6 +544,8 @@ class LocalStorage(interface.Storage):
             pass
         except json.JSONDecodeError:
             pass
+        except compression.UNREADABLE_ENCODING_ERRORS:
+            pass
 
         end = time.monotonic()
         delta = end - start
@@ -418,6 +569,9 @@ class LocalStorage(interface.Storage):
             start = time.monotonic()
             _callable = f'{c.callable_unique_id}.callable.{i}'
             await asyncio.to_thread(os.remove, _callable)
+            # the other callables of the file already hold this metadata
+            if i == c.num_callables - 1:
+                await self.metadata.delete(c)
             end = time.monotonic()
             delta = end - start
             await self.logger.info(
@@ -453,23 +607,24 @@ class LocalStorage(interface.Storage):
     async def save_knowledge_base_facts(self, content: list[dict], c: models.CallablesMetadata, i: int) -> None:
 
         facts_filename = f'{c.callable_unique_id}.callable.{i}.facts'
-        async with aiofiles.open(facts_filename, 'wt') as fl:
-            await fl.write(json.dumps(content))
+        content_as_str = json.dumps(content)
+        await LocalStorage.save_artifact_on_disk(facts_filename, content_as_str.encode('utf-8'))
 
-        LocalStorage.store_kbgen_facts_metadata_in_db(
+        await self.metadata.add(
             models.FactsMetadata(
                 facts_unique_id=facts_filename,
                 job_id=c.job_id,
                 original_filename=c.original_filename,
                 language=c.language
-            )
+            ),
+            len(content_as_str)
         )
 
     @typing.override
     async def load_knowledge_base_facts(self, f: models.FactsMetadata) -> list[str]:
         start = time.monotonic()
-        async with aiofiles.open(f.facts_unique_id, 'rt') as fl:
-            lines = await fl.readlines()
+        async with aiofiles.open(f.facts_unique_id, 'rb') as fl:
+            lines = (await asyncio.to_thread(compression.decompress, await fl.read())).decode('utf-8').splitlines(keepends=True)
             end = time.monotonic()
             delta = end - start
             await self.logger.warning(
@@ -490,6 +645,7 @@ class LocalStorage(interface.Storage):
         try:
             start = time.monotonic()
             await asyncio.to_thread(os.remove, f.facts_unique_id)
+            await self.metadata.delete(f)
             end = time.monotonic()
             delta = end - start
             await self.logger.info(
@@ -529,7 +685,7 @@ class LocalStorage(interface.Storage):
             await fl.write(content)
 
         results_as_str = str(results)
-        LocalStorage.store_results_metadata_in_db(
+        await LocalStorage.store_results_metadata_in_db(
             models.ResultsMetadata(
                 results=results_as_str,
                 job_id=job_id
@@ -595,6 +751,112 @@ class LocalStorage(interface.Storage):
         filename = LocalStorage.jobdir(job_id) / 'output.json'
         await asyncio.to_thread(os.remove, filename)
 
+    @typing.override
+    async def load_cached_artifact(self, stage: cache.CachedStage, key: str) -> typing.Optional[bytes]:
+        try:
+            return await asyncio.to_thread(self.artifacts.get, stage, key)
+        except PermissionError:
+            return None
+        finally:
+            await self.report_cache_stats_if_needed()
+
+    # best effort: a stage output that could not be cached is simply recomputed
+    @typing.override
+    async def save_cached_artifact(self, stage: cache.CachedStage, key: str, content: bytes) -> None:
+        try:
+            await asyncio.to_thread(self.artifacts.put, stage, key, content)
+        except OSError:
+            pass
+
+    async def report_cache_stats_if_needed(self) -> None:
+        for stats in self.artifacts.stats_if_needed() or []:
+            await self.logger.info(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id='*',
+                    context=Context.ARTIFACT_CACHE_STATS,
+                    original_filename=stats['stage'],
+                    language=Language.ALL,
+                    duration=timedelta(0),
+                    more_details=json.dumps(stats)
+                )
+            )
+
+    @typing.override
+    async def flush_metadata(self) -> None:
+        await self.metadata.flush()
+
+    @typing.override
+    async def load_native_asts_metadata_of_files_from_db(
+        self,
+        files: list[models.FileMetadata]
+    ) -> list[models.NativeAstMetadata]:
+        native_asts = [LocalStorage.native_ast_unique_id(f) for f in files]
+        return await LocalStorage.load_native_asts_metadata_by_ids_from_db(native_asts)
+
+    @staticmethod
+    @db.off_the_event_loop
+    def load_native_asts_metadata_by_ids_from_db(native_asts: list[str]) -> list[models.NativeAstMetadata]:
+        with db.SessionLocal() as session:
+            condition_is_satisfied = models.NativeAstMetadata.native_ast_unique_id.in_(native_asts)
+            stmt = sqlalchemy.select(models.NativeAstMetadata).where(condition_is_satisfied)
+            result = session.execute(stmt).scalars().all()
+            return typing.cast(list[models.NativeAstMetadata], result)
+
+    @typing.override
+    async def load_dhscanner_asts_metadata_of_files_from_db(
+        self,
+        files: list[models.FileMetadata]
+    ) -> list[models.DhscannerAstMetadata]:
+        dhscanner_asts = [LocalStorage.dhscanner_ast_unique_id(f) for f in files]
+        return await LocalStorage.load_dhscanner_asts_metadata_by_ids_from_db(dhscanner_asts)
+
+    @staticmethod
+    @db.off_the_event_loop
+    def load_dhscanner_asts_metadata_by_ids_from_db(dhscanner_asts: list[str]) -> list[models.DhscannerAstMetadata]:
+        with db.SessionLocal() as session:
+            condition_is_satisfied = models.DhscannerAstMetadata.dhscanner_ast_unique_id.in_(dhscanner_asts)
+            stmt = sqlalchemy.select(models.DhscannerAstMetadata).where(condition_is_satisfied)
+            result = session.execute(stmt).scalars().all()
+            return typing.cast(list[models.DhscannerAstMetadata], result)
+
+    @typing.override
+    async def load_callables_metadata_of_files_from_db(
+        self,
+        files: list[models.FileMetadata]
+    ) -> list[models.CallablesMetadata]:
+        callables = [f.file_unique_id for f in files]
+        return await LocalStorage.load_callables_metadata_by_ids_from_db(callables)
+
+    @staticmethod
+    @db.off_the_event_loop
+    def load_callables_metadata_by_ids_from_db(callables: list[str]) -> list[models.CallablesMetadata]:
+        with db.SessionLocal() as session:
+            condition_is_satisfied = models.CallablesMetadata.callable_unique_id.in_(callables)
+            stmt = sqlalchemy.select(models.CallablesMetadata).where(condition_is_satisfied)
+            result = session.execute(stmt).scalars().all()
+            return typing.cast(list[models.CallablesMetadata], result)
+
+    # inputs key => dhscanner ast key
+    @staticmethod
+    @db.off_the_event_loop
+    def load_scanned_files_of_job_from_db(job_id: str) -> dict[str, str]:
+        with db.SessionLocal() as session:
+            condition_is_satisfied = models.ScannedFileMetadata.job_id == job_id
+            stmt = sqlalchemy.select(
+                models.ScannedFileMetadata.inputs_key,
+                models.ScannedFileMetadata.cache_key
+            ).where(condition_is_satisfied)
+            return dict(session.execute(stmt).tuples().all())
+
+    @staticmethod
+    def native_ast_unique_id(f: models.FileMetadata) -> str:
+        return f'{f.file_unique_id}.native.ast'
+
+    @staticmethod
+    def dhscanner_ast_unique_id(f: models.FileMetadata) -> str:
+        return f'{f.file_unique_id}.dhscanner.ast'
+
     @staticmethod
     def jobdir(job_id: str) -> pathlib.Path:
         return BASEDIR / job_id
@@ -614,46 +876,155 @@ class LocalStorage(interface.Storage):
         unique_id = LocalStorage.get_unique_id()
         return job_dir / f'{unique_id}.{language.value}'
 
+    # runs in a thread, while the archive is still being received:
+    # ( file metadata, num bytes, seconds ) of every saved file,
+    # and the original names of the skipped ( unknown language ) ones
+    # pylint: disable=too-many-arguments, too-many-positional-arguments, too-many-locals
     @staticmethod
-    async def save_on_disk(
-        content: typing.AsyncIterator[bytes],
-        stored_filename: pathlib.Path,
-    ) -> None:
-        async with aiofiles.open(stored_filename, 'wb') as fl:
-            async for chunk in content:
-                await fl.write(chunk)
+    def extract_archive(
+        reader: archive.ChunksReader,
+        archive_format: archive.ArchiveFormat,
+        job_dir: pathlib.Path,
+        job_id: str,
+        artifacts: cache.ArtifactCache
+    ) -> tuple[list[tuple[models.FileMetadata, int, float]], list[str]]:
+        manifest = archive.Manifest()
+        extracted: list[tuple[str, pathlib.Path, Language, tuple[int, str, float]]] = []
+        skipped: list[str] = []
+        try:
+            for original_filename_in_repo, content in archive.members(io.BufferedReader(reader), archive_format):
+                if original_filename_in_repo == archive.MANIFEST_MEMBER_NAME:
+                    manifest = archive.read_manifest(content)
+                    continue
+
+                language = Language.from_filename(original_filename_in_repo)
+                if language is None:
+                    skipped.append(original_filename_in_repo)
+                    continue
+
+                stored_filename = LocalStorage.mk_stored_filename(job_dir, language)
+                saved_on_disk = LocalStorage.save_archive_member_on_disk(content, stored_filename, artifacts)
+                extracted.append((original_filename_in_repo, stored_filename, language, saved_on_disk))
+
+        except archive.UNREADABLE_ARCHIVE_ERRORS:
+            # a partially received archive registers nothing
+            for _, stored_filename, _, _ in extracted:
+                stored_filename.unlink(missing_ok=True)
+            raise
+
+        finally:
+            reader.abandon()
+
+        # the manifest is usually the first member, but not necessarily
+        saved = []
+        for original_filename_in_repo, stored_filename, language, (num_bytes, content_hash, delta) in extracted:
+            f = models.FileMetadata(
+                file_unique_id=str(stored_filename),
+                job_id=job_id,
+                original_filename=original_filename_in_repo,
+                language=language,
+                module_name_resolver=manifest.gomod,
+                github_url=manifest.github_url,
+                path_mappings=manifest.path_mappings.get(original_filename_in_repo),
+                content_hash=content_hash
+            )
+            saved.append((f, num_bytes, delta))
 
-    @staticmethod
-    def store_file_metadata_in_db(f: models.FileMetadata) -> None:
-        with db.SessionLocal() as session:
-            session.add(f)
-            session.commit()
+        return saved, skipped
 
+    # runs in a thread: ( file metadata, num bytes, seconds ) of every
+    # file linked from the content addressed sources, and the original
+    # names of the files that have to be uploaded ( unknown contents )
     @staticmethod
-    def store_native_ast_metadata_in_db(a: models.NativeAstMetadata) -> None:
-        with db.SessionLocal() as session:
-            session.add(a)
-            session.commit()
+    # only sources of the base job are linked, so no job
+    # ever learns ( or gets ) the content of any other job
+    # pylint: disable=too-many-locals
+    def link_known_sources(
+        manifest: archive.Manifest,
+        job_dir: pathlib.Path,
+        job_id: str,
+        scanned: dict[str, str],
+        artifacts: cache.ArtifactCache
+    ) -> tuple[list[tuple[models.FileMetadata, int, float]], list[str]]:
+        reused: list[tuple[models.FileMetadata, int, float]] = []
+        missing: list[str] = []
+        for original_filename_in_repo, content_hash in manifest.content_hashes.items():
+            # skipped anyway ( like go.mod, whose module name is in the manifest )
+            language = Language.from_filename(original_filename_in_repo)
+            if language is None:
+                continue
+
+            start = time.monotonic()
+            path_mappings = manifest.path_mappings.get(original_filename_in_repo)
+            native_ast_key = cache.native_ast_key(content_hash, language.value, original_filename_in_repo)
+            base_cache_key = scanned.get(cache.file_inputs_key(native_ast_key, manifest.github_url, path_mappings))
+            if base_cache_key is None:
+                missing.append(original_filename_in_repo)
+                continue
+
+            stored_filename = LocalStorage.mk_stored_filename(job_dir, language)
+            if not artifacts.link_source(content_hash, stored_filename):
+                missing.append(original_filename_in_repo)
+                continue
+
+            f = models.FileMetadata(
+                file_unique_id=str(stored_filename),
+                job_id=job_id,
+                original_filename=original_filename_in_repo,
+                language=language,
+                module_name_resolver=manifest.gomod,
+                github_url=manifest.github_url,
+                path_mappings=path_mappings,
+                content_hash=content_hash,
+                base_cache_key=base_cache_key
+            )
+            end = time.monotonic()
+            reused.append((f, stored_filename.stat().st_size, end - start))
+
+        return reused, missing
 
+    # ( num bytes, content hash, seconds )
     @staticmethod
-    def store_dhscanner_ast_metadata_in_db(a: models.DhscannerAstMetadata) -> None:
-        with db.SessionLocal() as session:
-            session.add(a)
-            session.commit()
+    def save_archive_member_on_disk(
+        content: typing.IO[bytes],
+        stored_filename: pathlib.Path,
+        artifacts: cache.ArtifactCache
+    ) -> tuple[int, str, float]:
+        start = time.monotonic()
+        content_hash = cache.new_content_hash()
+        with open(stored_filename, 'wb') as fl:
+            while chunk := content.read(COPY_CHUNK_NUM_BYTES):
+                content_hash.update(chunk)
+                fl.write(chunk)
+            num_bytes = fl.tell()
+        artifacts.adopt_source(stored_filename, content_hash.hexdigest())
+        end = time.monotonic()
+        return num_bytes, content_hash.hexdigest(), end - start
 
+    # ( de ) compression of large artifacts would stall every other request on the event loop
     @staticmethod
-    def store_callables_metadata_in_db(c: models.CallablesMetadata) -> None:
-        with db.SessionLocal() as session:
-            session.add(c)
-            session.commit()
+    async def save_artifact_on_disk(filename: str, content: bytes) -> None:
+        compressed = await asyncio.to_thread(compression.compress, content, ARTIFACTS_ENCODING)
+        async with aiofiles.open(filename, 'wb') as fl:
+            await fl.write(compressed)
 
+    # ( num bytes, content hash )
     @staticmethod
-    def store_kbgen_facts_metadata_in_db(c: models.FactsMetadata) -> None:
-        with db.SessionLocal() as session:
-            session.add(c)
-            session.commit()
+    async def save_on_disk(
+        content: typing.AsyncIterator[bytes],
+        stored_filename: pathlib.Path,
+    ) -> tuple[int, str]:
+        num_bytes = 0
+        content_hash = cache.new_content_hash()
+        async with aiofiles.open(stored_filename, 'wb') as fl:
+            async for chunk in content:
+                await fl.write(chunk)
+                content_hash.update(chunk)
+                num_bytes += len(chunk)
+        return num_bytes, content_hash.hexdigest()
 
     @staticmethod
+    @db.off_the_event_loop
     def store_results_metadata_in_db(r: models.ResultsMetadata) -> None:
         with db.SessionLocal() as session:
             session.add(r)
@@ -0,0 +1,254 @@
+import typing
+import asyncio
+import logging
+import sqlalchemy
+import dataclasses
+
+from sqlalchemy.orm import sessionmaker
+
+from storage import db
+from storage.models import Base, JobManifest
+
+MAX_NUM_BUFFERED_ROWS: typing.Final[int] = 256
+MAX_NUM_SECONDS_BETWEEN_FLUSHES: typing.Final[float] = 0.05
+
+# large flushes ( e.g. an entire uploaded archive ) still commit in a
+# single transaction, but keep every statement below the bound
+# parameters limit of the db ( sqlite allows 32766 of them )
+MAX_NUM_ROWS_PER_STATEMENT: typing.Final[int] = 1000
+
+# lost connections, busy ( or locked ) dbs and exhausted pools pass,
+# so the rows of those failures are retried for as long as they occur
+TRANSIENT_DB_ERRORS: typing.Final = (sqlalchemy.exc.OperationalError, sqlalchemy.exc.TimeoutError)
+
+# any other failure ( say a row the db rejects ) is retried that many times,
+# and then the batch is bisected, dropping only the rows that fail on their own
+MAX_NUM_ATTEMPTS_PER_BATCH: typing.Final[int] = 3
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=too-many-instance-attributes
+@dataclasses.dataclass
+class MetadataBuffer:
+    '''
+    write-behind buffer of metadata rows
+
+    ---
+
+    rows are grouped into one bulk insert ( single transaction ) per flush,
+    which happens once enough rows were buffered, once the oldest buffered
+    row waited long enough, or explicitly ( at the end of every stage )
+
+    the same transaction deletes the rows of deleted artifacts,
+    and accumulates the per stage counts of the job manifests
+    '''
+
+    session_factory: sessionmaker = db.SessionLocal
+    max_num_rows: int = MAX_NUM_BUFFERED_ROWS
+    max_num_seconds_between_flushes: float = MAX_NUM_SECONDS_BETWEEN_FLUSHES
+
+    rows: list[tuple[Base, int]] = dataclasses.field(default_factory=list, init=False)
+    deleted: list[Base] = dataclasses.field(default_factory=list, init=False)
+    committed: typing.Optional[asyncio.Future] = dataclasses.field(default=None, init=False)
+    timer: typing.Optional[asyncio.Task] = dataclasses.field(default=None, init=False)
+    lock: asyncio.Lock = dataclasses.field(default_factory=asyncio.Lock, init=False)
+    num_failed_attempts: int = dataclasses.field(default=0, init=False)
+
+    async def add(self, row: Base, num_bytes: int = 0) -> None:
+        self.rows.append((row, num_bytes))
+        await self.flush_if_needed()
+
+    # group commit: concurrent callers share the same transaction
+    async def add_and_wait(self, row: Base, num_bytes: int = 0) -> None:
+        if self.committed is None:
+            self.committed = asyncio.get_running_loop().create_future()
+        committed = self.committed
+        await self.add(row, num_bytes)
+        await asyncio.shield(committed)
+
+    # a single transaction for all the rows, committed before returning
+    async def add_all(self, rows: list[tuple[Base, int]]) -> None:
+        self.rows.extend(rows)
+        await self.flush()
+
+    async def delete(self, row: Base) -> None:
+        self.deleted.append(row)
+        await self.flush_if_needed()
+
+    async def flush_if_needed(self) -> None:
+        if len(self.rows) + len(self.deleted) >= self.max_num_rows:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self.flush_later())
+
+    # shielded, so that a cancelled caller never leaves
+    # the rows ( and whoever waits for them ) half flushed
+    async def flush(self) -> None:
+        await asyncio.shield(self.flush_buffered_rows())
+
+    async def flush_buffered_rows(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = None
+
+        # a flush returns only after every row added before it was committed,
+        # including rows already taken by flushes that are still in flight
+        async with self.lock:
+            rows, self.rows = self.rows, []
+            deleted, self.deleted = self.deleted, []
+            committed, self.committed = self.committed, None
+            if not rows and not deleted:
+                return
+
+            try:
+                await self.write_batch(rows, deleted)
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                # nothing is lost, the rows are retried by the next flush
+                self.rows[:0] = rows
+                self.deleted[:0] = deleted
+                if committed is not None:
+                    committed.set_exception(e)
+                raise
+
+            if committed is not None:
+                committed.set_result(None)
+
+    async def write_batch(self, rows: list[tuple[Base, int]], deleted: list[Base]) -> None:
+        try:
+            await self.write(rows, deleted)
+        except TRANSIENT_DB_ERRORS:
+            raise
+        except sqlalchemy.exc.SQLAlchemyError:
+            self.num_failed_attempts += 1
+            if self.num_failed_attempts < MAX_NUM_ATTEMPTS_PER_BATCH:
+                raise
+            await self.write_bisected(rows, deleted)
+
+        self.num_failed_attempts = 0
+
+    async def write_bisected(self, rows: list[tuple[Base, int]], deleted: list[Base]) -> None:
+        '''
+        write every part of a batch that keeps failing on its own
+
+        ---
+
+        the parts are halved down to single rows, and the ones the db still rejects are dropped.
+        a transient failure on the way re-raises: the parts already written are
+        written again by the next flush ( inserts skip existing rows, deletes are idempotent )
+        '''
+        if not rows and not deleted:
+            return
+
+        try:
+            await self.write(rows, deleted)
+            return
+        except TRANSIENT_DB_ERRORS:
+            raise
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            if len(rows) + len(deleted) == 1:
+                for row in [row for row, _ in rows] + deleted:
+                    logger.error('dropped metadata row %s %s: %s', row.__tablename__, MetadataBuffer.primary_key_of(row), e)
+                return
+
+        if rows and deleted:
+            await self.write_bisected(rows, [])
+            await self.write_bisected([], deleted)
+            return
+
+        await self.write_bisected(rows[:len(rows) // 2], deleted[:len(deleted) // 2])
+        await self.write_bisected(rows[len(rows) // 2:], deleted[len(deleted) // 2:])
+
+    async def flush_later(self) -> None:
+        await asyncio.sleep(self.max_num_seconds_between_flushes)
+        self.timer = None
+        try:
+            await self.flush()
+        except sqlalchemy.exc.SQLAlchemyError:
+            # surfaces on the next explicit flush
+            pass
+
+    # rows that already exist ( a shard re-claimed after a lost lease )
+    # are skipped, so one duplicate never fails the entire batch
+    @db.off_the_event_loop
+    def write(self, rows: list[tuple[Base, int]], deleted: list[Base]) -> None:
+        with self.session_factory() as session:
+            dialect_name = session.get_bind().dialect.name
+            if manifests := MetadataBuffer.insert_rows(session, dialect_name, rows):
+                MetadataBuffer.accumulate_manifests(session, dialect_name, manifests)
+            MetadataBuffer.delete_rows(session, deleted)
+            session.commit()
+
+    # returns the number of artifacts and bytes actually inserted per ( job, stage )
+    @staticmethod
+    def insert_rows(
+        session: sqlalchemy.orm.Session,
+        dialect_name: str,
+        rows: list[tuple[Base, int]]
+    ) -> dict[tuple[str, str], tuple[int, int]]:
+        rows_of_model: dict[type[Base], dict[typing.Any, tuple[Base, int]]] = {}
+        for row, num_bytes in rows:
+            rows_of_model.setdefault(type(row), {})[MetadataBuffer.primary_key_of(row)] = (row, num_bytes)
+
+        manifests: dict[tuple[str, str], tuple[int, int]] = {}
+        for model, rows_by_key in rows_of_model.items():
+            values = [MetadataBuffer.as_dict(row) for row, _ in rows_by_key.values()]
+            for i in range(0, len(values), MAX_NUM_ROWS_PER_STATEMENT):
+                stmt = db.insert(model, dialect_name).values(values[i:i + MAX_NUM_ROWS_PER_STATEMENT])
+                stmt = stmt.on_conflict_do_nothing().returning(MetadataBuffer.primary_key_column_of(model))
+                inserted = session.execute(stmt).scalars().all()
+                MetadataBuffer.count_inserted(manifests, model, [rows_by_key[key] for key in inserted])
+
+        return manifests
+
+    @staticmethod
+    def count_inserted(
+        manifests: dict[tuple[str, str], tuple[int, int]],
+        model: type[Base],
+        inserted: list[tuple[Base, int]]
+    ) -> None:
+        for row, num_bytes in inserted:
+            manifest = (getattr(row, 'job_id'), model.__tablename__)
+            num_artifacts, total_num_bytes = manifests.get(manifest, (0, 0))
+            manifests[manifest] = (num_artifacts + 1, total_num_bytes + num_bytes)
+
+    @staticmethod
+    def delete_rows(session: sqlalchemy.orm.Session, rows: list[Base]) -> None:
+        keys_of_model: dict[type[Base], list[typing.Any]] = {}
+        for row in rows:
+            keys_of_model.setdefault(type(row), []).append(MetadataBuffer.primary_key_of(row))
+
+        for model, keys in keys_of_model.items():
+            condition_is_satisfied = MetadataBuffer.primary_key_column_of(model).in_(keys)
+            session.execute(sqlalchemy.delete(model).where(condition_is_satisfied))
+
+    @staticmethod
+    def accumulate_manifests(
+        session: sqlalchemy.orm.Session,
+        dialect_name: str,
+        manifests: dict[tuple[str, str], tuple[int, int]]
+    ) -> None:
+        values = [
+            {'job_id': job_id, 'stage': stage, 'num_artifacts': num_artifacts, 'num_bytes': num_bytes}
+            for (job_id, stage), (num_artifacts, num_bytes) in manifests.items()
+        ]
+        stmt = db.insert(JobManifest, dialect_name).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[JobManifest.job_id, JobManifest.stage],
+            set_={
+                'num_artifacts': JobManifest.num_artifacts + stmt.excluded.num_artifacts,
+                'num_bytes': JobManifest.num_bytes + stmt.excluded.num_bytes
+            }
+        )
+        session.execute(stmt)
+
+    @staticmethod
+    def primary_key_column_of(model: type[Base]) -> sqlalchemy.ColumnElement:
+        return sqlalchemy.inspect(model).primary_key[0]
+
+    @staticmethod
+    def primary_key_of(row: Base) -> typing.Any:
+        return sqlalchemy.inspect(type(row)).primary_key_from_instance(row)[0]
+
+    @staticmethod
+    def as_dict(row: Base) -> dict[str, typing.Any]:
+        return {c.key: getattr(row, c.key) for c in row.__table__.columns}
@@ -17,12 +17,14 @@ class FileMetadata(Base):
     __tablename__ = 'files'
 
     file_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
-    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
     original_filename: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     language: Mapped[Language] = mapped_column(sqlalchemy.Enum(Language), nullable=False)
     module_name_resolver: Mapped[str] = mapped_column(sqlalchemy.String, nullable=True)
     github_url: Mapped[str] = mapped_column(sqlalchemy.String, nullable=True)
     path_mappings: Mapped[typing.Optional[list[dict[str, str]]]] = mapped_column(sqlalchemy.JSON, nullable=True)
+    content_hash: Mapped[typing.Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
+    base_cache_key: Mapped[typing.Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
 
 # pylint: disable=too-few-public-methods
 class NativeAstMetadata(Base):
@@ -38,17 +40,19 @@ class NativeAstMetadata(Base):
     - `module_name_resolver`: `typing.Optional[str]` ( like the module in `go.mod` )
     - `github_url`: `typing.Optional[str]`
     - `path_mappings`: `typing.Optional[list[dict[str, str]]]` ( JSON: [{"from": ..., "to": ...}] )
+    - `cache_key`: `typing.Optional[str]` ( see `storage/cache.py` )
     '''
 
     __tablename__ = 'native_asts'
 
     native_ast_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
-    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
     original_filename: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     language: Mapped[Language] = mapped_column(sqlalchemy.Enum(Language), nullable=False)
     module_name_resolver: Mapped[str] = mapped_column(sqlalchemy.String, nullable=True)
     github_url: Mapped[str] = mapped_column(sqlalchemy.String, nullable=True)
     path_mappings: Mapped[typing.Optional[list[dict[str, str]]]] = mapped_column(sqlalchemy.JSON, nullable=True)
+    cache_key: Mapped[typing.Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
 
 # pylint: disable=too-few-public-methods
 class DhscannerAstMetadata(Base):
@@ -61,14 +65,16 @@ class DhscannerAstMetadata(Base):
     - `job_id`: `str`
     - `original_filename`: `str`
     - `language`: `Language`
+    - `cache_key`: `typing.Optional[str]` ( see `storage/cache.py` )
     '''
 
     __tablename__ = 'dhscanner_asts'
 
     dhscanner_ast_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
-    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
     original_filename: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     language: Mapped[Language] = mapped_column(sqlalchemy.Enum(Language), nullable=False)
+    cache_key: Mapped[typing.Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
 
 # pylint: disable=too-few-public-methods
 class CallablesMetadata(Base):
@@ -82,15 +88,17 @@ class CallablesMetadata(Base):
     - `job_id`: `str`
     - `original_filename`: `str`
     - `language`: `Language`
+    - `cache_key`: `typing.Optional[str]` ( see `storage/cache.py` )
     '''
 
     __tablename__ = 'callables'
 
     callable_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
     num_callables: Mapped[int] = mapped_column(sqlalchemy.Integer, nullable=False)
-    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
     original_filename: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     language: Mapped[Language] = mapped_column(sqlalchemy.Enum(Language), nullable=False)
+    cache_key: Mapped[typing.Optional[str]] = mapped_column(sqlalchemy.String, nullable=True)
 
 # pylint: disable=too-few-public-methods
 class FactsMetadata(Base):
@@ -108,7 +116,7 @@ class FactsMetadata(Base):
     __tablename__ = 'knowledge_base_facts'
 
     facts_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
-    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
     original_filename: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
     language: Mapped[Language] = mapped_column(sqlalchemy.Enum(Language), nullable=False)
 
@@ -125,4 +133,44 @@ class ResultsMetadata(Base):
     __tablename__ = 'results'
 
     results: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
-    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
+
+# pylint: disable=too-few-public-methods
+class ScannedFileMetadata(Base):
+    '''
+    Initialize with keywords
+
+    ---
+
+    - `scanned_file_unique_id`: `str` ( primary, the dhscanner ast of the file )
+    - `job_id`: `str`
+    - `inputs_key`: `str` ( see `storage/cache.py` )
+    - `cache_key`: `str` ( the dhscanner ast key )
+
+    outlives the job, as the base of later rescans
+    '''
+    __tablename__ = 'scanned_files'
+
+    scanned_file_unique_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False, index=True)
+    inputs_key: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+    cache_key: Mapped[str] = mapped_column(sqlalchemy.String, nullable=False)
+
+# pylint: disable=too-few-public-methods
+class JobManifest(Base):
+    '''
+    Initialize with keywords
+
+    ---
+
+    - `job_id`: `str` ( primary )
+    - `stage`: `str` ( primary, the table of the stage artifacts, like `native_asts` )
+    - `num_artifacts`: `int`
+    - `num_bytes`: `int`
+    '''
+    __tablename__ = 'job_manifests'
+
+    job_id: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    stage: Mapped[str] = mapped_column(sqlalchemy.String, primary_key=True)
+    num_artifacts: Mapped[int] = mapped_column(sqlalchemy.Integer, nullable=False, default=0)
+    num_bytes: Mapped[int] = mapped_column(sqlalchemy.BigInteger, nullable=False, default=0)
@@ -0,0 +1,99 @@
+import io
+import typing
+import tarfile
+import zipfile
+import threading
+import pytest
+import zstandard
+
+from storage import archive
+from storage.archive import ArchiveFormat, ChunksReader
+
+FILES: typing.Final[dict[str, bytes]] = {
+    'main.py': b'print("hello")\n',
+    'src/app.js': b'console.log("hello")\n' * 5000,
+    'empty.go': b''
+}
+
+def mk_tar(files: dict[str, bytes], mode: typing.Literal['w', 'w:gz']) -> bytes:
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode=mode) as tar:
+        directory = tarfile.TarInfo('./src')
+        directory.type = tarfile.DIRTYPE
+        tar.addfile(directory)
+        for name, data in files.items():
+            info = tarfile.TarInfo(f'./{name}')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return content.getvalue()
+
+def mk_zip(files: dict[str, bytes]) -> bytes:
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('src/', b'')
+        for name, data in files.items():
+            z.writestr(name, data)
+    return content.getvalue()
+
+def mk_archive(archive_format: ArchiveFormat) -> bytes:
+    match archive_format:
+        case ArchiveFormat.TAR:
+            return mk_tar(FILES, 'w')
+        case ArchiveFormat.TAR_GZ:
+            return mk_tar(FILES, 'w:gz')
+        case ArchiveFormat.TAR_ZST:
+            return zstandard.ZstdCompressor().compress(mk_tar(FILES, 'w'))
+        case ArchiveFormat.ZIP:
+            return mk_zip(FILES)
+
+# fed in small chunks from another thread, like the upload endpoint does
+def extract(content: bytes, archive_format: ArchiveFormat) -> dict[str, bytes]:
+    reader = ChunksReader()
+
+    def feed() -> None:
+        for i in range(0, len(content), 1000):
+            reader.feed(content[i:i + 1000])
+        reader.feed(None)
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    try:
+        return {
+            name: member.read()
+            for name, member in archive.members(io.BufferedReader(reader), archive_format)
+        }
+    finally:
+        reader.abandon()
+        feeder.join(timeout=5)
+        assert not feeder.is_alive()
+
+@pytest.mark.parametrize('archive_format', list(ArchiveFormat))
+def test_regular_files_are_extracted(archive_format: ArchiveFormat) -> None:
+    assert extract(mk_archive(archive_format), archive_format) == FILES
+
+@pytest.mark.parametrize('archive_format', list(ArchiveFormat))
+def test_truncated_archive_is_unreadable(archive_format: ArchiveFormat) -> None:
+    content = mk_archive(archive_format)
+    with pytest.raises(archive.UNREADABLE_ARCHIVE_ERRORS):
+        extract(content[:len(content) // 2], archive_format)
+
+@pytest.mark.parametrize('archive_format', list(ArchiveFormat))
+def test_garbage_is_unreadable(archive_format: ArchiveFormat) -> None:
+    with pytest.raises(archive.UNREADABLE_ARCHIVE_ERRORS):
+        extract(b'not an archive at all' * 100, archive_format)
+
+def test_abandoned_reader_never_blocks_the_feeder() -> None:
+    reader = ChunksReader()
+    for _ in range(archive.MAX_NUM_PENDING_CHUNKS):
+        reader.feed(b'chunk')
+    reader.abandon()
+    reader.feed(b'one too many')
+
+def test_manifest() -> None:
+    manifest = archive.read_manifest(io.BytesIO(
+        b'{"gomod": "example.com/m", "path_mappings": {"a.py": [{"from": "x", "to": "y"}], "b.py": "bad"}}'
+    ))
+    assert manifest.gomod == 'example.com/m'
+    assert manifest.github_url is None
+    assert manifest.path_mappings == {'a.py': [{'from': 'x', 'to': 'y'}]}
+    assert archive.read_manifest(io.BytesIO(b'\xff not json')) == archive.Manifest()
@@ -0,0 +1,47 @@
+import pytest
+
+from common.language import Language
+from storage.models import FileMetadata
+from workers.native_parser import batching
+from workers.native_parser.batching import Source
+
+def mk_source(i: int, language: Language, num_bytes: int) -> Source:
+    f = FileMetadata(
+        file_unique_id=f'file{i}',
+        job_id='job',
+        original_filename=f'file{i}',
+        language=language
+    )
+    return Source(f=f, code=b'x' * num_bytes, key=None)
+
+def ids(packed: list[list[Source]]) -> list[list[str]]:
+    return [[source.f.file_unique_id for source in batch] for batch in packed]
+
+def test_no_sources() -> None:
+    assert not batching.batches([])
+
+def test_batches_are_of_a_single_language() -> None:
+    sources = [mk_source(i, [Language.PY, Language.JS][i % 2], 10) for i in range(6)]
+    packed = batching.batches(sources)
+    assert len(packed) == 2
+    assert all(len({source.f.language for source in batch}) == 1 for batch in packed)
+    assert sorted(ids(packed)) == [['file0', 'file2', 'file4'], ['file1', 'file3', 'file5']]
+
+def test_batches_are_bounded_by_the_number_of_files() -> None:
+    n = 2 * batching.MAX_NUM_FILES_PER_BATCH + 1
+    packed = batching.batches([mk_source(i, Language.PY, 10) for i in range(n)])
+    assert [len(batch) for batch in packed] == [batching.MAX_NUM_FILES_PER_BATCH] * 2 + [1]
+    assert sum(ids(packed), []) == [f'file{i}' for i in range(n)]
+
+def test_batches_are_bounded_by_the_number_of_bytes() -> None:
+    num_bytes = batching.MAX_NUM_BYTES_PER_BATCH // 3
+    packed = batching.batches([mk_source(i, Language.PY, num_bytes) for i in range(7)])
+    assert [len(batch) for batch in packed] == [3, 3, 1]
+
+@pytest.mark.parametrize('position', [0, 1, 2])
+def test_oversized_source_is_a_batch_of_its_own(position: int) -> None:
+    sources = [mk_source(i, Language.PY, 10) for i in range(2)]
+    sources.insert(position, mk_source(9, Language.PY, batching.MAX_NUM_BYTES_PER_BATCH + 1))
+    packed = batching.batches(sources)
+    assert ['file9'] in ids(packed)
+    assert sum(len(batch) for batch in packed) == 3
@@ -0,0 +1,57 @@
+import os
+import pathlib
+
+from common import compression
+from storage import cache as cache_module
+from storage.cache import ArtifactCache, CachedStage
+
+def put_at(cache: ArtifactCache, key: str, num_bytes: int, mtime: float) -> pathlib.Path:
+    cache.put(CachedStage.FACTS, key, b'x' * num_bytes)
+    blob = cache.path(CachedStage.FACTS, key)
+    os.utime(blob, (mtime, mtime))
+    return blob
+
+def test_round_trip(tmp_path: pathlib.Path) -> None:
+    cache = ArtifactCache(root=tmp_path, encoding=compression.Encoding.ZSTD)
+    assert cache.get(CachedStage.FACTS, 'ab12') is None
+    cache.put(CachedStage.FACTS, 'ab12', b'facts')
+    assert cache.get(CachedStage.FACTS, 'ab12') == b'facts'
+    assert compression.encoding_of(cache.path(CachedStage.FACTS, 'ab12').read_bytes()) == compression.Encoding.ZSTD
+    assert cache.hits[CachedStage.FACTS] == 1
+    assert cache.misses[CachedStage.FACTS] == 1
+
+def test_nothing_is_evicted_below_the_max(tmp_path: pathlib.Path) -> None:
+    cache = ArtifactCache(root=tmp_path, max_num_bytes=1000)
+    blobs = [put_at(cache, f'key{i}', 100, 1000 + i) for i in range(10)]
+    assert cache.evict() == (0, 0)
+    assert all(blob.exists() for blob in blobs)
+
+def test_least_recently_used_blobs_are_evicted_first(tmp_path: pathlib.Path) -> None:
+    cache = ArtifactCache(root=tmp_path, max_num_bytes=1000)
+    blobs = [put_at(cache, f'key{i}', 100, 1000 + i) for i in range(12)]
+
+    # evicted down to 90% of the max
+    assert cache.evict() == (3, 300)
+    assert [blob.exists() for blob in blobs] == [False] * 3 + [True] * 9
+
+def test_a_hit_makes_the_blob_recently_used(tmp_path: pathlib.Path) -> None:
+    cache = ArtifactCache(root=tmp_path, max_num_bytes=1000)
+    blobs = [put_at(cache, f'key{i}', 100, 1000 + i) for i in range(11)]
+    assert cache.get(CachedStage.FACTS, 'key0') is not None
+
+    assert cache.evict() == (2, 200)
+    assert [blob.exists() for blob in blobs] == [True, False, False] + [True] * 8
+
+def test_stats_are_reported_once_in_a_while(tmp_path: pathlib.Path) -> None:
+    cache = ArtifactCache(root=tmp_path)
+    cache.put(CachedStage.CALLABLES, 'ab12', b'callables')
+    assert cache.get(CachedStage.CALLABLES, 'ab12') is not None
+    assert cache.get(CachedStage.CALLABLES, 'cd34') is None
+    assert cache.get(CachedStage.CALLABLES, 'ef56') is None
+    assert cache.stats_if_needed() is None
+
+    cache.last_stats_report_at -= cache_module.NUM_SECONDS_BETWEEN_STATS_REPORTS
+    assert cache.stats_if_needed() == [
+        {'stage': 'callables', 'num_hits': 1, 'num_misses': 2, 'hit_ratio': 1 / 3}
+    ]
+    assert cache.stats_if_needed() is None
@@ -0,0 +1,83 @@
+import asyncio
+import typing
+import pytest
+
+from common import compression
+from common.compression import Encoding
+
+CONTENT: typing.Final[bytes] = b'{"facts": ["calls(a, b)"]}\n' * 1000
+
+@pytest.mark.parametrize('encoding', list(Encoding))
+def test_round_trip(encoding: Encoding) -> None:
+    compressed = compression.compress(CONTENT, encoding)
+    assert len(compressed) < len(CONTENT)
+    assert compression.encoding_of(compressed) == encoding
+    assert compression.decompress(compressed) == CONTENT
+
+def test_uncompressed_content_is_left_as_is() -> None:
+    assert compression.compress(CONTENT, None) == CONTENT
+    assert compression.encoding_of(CONTENT) is None
+    assert compression.decompress(CONTENT) == CONTENT
+
+def test_magic_bytes() -> None:
+    assert compression.encoding_of(compression.ZSTD_MAGIC + b'rest') == Encoding.ZSTD
+    assert compression.encoding_of(compression.GZIP_MAGIC + b'rest') == Encoding.GZIP
+    assert compression.encoding_of(b'') is None
+
+def test_corrupted_content_is_unreadable() -> None:
+    with pytest.raises(compression.UNREADABLE_ENCODING_ERRORS):
+        compression.decompress(compression.ZSTD_MAGIC + b'garbage')
+    with pytest.raises(compression.UNREADABLE_ENCODING_ERRORS):
+        compression.decompress(compression.GZIP_MAGIC + b'garbage')
+
+@pytest.mark.parametrize('encoding', list(Encoding))
+def test_decompress_at_most(encoding: Encoding) -> None:
+    compressed = encoding.compress(CONTENT)
+    assert encoding.decompress_at_most(compressed, len(CONTENT)) == CONTENT
+    assert encoding.decompress_at_most(compressed, len(CONTENT) - 1) is None
+
+@pytest.mark.parametrize('encoding', list(Encoding))
+def test_decompression_bomb_is_never_decompressed_entirely(encoding: Encoding) -> None:
+    bomb = encoding.compress(bytes(64 * 1024 * 1024))
+    assert encoding.decompress_at_most(bomb, 1024) is None
+
+def collect(content: bytes, encoding: typing.Optional[Encoding], max_num_bytes: int) -> bytes:
+
+    async def chunks() -> typing.AsyncIterator[bytes]:
+        for i in range(0, len(content), 7):
+            yield content[i:i + 7]
+
+    async def decompressed() -> bytes:
+        return b''.join([chunk async for chunk in compression.decompressed(chunks(), encoding, max_num_bytes)])
+
+    return asyncio.run(decompressed())
+
+@pytest.mark.parametrize('encoding', [None, *Encoding])
+def test_decompressed_chunks(encoding: typing.Optional[Encoding]) -> None:
+    compressed = compression.compress(CONTENT, encoding)
+    assert collect(compressed, encoding, len(CONTENT)) == CONTENT
+
+@pytest.mark.parametrize('encoding', list(Encoding))
+def test_decompressed_concatenated_frames(encoding: Encoding) -> None:
+    compressed = encoding.compress(CONTENT) + encoding.compress(CONTENT)
+    assert collect(compressed, encoding, 2 * len(CONTENT)) == CONTENT + CONTENT
+
+@pytest.mark.parametrize('encoding', list(Encoding))
+def test_truncated_chunks_are_unreadable(encoding: Encoding) -> None:
+    compressed = encoding.compress(CONTENT)
+    with pytest.raises(compression.UNREADABLE_ENCODING_ERRORS):
+        collect(compressed[:-4], encoding, len(CONTENT))
+    with pytest.raises(compression.UNREADABLE_ENCODING_ERRORS):
+        compression.decompress(compressed[:-4])
+
+@pytest.mark.parametrize('encoding', [None, *Encoding])
+def test_decompressed_chunks_are_bounded(encoding: typing.Optional[Encoding]) -> None:
+    compressed = compression.compress(CONTENT, encoding)
+    with pytest.raises(compression.TooLargeContent):
+        collect(compressed, encoding, len(CONTENT) - 1)
+
+@pytest.mark.parametrize('encoding', list(Encoding))
+def test_decompressed_bomb_is_never_decompressed_entirely(encoding: Encoding) -> None:
+    bomb = encoding.compress(bytes(64 * 1024 * 1024))
+    with pytest.raises(compression.TooLargeContent):
+        collect(bomb, encoding, 1024)
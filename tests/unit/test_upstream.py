@@ -0,0 +1,249 @@
+import http
+import asyncio
+import pytest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from logger.client import Logger
+from workers import upstream
+from workers.upstream import AdaptiveLimit, Circuit, CircuitBreaker, UpstreamUnavailable, Upstreams
+
+def test_limit_increases_additively_on_healthy_responses() -> None:
+    limit = AdaptiveLimit(limit=4)
+    limit.adapt(0.1, True)
+    assert limit.limit == pytest.approx(4.25)
+    limit.adapt(0.1, True)
+    assert limit.limit == pytest.approx(4.25 + 1 / 4.25)
+
+def test_limit_never_exceeds_max_concurrency() -> None:
+    limit = AdaptiveLimit(limit=upstream.MAX_CONCURRENCY - 0.01)
+    limit.adapt(0.1, True)
+    assert limit.limit == upstream.MAX_CONCURRENCY
+
+def test_limit_halves_on_errors_at_most_once_per_round_trip() -> None:
+    limit = AdaptiveLimit(limit=16)
+    limit.adapt(0.1, False)
+    assert limit.limit == 8
+    # reported by the requests that were in flight together
+    limit.adapt(0.1, False)
+    assert limit.limit == 8
+    limit.last_decrease_at -= 1
+    limit.adapt(0.1, False)
+    assert limit.limit == 4
+
+def test_limit_decreases_gently_on_growing_latency() -> None:
+    limit = AdaptiveLimit(limit=10)
+    limit.adapt(0.1, True)
+    limit.adapt(5.0, True)
+    assert limit.smoothed_latency is not None
+    assert limit.smoothed_latency > 0.1 * upstream.LATENCY_TOLERANCE
+    assert limit.limit == pytest.approx((10 + 1 / 10) * upstream.DECREASE_RATIO_ON_LATENCY)
+
+def test_limit_never_drops_below_min_concurrency() -> None:
+    limit = AdaptiveLimit(limit=1)
+    limit.adapt(0.1, False)
+    assert limit.limit == upstream.MIN_CONCURRENCY
+
+def test_acquire_waits_for_a_release() -> None:
+    async def scenario() -> None:
+        limit = AdaptiveLimit(limit=1)
+        await limit.acquire()
+        waiting = asyncio.create_task(limit.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        await limit.release(None, True)
+        await asyncio.wait_for(waiting, timeout=1)
+        assert limit.in_flight == 1
+
+    asyncio.run(scenario())
+
+async def fail(breaker: CircuitBreaker, n: int) -> list[bool]:
+    return [await breaker.record(False, probe=False) for _ in range(n)]
+
+# the cool down is over ( without waiting for it )
+def cool_down(breaker: CircuitBreaker) -> None:
+    assert breaker.opened_at is not None
+    breaker.opened_at -= breaker.num_seconds_open
+
+def test_circuit_opens_after_consecutive_failures() -> None:
+    async def scenario() -> None:
+        breaker = CircuitBreaker()
+        changed = await fail(breaker, upstream.NUM_FAILURES_TO_OPEN_CIRCUIT)
+        assert changed == [False] * (upstream.NUM_FAILURES_TO_OPEN_CIRCUIT - 1) + [True]
+        assert breaker.circuit == Circuit.OPEN
+
+    asyncio.run(scenario())
+
+def test_success_resets_the_consecutive_failures() -> None:
+    async def scenario() -> None:
+        breaker = CircuitBreaker()
+        await fail(breaker, upstream.NUM_FAILURES_TO_OPEN_CIRCUIT - 1)
+        await breaker.record(True, probe=False)
+        await fail(breaker, upstream.NUM_FAILURES_TO_OPEN_CIRCUIT - 1)
+        assert breaker.circuit == Circuit.CLOSED
+        assert await breaker.wait_until_dispatch_allowed() is False
+
+    asyncio.run(scenario())
+
+def test_circuit_closes_after_a_successful_probe() -> None:
+    async def scenario() -> None:
+        breaker = CircuitBreaker()
+        await fail(breaker, upstream.NUM_FAILURES_TO_OPEN_CIRCUIT)
+        waiting = asyncio.create_task(breaker.wait_until_dispatch_allowed())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        waiting.cancel()
+
+        cool_down(breaker)
+        assert await breaker.wait_until_dispatch_allowed() is True
+
+        assert await breaker.record(True, probe=True) is True
+        assert breaker.circuit == Circuit.CLOSED
+        assert breaker.num_seconds_open == upstream.MIN_NUM_SECONDS_OF_OPEN_CIRCUIT
+        assert await breaker.wait_until_dispatch_allowed() is False
+
+    asyncio.run(scenario())
+
+def test_failing_probe_reopens_the_circuit_for_longer() -> None:
+    async def scenario() -> None:
+        breaker = CircuitBreaker()
+        await fail(breaker, upstream.NUM_FAILURES_TO_OPEN_CIRCUIT)
+        cool_down(breaker)
+        assert await breaker.wait_until_dispatch_allowed() is True
+
+        # a single probe at a time, the others keep waiting for it
+        other = asyncio.create_task(breaker.wait_until_dispatch_allowed())
+        await asyncio.sleep(0)
+        assert not other.done()
+
+        assert await breaker.record(False, probe=True) is False
+        assert breaker.circuit == Circuit.OPEN
+        assert breaker.num_seconds_open == 2 * upstream.MIN_NUM_SECONDS_OF_OPEN_CIRCUIT
+        assert await asyncio.wait_for(other, timeout=1) is None
+
+        cool_down(breaker)
+        assert await breaker.wait_until_dispatch_allowed() is True
+        assert await breaker.record(True, probe=True) is True
+        assert breaker.circuit == Circuit.CLOSED
+
+    asyncio.run(scenario())
+
+def test_open_circuit_stays_open_for_at_most_the_max() -> None:
+    async def scenario() -> None:
+        breaker = CircuitBreaker()
+        await fail(breaker, upstream.NUM_FAILURES_TO_OPEN_CIRCUIT)
+        for _ in range(10):
+            cool_down(breaker)
+            assert await breaker.wait_until_dispatch_allowed() is True
+            await breaker.record(False, probe=True)
+        assert breaker.num_seconds_open == upstream.MAX_NUM_SECONDS_OF_OPEN_CIRCUIT
+
+    asyncio.run(scenario())
+
+async def serve(statuses: list[int], num_seconds_per_response: float = 0) -> tuple[TestServer, list[int]]:
+    received: list[int] = []
+
+    async def handler(_: web.Request) -> web.Response:
+        received.append(len(received))
+        await asyncio.sleep(num_seconds_per_response)
+        return web.Response(status=statuses[min(len(received), len(statuses)) - 1], text='answer')
+
+    app = web.Application()
+    app.router.add_post('/endpoint', handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server, received
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(upstream, 'backoff', lambda attempt, first: 0)
+
+def test_transient_failures_are_retried() -> None:
+    async def scenario() -> None:
+        server, received = await serve([http.HTTPStatus.SERVICE_UNAVAILABLE, http.HTTPStatus.OK])
+        upstreams = Upstreams(Logger())
+        try:
+            async with upstreams.post(str(server.make_url('/endpoint')), timeout=5) as response:
+                assert response.status == http.HTTPStatus.OK
+                assert await response.text() == 'answer'
+        finally:
+            await upstreams.get_session().close()
+            await server.close()
+
+        assert len(received) == 2
+        [stats] = upstreams.stats()
+        assert stats['num_retries'] == 1
+        assert stats['num_failures'] == 1
+
+    asyncio.run(scenario())
+
+def test_exhausted_retries_raise_upstream_unavailable() -> None:
+    async def scenario() -> None:
+        server, received = await serve([http.HTTPStatus.SERVICE_UNAVAILABLE])
+        upstreams = Upstreams(Logger())
+        try:
+            with pytest.raises(UpstreamUnavailable, match='http status 503'):
+                async with upstreams.post(str(server.make_url('/endpoint')), timeout=5):
+                    pytest.fail('no response was expected')
+        finally:
+            await upstreams.get_session().close()
+            await server.close()
+
+        assert len(received) == upstream.MAX_NUM_ATTEMPTS
+
+    asyncio.run(scenario())
+
+def test_other_errors_are_handed_over_without_retries() -> None:
+    async def scenario() -> None:
+        server, received = await serve([http.HTTPStatus.BAD_REQUEST])
+        upstreams = Upstreams(Logger())
+        try:
+            async with upstreams.post(str(server.make_url('/endpoint')), timeout=5) as response:
+                assert response.status == http.HTTPStatus.BAD_REQUEST
+        finally:
+            await upstreams.get_session().close()
+            await server.close()
+
+        assert len(received) == 1
+
+    asyncio.run(scenario())
+
+def test_callers_may_send_fewer_attempts() -> None:
+    async def scenario() -> None:
+        server, received = await serve([http.HTTPStatus.SERVICE_UNAVAILABLE])
+        upstreams = Upstreams(Logger())
+        try:
+            with pytest.raises(UpstreamUnavailable, match='2 attempts'):
+                async with upstreams.post(str(server.make_url('/endpoint')), timeout=5, max_num_attempts=2):
+                    pytest.fail('no response was expected')
+        finally:
+            await upstreams.get_session().close()
+            await server.close()
+
+        assert len(received) == 2
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize('retry_timeouts', [True, False])
+def test_timeouts_are_retried_unless_told_otherwise(retry_timeouts: bool) -> None:
+    async def scenario() -> None:
+        server, received = await serve([http.HTTPStatus.OK], num_seconds_per_response=1)
+        upstreams = Upstreams(Logger())
+        expected = UpstreamUnavailable if retry_timeouts else TimeoutError
+        try:
+            with pytest.raises(expected):
+                async with upstreams.post(
+                    str(server.make_url('/endpoint')),
+                    timeout=0.1,
+                    max_num_attempts=2,
+                    retry_timeouts=retry_timeouts
+                ):
+                    pytest.fail('no response was expected')
+        finally:
+            await upstreams.get_session().close()
+            await server.close()
+
+        assert len(received) == (2 if retry_timeouts else 1)
+
+    asyncio.run(scenario())
@@ -1,3 +1,4 @@
+import os
 import http
 import json
 import time
@@ -8,51 +9,126 @@ import dataclasses
 
 from datetime import timedelta
 
-from coordinator.interface import Status
-from workers.interface import AbstractWorker
+from coordinator.interface import Shard, Status
+from storage import cache
+from workers.interface import AbstractWorker, json_request
+from workers.upstream import UpstreamUnavailable
 from logger.models import Context, LogMessage
 from storage.models import DhscannerAstMetadata
 
 TO_CODEGEN_URL = 'http://codegen:3000/codegen'
 
+NUM_SECONDS_PER_REQUEST: typing.Final[float] = float(os.getenv('CODEGEN_NUM_SECONDS_PER_REQUEST', '60'))
+
 @dataclasses.dataclass(frozen=True)
 class Codegen(AbstractWorker):
 
     @typing.override
     async def run(self, job_id: str) -> None:
-        dhscanner_asts = self.the_storage_guy.load_dhscanner_asts_metadata_from_db(job_id)
-        async with aiohttp.ClientSession() as s:
-            tasks = [self.codegen_single_dhscanner_ast(s, d) for d in dhscanner_asts]
-            await asyncio.gather(*tasks)
+        dhscanner_asts = await self.the_storage_guy.load_dhscanner_asts_metadata_from_db(job_id)
+        await self.codegen_dhscanner_asts(job_id, dhscanner_asts)
+
+    # only jobs analyzed in streaming mode reach codegen in shards
+    @typing.override
+    async def run_shard(self, shard: Shard) -> None:
+        if shard.num_shards == 1:
+            await self.run(shard.job_id)
+            return
+
+        files = shard.select(await self.the_storage_guy.load_files_metadata_from_db(shard.job_id))
+        dhscanner_asts = await self.the_storage_guy.load_dhscanner_asts_metadata_of_files_from_db(files)
+        await self.codegen_dhscanner_asts(shard.job_id, dhscanner_asts)
+
+    async def codegen_dhscanner_asts(self, job_id: str, dhscanner_asts: list[DhscannerAstMetadata]) -> None:
+        await self.run_with_requeues(job_id, dhscanner_asts, self.run_dhscanner_asts)
+
+    # returns the dhscanner asts to requeue
+    async def run_dhscanner_asts(
+        self,
+        dhscanner_asts: list[DhscannerAstMetadata],
+        give_up: bool
+    ) -> list[DhscannerAstMetadata]:
+        tasks = [self.codegen_single_dhscanner_ast(d, give_up) for d in dhscanner_asts]
+        requeue = await asyncio.gather(*tasks)
+        return [d for d, requeued in zip(dhscanner_asts, requeue) if requeued]
+
+    @typing.override
+    def streams_into(self) -> typing.Optional[Status]:
+        return Status.WaitingForKbgen
 
     @typing.override
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
-        for job_id in job_ids:
-            self.the_coordinator.set_status(
-                job_id,
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
+        for shard in shards:
+            await self.the_coordinator.set_status(
+                shard,
                 Status.WaitingForKbgen
             )
 
-    async def codegen_single_dhscanner_ast(
-        self,
-        session: aiohttp.ClientSession,
-        a: DhscannerAstMetadata
-    ) -> None:
+    # returns whether to requeue the dhscanner ast
+    async def codegen_single_dhscanner_ast(self, a: DhscannerAstMetadata, give_up: bool) -> bool:
+
+        key = None
+        if a.cache_key is not None:
+            key = cache.callables_key(a.cache_key)
+            if cached := await self.load_cached_callables(a, key):
+                await self.the_storage_guy.save_callables(cached, a, key)
+                await self.the_storage_guy.delete_dhscanner_ast(a)
+                return False
 
         if dhscanner_ast := await self.read_dhscanner_ast_file(a):
-            if content := await self.codegen(session, dhscanner_ast, a):
-                await self.the_storage_guy.save_callables(content, a)
+            try:
+                content = await self.codegen(dhscanner_ast, a, give_up)
+            except UpstreamUnavailable:
+                return True
+
+            if content:
+                await self.the_storage_guy.save_callables(content, a, key)
+                if key is not None:
+                    await self.the_storage_guy.save_cached_artifact(
+                        cache.CachedStage.CALLABLES,
+                        key,
+                        json.dumps(content).encode('utf-8')
+                    )
         await self.the_storage_guy.delete_dhscanner_ast(a)
+        return False
 
+    async def load_cached_callables(self, a: DhscannerAstMetadata, key: str) -> typing.Optional[list[dict]]:
+        start = time.monotonic()
+        cached = await self.the_storage_guy.load_cached_artifact(cache.CachedStage.CALLABLES, key)
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=a.dhscanner_ast_unique_id,
+                job_id=a.job_id,
+                context=Context.CALLABLES_CACHE_MISS if cached is None else Context.CALLABLES_CACHE_HIT,
+                original_filename=a.original_filename,
+                language=a.language,
+                duration=timedelta(seconds=delta),
+                corresponding_byte_size=0 if cached is None else len(cached)
+            )
+        )
+
+        if cached is None:
+            return None
+
+        try:
+            return json.loads(cached)
+        except json.JSONDecodeError:
+            return None
+
+    # an unavailable codegen says nothing about the dhscanner ast,
+    # which is requeued ( raised ) unless it is the last chance to generate it
     async def codegen(
         self,
-        session: aiohttp.ClientSession,
         dhscanner_ast: dict,
-        a: DhscannerAstMetadata
+        a: DhscannerAstMetadata,
+        give_up: bool
     ) -> list[dict]:
+        emessage = 'no exceptions'
         start = time.monotonic()
         try:
-            async with session.post(TO_CODEGEN_URL, json=dhscanner_ast) as response:
+            async with self.the_upstreams.post(TO_CODEGEN_URL, NUM_SECONDS_PER_REQUEST, **json_request(dhscanner_ast)) as response:
                 if response.status == http.HTTPStatus.OK:
                     callables = await response.json()
                     end = time.monotonic()
@@ -74,11 +150,16 @@ class Codegen(AbstractWorker):
                             )
                             return actualCallables
 
-        except aiohttp.ClientError:
-            pass
+        except UpstreamUnavailable as e:
+            if not give_up:
+                raise
+            emessage = str(e)
 
-        except json.JSONDecodeError:
-            pass
+        except aiohttp.ClientError as e:
+            emessage = str(e)
+
+        except json.JSONDecodeError as e:
+            emessage = str(e)
 
         end = time.monotonic()
         delta = end - start
@@ -89,7 +170,8 @@ class Codegen(AbstractWorker):
                 context=Context.CODEGEN_FAILED,
                 original_filename=a.original_filename,
                 language=a.language,
-                duration=timedelta(seconds=delta)
+                duration=timedelta(seconds=delta),
+                more_details=f'exception(s): {emessage}'
             )
         )
         return []
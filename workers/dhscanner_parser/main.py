@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import os
+import enum
 import http
 import json
 import time
@@ -7,31 +9,68 @@ import typing
 import pathlib
 import aiohttp
 import asyncio
+import weakref
 import dataclasses
 
 from datetime import timedelta
 
-from coordinator.interface import Status
+from coordinator.interface import Shard, Status
 from logger.models import (
     Context,
     LogMessage
 )
 
 from common.language import Language
-from workers.interface import AbstractWorker
+from storage import cache
+from workers.interface import AbstractWorker, json_request
+from workers.upstream import UpstreamUnavailable
 from storage.models import FileMetadata, NativeAstMetadata
 
+DHSCANNER_PARSER_URL: typing.Final[str] = os.getenv('DHSCANNER_PARSER_URL', 'http://parsers:3000')
+
 DHSCANNER_AST_BUILDER_URL = {
-    Language.JS: 'http://parsers:3000/from/js/to/dhscanner/ast',
-    Language.TS: 'http://parsers:3000/from/ts/to/dhscanner/ast',
-    Language.TSX: 'http://parsers:3000/from/ts/to/dhscanner/ast',
-    Language.PHP: 'http://parsers:3000/from/php/to/dhscanner/ast',
-    Language.PY: 'http://parsers:3000/from/py/to/dhscanner/ast',
-    Language.RB: 'http://parsers:3000/from/rb/to/dhscanner/ast',
-    Language.CS: 'http://parsers:3000/from/cs/to/dhscanner/ast',
-    Language.GO: 'http://parsers:3000/from/go/to/dhscanner/ast',
+    Language.JS: f'{DHSCANNER_PARSER_URL}/from/js/to/dhscanner/ast',
+    Language.TS: f'{DHSCANNER_PARSER_URL}/from/ts/to/dhscanner/ast',
+    Language.TSX: f'{DHSCANNER_PARSER_URL}/from/ts/to/dhscanner/ast',
+    Language.PHP: f'{DHSCANNER_PARSER_URL}/from/php/to/dhscanner/ast',
+    Language.PY: f'{DHSCANNER_PARSER_URL}/from/py/to/dhscanner/ast',
+    Language.RB: f'{DHSCANNER_PARSER_URL}/from/rb/to/dhscanner/ast',
+    Language.CS: f'{DHSCANNER_PARSER_URL}/from/cs/to/dhscanner/ast',
+    Language.GO: f'{DHSCANNER_PARSER_URL}/from/go/to/dhscanner/ast',
 }
 
+# parsers ( or a stand-in in front of them, see standin.py ) that keep the layout of a job:
+# a json post of { layout_id, source_containing_dirs, all_filenames } registers it, and every
+# file then sends just its layout_id ( answered with 410 once the layout is gone, say a restart )
+DHSCANNER_PARSER_LAYOUT_URL: typing.Final[typing.Optional[str]] = os.getenv('DHSCANNER_PARSER_LAYOUT_URL') or None
+
+class RequestFormat(str, enum.Enum):
+
+    # the native ast is decoded, and escaped, into a json string
+    JSON = 'json'
+    # the native ast goes as is ( a 'source' part ), next to a json 'metadata' part
+    MULTIPART = 'multipart'
+
+    @staticmethod
+    def from_raw_string(raw: typing.Optional[str]) -> RequestFormat:
+        if raw is None or raw.strip() == '':
+            return RequestFormat.JSON
+        return RequestFormat(raw.strip().lower())
+
+# parsers ( or the stand-in in front of them, see standin.py ) that accept multipart requests
+DHSCANNER_PARSER_REQUEST_FORMAT: typing.Final[RequestFormat] = RequestFormat.from_raw_string(
+    os.getenv('DHSCANNER_PARSER_REQUEST_FORMAT')
+)
+
+NUM_SECONDS_PER_REQUEST: typing.Final[float] = float(os.getenv('DHSCANNER_PARSER_NUM_SECONDS_PER_REQUEST', '120'))
+
+# parsers that keep losing the layout right after it was registered get all of it with every file
+MAX_NUM_REGISTRATIONS_PER_LAYOUT: typing.Final[int] = 3
+
+# parse errors are answered with 200 too, as a small json object with a 'FAILED' status,
+# so only responses mentioning it that early on are parsed ( dhscanner asts never are )
+MAX_NUM_BYTES_TO_TELL_PARSE_ERRORS: typing.Final[int] = 4096
+
 @dataclasses.dataclass(kw_only=True, frozen=True)
 class Location:
 
@@ -66,77 +105,245 @@ class Location:
             colEnd=candidate['colEnd']
         )
 
+@dataclasses.dataclass(frozen=True)
+class Layout:
+    '''
+    directories and filenames of the entire job, every file is parsed against
+
+    ---
+
+    once registered with the parsers, requests reference it by key,
+    instead of carrying all of it ( again and again ) with every file
+    '''
+
+    key: str
+    directories: list[str]
+    filenames: list[str]
+    registered: bool = False
+
+    def as_payload(self) -> dict[str, typing.Any]:
+        if self.registered:
+            return {'layout_id': self.key}
+        return {'source_containing_dirs': self.directories, 'all_filenames': self.filenames}
+
+@dataclasses.dataclass
+class SharedLayout:
+    '''
+    the layout of a job as currently registered, shared by all of its shards in flight
+
+    ---
+
+    once the parsers lose the layout, the files in flight all get a 410 together:
+    the first of them registers it again, and all the others reuse that registration
+    '''
+
+    current: Layout
+    num_registrations: int = 0
+    lock: asyncio.Lock = dataclasses.field(default_factory=asyncio.Lock)
+
 @dataclasses.dataclass(frozen=True)
 class DhscannerParser(AbstractWorker):
 
+    # by layout key, for as long as any shard of the job is in flight
+    shared_layouts: weakref.WeakValueDictionary[str, SharedLayout] = dataclasses.field(
+        default_factory=weakref.WeakValueDictionary,
+        init=False
+    )
+
     @typing.override
     async def run(self, job_id: str) -> None:
-        asts = self.the_storage_guy.load_native_asts_metadata_from_db(job_id)
-        all_files = self.the_storage_guy.load_files_metadata_from_db(job_id)
+        await self.run_shard(Shard.whole(job_id))
+
+    @typing.override
+    async def run_shard(self, shard: Shard) -> None:
+        all_files = await self.the_storage_guy.load_files_metadata_from_db(shard.job_id)
+        asts = await self.the_storage_guy.load_native_asts_metadata_of_files_from_db(shard.select(all_files))
         directories, filenames = self._collect_directories_and_filenames(all_files)
-        async with aiohttp.ClientSession() as session:
-            tasks = [self.run_single_ast(session, f, directories, filenames, f.github_url) for f in asts]
-            await asyncio.gather(*tasks)
+        layout = self.share_layout(Layout(cache.layout_key(directories, filenames), directories, filenames))
+        base_cache_keys = {f.original_filename: f.base_cache_key for f in all_files if f.base_cache_key is not None}
+        if asts:
+            await self.register_shared_layout(shard.job_id, layout, None)
+        await self.run_with_requeues(
+            shard.job_id,
+            asts,
+            lambda asts, give_up: self.run_asts(asts, layout, base_cache_keys, give_up)
+        )
+
+    @typing.override
+    def streams_into(self) -> typing.Optional[Status]:
+        return Status.WaitingForCodegen
 
     @typing.override
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
-        for job_id in job_ids:
-            self.the_coordinator.set_status(
-                job_id,
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
+        for shard in shards:
+            await self.the_coordinator.set_status(
+                shard,
                 Status.WaitingForCodegen
             )
 
-    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def share_layout(self, layout: Layout) -> SharedLayout:
+        if (shared := self.shared_layouts.get(layout.key)) is None:
+            shared = SharedLayout(layout)
+            self.shared_layouts[layout.key] = shared
+        return shared
+
+    # registered once for all the shards in flight ( rather than sent with each and every file ),
+    # and registered again once for all the files that were sent with the `lost` registration
+    async def register_shared_layout(self, job_id: str, shared: SharedLayout, lost: typing.Optional[Layout]) -> None:
+        async with shared.lock:
+            if lost is None and shared.current.registered:
+                return
+            if lost is not None and shared.current is not lost:
+                return
+            if shared.num_registrations >= MAX_NUM_REGISTRATIONS_PER_LAYOUT:
+                shared.current = dataclasses.replace(shared.current, registered=False)
+                return
+            shared.num_registrations += 1
+            shared.current = await self.register_layout(job_id, shared.current)
+
+    async def register_layout(self, job_id: str, layout: Layout) -> Layout:
+        if DHSCANNER_PARSER_LAYOUT_URL is None:
+            return layout
+
+        emessage = 'no exceptions'
+        registered = False
+        start = time.monotonic()
+        payload = {
+            'layout_id': layout.key,
+            'source_containing_dirs': layout.directories,
+            'all_filenames': layout.filenames
+        }
+        try:
+            request = json_request(payload)
+            async with self.the_upstreams.post(DHSCANNER_PARSER_LAYOUT_URL, NUM_SECONDS_PER_REQUEST, **request) as response:
+                registered = response.status == http.HTTPStatus.OK
+                emessage = f'http status {response.status}'
+
+        except aiohttp.ClientError as e:
+            emessage = str(e)
+
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=f'layout_{layout.key}',
+                job_id=job_id,
+                context=Context.DHSCANNER_LAYOUT_REGISTERED if registered else Context.DHSCANNER_LAYOUT_REGISTRATION_FAILED,
+                original_filename='*',
+                language=Language.ALL,
+                duration=timedelta(seconds=delta),
+                more_details=f'files({len(layout.filenames)})' if registered else f'exception(s): {emessage}'
+            )
+        )
+        return dataclasses.replace(layout, registered=registered)
+
+    # returns the native asts to requeue
+    async def run_asts(
+        self,
+        asts: list[NativeAstMetadata],
+        layout: SharedLayout,
+        base_cache_keys: dict[str, str],
+        give_up: bool
+    ) -> list[NativeAstMetadata]:
+        tasks = [self.run_single_ast(a, layout, base_cache_keys.get(a.original_filename), give_up) for a in asts]
+        requeue = await asyncio.gather(*tasks)
+        return [a for a, requeued in zip(asts, requeue) if requeued]
+
+    # returns whether to requeue the native ast
     async def run_single_ast(
         self,
-        session: aiohttp.ClientSession,
         a: NativeAstMetadata,
-        directories: list[str],
-        filenames: list[str],
-        github_url: typing.Optional[str]
-    ) -> None:
+        layout: SharedLayout,
+        base_cache_key: typing.Optional[str],
+        give_up: bool
+    ) -> bool:
+
+        key = None
+        if a.cache_key is not None:
+            key = cache.dhscanner_ast_key(a.cache_key, a.github_url, a.path_mappings, layout.current.key)
+
+        # files unchanged since the base job keep its dhscanner ast ( and with it its
+        # callables and facts ), whatever changed in the layout meanwhile ( see rescans )
+        for k in [k for k in (base_cache_key, key) if k is not None]:
+            if cached := await self.load_cached_dhscanner_ast(a, k):
+                await self.the_storage_guy.save_dhscanner_ast(cached, a, k)
+                await self.the_storage_guy.delete_native_ast(a)
+                return False
 
         if native_ast := await self.read_native_ast_file(a):
-            if content := await self.parse(session, native_ast, a, directories, filenames, github_url):
-                await self.the_storage_guy.save_dhscanner_ast(content, a)
+            try:
+                content = await self.parse(native_ast, a, layout, a.github_url, give_up)
+            except UpstreamUnavailable:
+                return True
+
+            if content:
+                await self.the_storage_guy.save_dhscanner_ast(content, a, key)
+                if key is not None:
+                    await self.the_storage_guy.save_cached_artifact(
+                        cache.CachedStage.DHSCANNER_AST,
+                        key,
+                        content
+                    )
         await self.the_storage_guy.delete_native_ast(a)
+        return False
 
+    async def load_cached_dhscanner_ast(self, a: NativeAstMetadata, key: str) -> typing.Optional[bytes]:
+        start = time.monotonic()
+        cached = await self.the_storage_guy.load_cached_artifact(cache.CachedStage.DHSCANNER_AST, key)
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=a.native_ast_unique_id,
+                job_id=a.job_id,
+                context=Context.DHSCANNER_AST_CACHE_MISS if cached is None else Context.DHSCANNER_AST_CACHE_HIT,
+                original_filename=a.original_filename,
+                language=a.language,
+                duration=timedelta(seconds=delta),
+                corresponding_byte_size=0 if cached is None else len(cached)
+            )
+        )
+
+        return cached
+
+    # an unavailable parser says nothing about the native ast,
+    # which is requeued ( raised ) unless it is the last chance to parse it
     # pylint: disable=too-many-locals,too-many-arguments,too-many-positional-arguments
     async def parse(
         self,
-        session: aiohttp.ClientSession,
         code: dict[str, typing.Tuple[str, bytes]],
         a: NativeAstMetadata,
-        directories: list[str],
-        filenames: list[str],
-        github_url: typing.Optional[str]
-    ) -> typing.Optional[dict]:
+        shared: SharedLayout,
+        github_url: typing.Optional[str],
+        give_up: bool
+    ) -> typing.Optional[bytes]:
+        emessage = 'no exceptions'
         start = time.monotonic()
         url = DHSCANNER_AST_BUILDER_URL[a.language]
+        layout = shared.current
         try:
-            payload = {
+            metadata = {
                 'filename': code['source'][0],
-                'content': code['source'][1].decode('utf-8'),
                 'optional_github_url': github_url,
-                'source_containing_dirs': directories,
-                'all_filenames': filenames,
-                'path_mappings': a.path_mappings
+                'path_mappings': a.path_mappings,
+                **layout.as_payload()
             }
-            async with session.post(url, json=payload) as response:
+            request = DhscannerParser.parse_request(code['source'][1], metadata)
+            async with self.the_upstreams.post(url, NUM_SECONDS_PER_REQUEST, **request) as response:
                 if response.status == http.HTTPStatus.OK:
-                    dhscanner_ast: dict = await response.json()
+                    # stored as received
+                    dhscanner_ast = await response.read()
                     end = time.monotonic()
                     delta = end - start
                     context = Context.DHSCANNER_PARSING_SUCCEEDED
                     more_details = 'nothing else to add'
-                    dhscanner_ast_as_string = json.dumps(dhscanner_ast)
-                    corresponding_byte_size = len(dhscanner_ast_as_string)
+                    corresponding_byte_size = len(dhscanner_ast)
 
-                    if 'status' in dhscanner_ast and dhscanner_ast['status'] == 'FAILED':
+                    if (outcome := DhscannerParser.parse_error(dhscanner_ast)) is not None:
                         context = Context.DHSCANNER_PARSING_FAILED
                         more_details = 'could not extract parse error location'
-                        if 'location' in dhscanner_ast:
-                            if location := Location.from_dict(dhscanner_ast['location']):
+                        if 'location' in outcome:
+                            if location := Location.from_dict(outcome['location']):
                                 more_details = str(location)
 
                     await self.the_logger_dude.info(
@@ -154,11 +361,22 @@ class DhscannerParser(AbstractWorker):
 
                     return dhscanner_ast
 
-        except aiohttp.ClientError:
-            pass
+            # the parsers lost the layout ( say they restarted ), so it is registered again
+            # ( once for all the files in flight ), and this one is sent again with it
+            if response.status == http.HTTPStatus.GONE and layout.registered:
+                await self.register_shared_layout(a.job_id, shared, layout)
+                return await self.parse(code, a, shared, github_url, give_up)
+
+        except UpstreamUnavailable as e:
+            if not give_up:
+                raise
+            emessage = str(e)
+
+        except aiohttp.ClientError as e:
+            emessage = str(e)
 
-        except json.JSONDecodeError:
-            pass
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            emessage = str(e)
 
         end = time.monotonic()
         delta = end - start
@@ -169,11 +387,36 @@ class DhscannerParser(AbstractWorker):
                 context=Context.DHSCANNER_PARSING_SYSTEM_FAILURE,
                 original_filename=a.original_filename,
                 language=a.language,
-                duration=timedelta(seconds=delta)
+                duration=timedelta(seconds=delta),
+                more_details=f'exception(s): {emessage}'
             )
         )
         return None
 
+    @staticmethod
+    def parse_error(dhscanner_ast: bytes) -> typing.Optional[dict]:
+        if b'FAILED' not in dhscanner_ast[:MAX_NUM_BYTES_TO_TELL_PARSE_ERRORS]:
+            return None
+        outcome = json.loads(dhscanner_ast)
+        if isinstance(outcome, dict) and outcome.get('status') == 'FAILED':
+            return outcome
+        return None
+
+    @staticmethod
+    def parse_request(native_ast: bytes, metadata: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        if DHSCANNER_PARSER_REQUEST_FORMAT == RequestFormat.JSON:
+            return json_request({**metadata, 'content': native_ast.decode('utf-8')})
+
+        form = aiohttp.FormData()
+        form.add_field('metadata', json.dumps(metadata), content_type='application/json')
+        form.add_field(
+            'source',
+            native_ast,
+            filename=metadata['filename'],
+            content_type='application/octet-stream'
+        )
+        return {'data': form}
+
     async def read_native_ast_file(
         self, a: NativeAstMetadata
     ) -> typing.Optional[dict[str, typing.Tuple[str, bytes]]]:
@@ -0,0 +1,116 @@
+import os
+import http
+import json
+import typing
+import aiohttp
+import collections
+
+from aiohttp import web
+
+from common import compression
+
+# stands in for parsers that do not keep layouts ( yet ) on their own:
+# it keeps them on their behalf, and expands every layout_id back into
+# the entire layout before passing the request on to the actual parsers
+# ( deployed right next to them: only the workers to stand-in hop is spared
+# the layout, the parsers still receive and decode all of it with every file )
+#
+# docker compose ... -f ./compose/compose.workers.yaml -f ./compose/compose.layouts.yaml up -d
+UPSTREAM_URL: typing.Final[str] = os.getenv('LAYOUTS_STANDIN_UPSTREAM_URL', 'http://parsers:3000')
+PORT: typing.Final[int] = int(os.getenv('LAYOUTS_STANDIN_PORT', '3000'))
+MAX_NUM_LAYOUTS: typing.Final[int] = int(os.getenv('LAYOUTS_STANDIN_MAX_NUM_LAYOUTS', '256'))
+NUM_SECONDS_PER_REQUEST: typing.Final[float] = 300
+
+# native asts ( of large files ) are way larger than the default 1 MiB
+MAX_NUM_BYTES_PER_REQUEST: typing.Final[int] = int(os.getenv('LAYOUTS_STANDIN_MAX_NUM_BYTES_PER_REQUEST', str(256 * 1024 ** 2)))
+
+# least recently used layouts go first
+LAYOUTS: typing.Final = web.AppKey('layouts', collections.OrderedDict[str, dict])
+SESSION: typing.Final = web.AppKey('session', aiohttp.ClientSession)
+
+async def register(request: web.Request) -> web.Response:
+    if (layout := await json_of(request)) is None or 'layout_id' not in layout:
+        return web.Response(status=http.HTTPStatus.BAD_REQUEST)
+
+    layouts = request.app[LAYOUTS]
+    layouts[layout['layout_id']] = {
+        'source_containing_dirs': layout.get('source_containing_dirs', []),
+        'all_filenames': layout.get('all_filenames', [])
+    }
+    layouts.move_to_end(layout['layout_id'])
+    while len(layouts) > MAX_NUM_LAYOUTS:
+        layouts.popitem(last=False)
+
+    return web.json_response({})
+
+async def parse(request: web.Request) -> web.Response:
+    if (payload := await parse_request_of(request)) is None:
+        return web.Response(status=http.HTTPStatus.BAD_REQUEST)
+
+    if layout_id := payload.pop('layout_id', None):
+        layouts = request.app[LAYOUTS]
+        if layout_id not in layouts:
+            return web.Response(status=http.HTTPStatus.GONE)
+        layouts.move_to_end(layout_id)
+        payload.update(layouts[layout_id])
+
+    try:
+        async with request.app[SESSION].post(
+            f'{UPSTREAM_URL}{request.path}',
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=NUM_SECONDS_PER_REQUEST)
+        ) as response:
+            return web.Response(
+                status=response.status,
+                body=await response.read(),
+                content_type=response.content_type
+            )
+    except (aiohttp.ClientError, TimeoutError):
+        return web.Response(status=http.HTTPStatus.BAD_GATEWAY)
+
+# either format of DHSCANNER_PARSER_REQUEST_FORMAT,
+# passed on in the only one the parsers accept ( json )
+async def parse_request_of(request: web.Request) -> typing.Optional[dict]:
+    if request.content_type != 'multipart/form-data':
+        return await json_of(request)
+
+    form = await request.post()
+    if not isinstance(source := form.get('source'), web.FileField):
+        return None
+    if not isinstance(metadata := form.get('metadata'), (str, bytes, bytearray)):
+        return None
+
+    try:
+        payload = json.loads(metadata)
+        payload['content'] = source.file.read().decode('utf-8')
+    except (json.JSONDecodeError, UnicodeDecodeError, TypeError):
+        return None
+
+    return payload
+
+# request bodies may be compressed ( see UPSTREAM_REQUEST_COMPRESSION )
+async def json_of(request: web.Request) -> typing.Optional[dict]:
+    try:
+        content = json.loads(compression.decompress(await request.read()))
+    except compression.UNREADABLE_ENCODING_ERRORS:
+        return None
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+    return content if isinstance(content, dict) else None
+
+async def session_context(app: web.Application) -> typing.AsyncIterator[None]:
+    app[SESSION] = aiohttp.ClientSession()
+    yield
+    await app[SESSION].close()
+
+def create_app() -> web.Application:
+    app = web.Application(client_max_size=MAX_NUM_BYTES_PER_REQUEST, handler_args={'auto_decompress': False})
+    app[LAYOUTS] = collections.OrderedDict()
+    app.cleanup_ctx.append(session_context)
+    app.router.add_post('/layouts', register)
+    app.router.add_post('/from/{language}/to/dhscanner/ast', parse)
+    return app
+
+if __name__ == '__main__':
+    web.run_app(create_app(), port=PORT)
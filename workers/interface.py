@@ -1,12 +1,51 @@
+import os
 import abc
 import enum
+import json
+import signal
 import typing
 import asyncio
 import dataclasses
 
+from datetime import timedelta
+
+from common import compression
+from common.language import Language
 from logger.client import Logger
+from logger.models import Context, LogMessage
 from storage.interface import Storage
-from coordinator.interface import Coordinator, Status
+from workers.upstream import Upstreams, backoff
+from coordinator.interface import Coordinator, Shard, Status, NUM_SECONDS_PER_LEASE
+
+MAX_NUM_CONCURRENT_JOBS: typing.Final[int] = int(os.getenv('MAX_NUM_CONCURRENT_JOBS', '4'))
+NUM_SECONDS_BETWEEN_HEARTBEATS: typing.Final[int] = NUM_SECONDS_PER_LEASE // 3
+
+# whatever an unavailable upstream ( see workers/upstream.py ) failed to process
+# is requeued for a later round, once the upstream had some time to recover
+MAX_NUM_REQUEUES: typing.Final[int] = int(os.getenv('MAX_NUM_REQUEUES', '3'))
+NUM_SECONDS_BEFORE_FIRST_REQUEUE: typing.Final[float] = 5
+
+T = typing.TypeVar('T')
+
+# json bodies sent to the upstream services ( parsers, codegen, kbgen, queryengine )
+# are compressed only when those are deployed with Content-Encoding support
+# ( their responses are negotiated by aiohttp anyway, through Accept-Encoding )
+UPSTREAM_REQUEST_ENCODING: typing.Final[typing.Optional[compression.Encoding]] = compression.Encoding.from_raw_string(
+    os.getenv('UPSTREAM_REQUEST_COMPRESSION')
+)
+
+# keyword arguments of an aiohttp request with a json body
+def json_request(payload: typing.Any) -> dict[str, typing.Any]:
+    if UPSTREAM_REQUEST_ENCODING is None:
+        return {'json': payload}
+
+    return {
+        'data': UPSTREAM_REQUEST_ENCODING.compress(json.dumps(payload).encode('utf-8')),
+        'headers': {
+            'Content-Type': 'application/json',
+            'Content-Encoding': UPSTREAM_REQUEST_ENCODING.value
+        }
+    }
 
 class JobDescription(str, enum.Enum):
     NATIVE_PARSER = 'NATIVE_PARSER'
@@ -19,28 +58,146 @@ class AbstractWorker(abc.ABC):
     the_storage_guy: Storage
     the_coordinator: Coordinator
     status: Status
+    max_num_concurrent_jobs: int = MAX_NUM_CONCURRENT_JOBS
+
+    # shared by all the jobs ( and shards ) in flight
+    the_upstreams: Upstreams = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'the_upstreams', Upstreams(self.the_logger_dude))
 
     @typing.final
     def check_in(self) -> None:
-        asyncio.run(self.worker_loop())
+        asyncio.run(self.serve())
+
+    # a stopped worker ( docker stop, ctrl-c ) still ships its last log messages
+    @typing.final
+    async def serve(self) -> None:
+        worker_loop = asyncio.create_task(self.worker_loop())
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, worker_loop.cancel)
+        try:
+            await worker_loop
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.the_logger_dude.close()
 
+    # every job ( or shard of a job ) moves forward as soon as it is done,
+    # and new ones are admitted while others are still in flight
     @typing.final
     async def worker_loop(self) -> None:
+        in_flight: set[asyncio.Task] = set()
+        while True:
+            if len(in_flight) >= self.max_num_concurrent_jobs:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.difference_update(done)
+                continue
+
+            capacity = self.max_num_concurrent_jobs - len(in_flight)
+            shards = await self.the_coordinator.get_shards_waiting_for(self.status, capacity)
+            for shard in shards:
+                task = asyncio.create_task(self.run_single_shard(shard))
+                task.add_done_callback(in_flight.discard)
+                in_flight.add(task)
+
+    @typing.final
+    async def run_single_shard(self, shard: Shard) -> None:
+        job = asyncio.create_task(self.run_shard(shard))
+        heartbeat = asyncio.create_task(self.keep_lease_alive(shard, job))
+        try:
+            await asyncio.wait({job})
+        finally:
+            heartbeat.cancel()
+
+        # lease lost, the shard was ( or will be ) re-claimed by another worker
+        if job.cancelled():
+            return
+
+        if (e := job.exception()) is not None:
+            await self.the_logger_dude.error(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id=shard.job_id,
+                    context=Context.JOB_SHARD_FAILED,
+                    original_filename='*',
+                    language=Language.ALL,
+                    duration=timedelta(0),
+                    more_details=f'{self.status.value} shard({shard.index+1}/{shard.num_shards}) {type(e).__name__}: {e}'
+                )
+            )
+            await self.the_coordinator.abandon_shard(shard)
+            return
+
+        await self.the_storage_guy.flush_metadata()
+        if next_status := self.streams_into():
+            if self.the_coordinator.get_streaming_mode(shard.job_id):
+                await self.the_coordinator.forward_shard(shard, next_status)
+                return
+
+        if await self.the_coordinator.mark_shard_finished(shard):
+            await self.mark_jobs_finished([shard])
+
+    @typing.final
+    async def keep_lease_alive(self, shard: Shard, job: asyncio.Task) -> None:
         while True:
-            job_ids = await self.the_coordinator.get_jobs_waiting_for(self.status)
-            await self.worker_loop_internal(job_ids)
-            await self.mark_jobs_finished(job_ids)
-            await asyncio.sleep(1)
+            await asyncio.sleep(NUM_SECONDS_BETWEEN_HEARTBEATS)
+            if not await self.the_coordinator.renew_lease(shard):
+                job.cancel()
+                return
+
+    # only workers that split their jobs into
+    # shards need to override this one
+    async def run_shard(self, shard: Shard) -> None:
+        await self.run(shard.job_id)
 
     @typing.final
-    async def worker_loop_internal(self, job_ids: list[str]) -> None:
-        tasks = [self.run(job_id) for job_id in job_ids]
-        await asyncio.gather(*tasks)
+    async def run_with_requeues(
+        self,
+        job_id: str,
+        items: list[T],
+        run: typing.Callable[[list[T], bool], typing.Awaitable[list[T]]]
+    ) -> None:
+        '''
+        run the items in rounds, each with the items the previous one requeued
+
+        ---
+
+        `run` returns the items to requeue, and is told when it is the last round,
+        where it should give up on them instead ( like any other failure )
+        '''
+        for i in range(MAX_NUM_REQUEUES + 1):
+            items = await run(items, i == MAX_NUM_REQUEUES)
+            if not items:
+                return
+
+            await self.the_logger_dude.warning(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id=job_id,
+                    context=Context.UPSTREAM_UNAVAILABLE_REQUEUED,
+                    original_filename='*',
+                    language=Language.ALL,
+                    duration=timedelta(0),
+                    more_details=f'{self.status.value} requeued {len(items)} ( round {i+1}/{MAX_NUM_REQUEUES} )'
+                )
+            )
+            await asyncio.sleep(backoff(i, NUM_SECONDS_BEFORE_FIRST_REQUEUE) + NUM_SECONDS_BEFORE_FIRST_REQUEUE)
+
+    @typing.final
+    async def finish_job(self, shard: Shard) -> None:
+        await self.the_storage_guy.delete_job_metadata_from_db(shard.job_id)
+        await self.the_coordinator.set_status(shard, Status.Finished)
+
+    # stages that can hand over every finished shard to the next
+    # stage ( streaming mode ) return that next stage here
+    def streams_into(self) -> typing.Optional[Status]:
+        return None
 
     @abc.abstractmethod
     async def run(self, job_id: str) -> None:
         ...
 
+    # the last shard of every job, whose claim moves the entire job forward
     @abc.abstractmethod
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
         ...
@@ -1,3 +1,4 @@
+import os
 import http
 import json
 import time
@@ -8,59 +9,130 @@ import dataclasses
 
 from datetime import timedelta
 
-from coordinator.interface import Status
+from coordinator.interface import Shard, Status
 from logger.models import Context, LogMessage
+from storage import cache
 from storage.models import CallablesMetadata
-from workers.interface import AbstractWorker
+from workers.interface import AbstractWorker, json_request
+from workers.upstream import MAX_CONCURRENCY, UpstreamUnavailable
 
 TO_KBGEN_URL = 'http://kbgen:3000/kbgen'
 
-MAX_NUM_CONCURRENT_HTTP_REQUESTS = 50
-MAX_NUM_CONCURRENT_TCP_CONNECTIONS = 100
+NUM_SECONDS_PER_REQUEST: typing.Final[float] = float(os.getenv('KBGEN_NUM_SECONDS_PER_REQUEST', '60'))
+
+# callables are read ahead of the ( adaptive ) limit of kbgen itself,
+# so only that many of them are held in memory at once
+MAX_NUM_CALLABLES_IN_FLIGHT: typing.Final[int] = MAX_CONCURRENCY
 
 @dataclasses.dataclass(frozen=True)
 class Kbgen(AbstractWorker):
 
     @typing.override
     async def run(self, job_id: str) -> None:
-        cs = self.the_storage_guy.load_callables_metadata_from_db(job_id)
-        limit = asyncio.Semaphore(MAX_NUM_CONCURRENT_HTTP_REQUESTS)
-        connector = aiohttp.TCPConnector(limit=MAX_NUM_CONCURRENT_TCP_CONNECTIONS)
-        async with aiohttp.ClientSession(connector=connector) as s:
-            tasks = [self._batched_kbgen(s, c, i, limit) for c in cs for i in range(c.num_callables)]
-            await asyncio.gather(*tasks)
+        cs = await self.the_storage_guy.load_callables_metadata_from_db(job_id)
+        await self.kbgen_callables(job_id, cs)
 
+    # only jobs analyzed in streaming mode reach kbgen in shards
     @typing.override
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
-        for job_id in job_ids:
-            self.the_coordinator.set_status(
-                job_id,
+    async def run_shard(self, shard: Shard) -> None:
+        if shard.num_shards == 1:
+            await self.run(shard.job_id)
+            return
+
+        files = shard.select(await self.the_storage_guy.load_files_metadata_from_db(shard.job_id))
+        cs = await self.the_storage_guy.load_callables_metadata_of_files_from_db(files)
+        await self.kbgen_callables(shard.job_id, cs)
+
+    async def kbgen_callables(self, job_id: str, cs: list[CallablesMetadata]) -> None:
+        callables = [(c, i) for c in cs for i in range(c.num_callables)]
+        await self.run_with_requeues(job_id, callables, self.run_callables)
+
+    # returns the callables to requeue
+    async def run_callables(
+        self,
+        callables: list[tuple[CallablesMetadata, int]],
+        give_up: bool
+    ) -> list[tuple[CallablesMetadata, int]]:
+        limit = asyncio.Semaphore(MAX_NUM_CALLABLES_IN_FLIGHT)
+        tasks = [self._batched_kbgen(c, i, limit, give_up) for c, i in callables]
+        requeue = await asyncio.gather(*tasks)
+        return [ci for ci, requeued in zip(callables, requeue) if requeued]
+
+    @typing.override
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
+        for shard in shards:
+            await self.the_coordinator.set_status(
+                shard,
                 Status.WaitingForQueryengine
             )
 
-    async def kbgen_ith_callable(
-        self,
-        session: aiohttp.ClientSession,
-        c: CallablesMetadata,
-        i: int
-    ) -> None:
+    # returns whether to requeue the callable
+    async def kbgen_ith_callable(self, c: CallablesMetadata, i: int, give_up: bool) -> bool:
+
+        key = None
+        if c.cache_key is not None:
+            key = cache.facts_key(c.cache_key, i)
+            if cached := await self.load_cached_facts(c, i, key):
+                await self.the_storage_guy.save_knowledge_base_facts(cached, c, i)
+                await self.the_storage_guy.delete_ith_callable(c, i)
+                return False
 
         if _callable := await self.read_ith_callablle_file(c, i):
-            if content := await self.kbgen(session, _callable, c, i):
+            try:
+                content = await self.kbgen(_callable, c, i, give_up)
+            except UpstreamUnavailable:
+                return True
+
+            if content:
                 await self.the_storage_guy.save_knowledge_base_facts(content, c, i)
+                if key is not None:
+                    await self.the_storage_guy.save_cached_artifact(
+                        cache.CachedStage.FACTS,
+                        key,
+                        json.dumps(content).encode('utf-8')
+                    )
         await self.the_storage_guy.delete_ith_callable(c, i)
+        return False
+
+    async def load_cached_facts(self, c: CallablesMetadata, i: int, key: str) -> typing.Optional[list[dict]]:
+        start = time.monotonic()
+        cached = await self.the_storage_guy.load_cached_artifact(cache.CachedStage.FACTS, key)
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=c.callable_unique_id,
+                job_id=c.job_id,
+                context=Context.FACTS_CACHE_MISS if cached is None else Context.FACTS_CACHE_HIT,
+                original_filename=c.original_filename,
+                language=c.language,
+                duration=timedelta(seconds=delta),
+                more_details=f'callable({i+1})',
+                corresponding_byte_size=0 if cached is None else len(cached)
+            )
+        )
+
+        if cached is None:
+            return None
 
+        try:
+            return json.loads(cached)
+        except json.JSONDecodeError:
+            return None
+
+    # an unavailable kbgen says nothing about the callable,
+    # which is requeued ( raised ) unless it is the last chance to process it
     async def kbgen(
         self,
-        session: aiohttp.ClientSession,
         _callable: dict[str, typing.Tuple[str, bytes]],
         c: CallablesMetadata,
-        i: int
+        i: int,
+        give_up: bool
     ) -> typing.Optional[list[dict]]:
         emessage = 'no exceptions'
         start = time.monotonic()
         try:
-            async with session.post(TO_KBGEN_URL, json=_callable) as response:
+            async with self.the_upstreams.post(TO_KBGEN_URL, NUM_SECONDS_PER_REQUEST, **json_request(_callable)) as response:
                 if response.status == http.HTTPStatus.OK:
                     facts = await response.json()
                     end = time.monotonic()
@@ -78,6 +150,11 @@ class Kbgen(AbstractWorker):
                     )
                     return facts
 
+        except UpstreamUnavailable as e:
+            if not give_up:
+                raise
+            emessage = str(e)
+
         except aiohttp.ClientError as e:
             emessage = str(e)
 
@@ -104,12 +181,6 @@ class Kbgen(AbstractWorker):
     async def read_ith_callablle_file(self, c: CallablesMetadata, i: int) -> typing.Optional[dict]:
         return await self.the_storage_guy.load_ith_callable(c, i)
 
-    async def _batched_kbgen(
-        self,
-        session: aiohttp.ClientSession,
-        c: CallablesMetadata,
-        i: int,
-        limit: asyncio.Semaphore
-    ) -> None:
+    async def _batched_kbgen(self, c: CallablesMetadata, i: int, limit: asyncio.Semaphore, give_up: bool) -> bool:
         async with limit:
-            await self.kbgen_ith_callable(session, c, i)
+            return await self.kbgen_ith_callable(c, i, give_up)
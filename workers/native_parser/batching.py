@@ -0,0 +1,59 @@
+import os
+import typing
+import itertools
+import dataclasses
+
+from common.language import Language
+from storage.models import FileMetadata
+
+# many small files share a request, while large ones go ( almost ) alone,
+# so the per request overhead stops dominating on repositories with
+# thousands of small files, and no single request grows too large
+MAX_NUM_FILES_PER_BATCH: typing.Final[int] = int(os.getenv('NATIVE_PARSER_MAX_NUM_FILES_PER_BATCH', '64'))
+MAX_NUM_BYTES_PER_BATCH: typing.Final[int] = int(os.getenv('NATIVE_PARSER_MAX_NUM_BYTES_PER_BATCH', str(1024 ** 2)))
+
+# frontends ( or aggregators in front of them ) that parse an entire batch in one request:
+# a multipart post with a 'sources' field per file, answered with a json list of native asts,
+# in the same order ( an empty string for every file that failed ), for example:
+#
+# NATIVE_PARSER_BATCH_URL_PY=http://frontpy:5000/to/native/py/asts
+#
+# the batches of all other languages fan out locally, one request per file
+AST_BUILDER_BATCH_URL: typing.Final[dict[Language, str]] = {
+    language: url
+    for language in Language
+    if (url := os.getenv(f'NATIVE_PARSER_BATCH_URL_{language.name}'))
+}
+
+@dataclasses.dataclass(frozen=True)
+class Source:
+
+    f: FileMetadata
+    code: bytes
+    key: typing.Optional[str]
+
+def batches(sources: list[Source]) -> list[list[Source]]:
+    '''
+    pack sources into batches of a single language
+
+    ---
+
+    a batch is closed once adding the next source would exceed
+    either the number of files or the number of bytes per batch
+    ( a source larger than that is a batch of its own )
+    '''
+    packed = []
+    by_language = sorted(sources, key=lambda source: source.f.language.value)
+    for _, of_language in itertools.groupby(by_language, key=lambda source: source.f.language):
+        batch: list[Source] = []
+        num_bytes = 0
+        for source in of_language:
+            if batch and (len(batch) >= MAX_NUM_FILES_PER_BATCH or num_bytes + len(source.code) > MAX_NUM_BYTES_PER_BATCH):
+                packed.append(batch)
+                batch, num_bytes = [], 0
+            batch.append(source)
+            num_bytes += len(source.code)
+        if batch:
+            packed.append(batch)
+
+    return packed
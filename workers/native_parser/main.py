@@ -1,3 +1,5 @@
+import os
+import json
 import http
 import time
 import typing
@@ -8,10 +10,13 @@ import dataclasses
 from datetime import timedelta
 
 from common.language import Language
-from coordinator.interface import Status
+from coordinator.interface import Shard, Status
+from storage import cache
 from storage.models import FileMetadata
 from logger.models import Context, LogMessage
 from workers.interface import AbstractWorker
+from workers.native_parser import batching
+from workers.upstream import UpstreamUnavailable
 
 AST_BUILDER_URL = {
     Language.JS: 'http://frontjs:3000/to/esprima/js/ast',
@@ -25,54 +30,186 @@ AST_BUILDER_URL = {
     Language.BLADE_PHP: 'http://frontphp:5000/to/php/code'
 }
 
+NUM_SECONDS_PER_REQUEST: typing.Final[float] = float(os.getenv('NATIVE_PARSER_NUM_SECONDS_PER_REQUEST', '60'))
+NUM_SECONDS_PER_BATCH_REQUEST: typing.Final[float] = float(os.getenv('NATIVE_PARSER_NUM_SECONDS_PER_BATCH_REQUEST', '300'))
+
 @dataclasses.dataclass(frozen=True)
 class NativeParser(AbstractWorker):
 
     @typing.override
     async def run(self, job_id: str) -> None:
-        files = self.the_storage_guy.load_files_metadata_from_db(job_id)
-        async with aiohttp.ClientSession() as session:
-            tasks = [self.run_single_file(session, f) for f in files]
-            await asyncio.gather(*tasks)
+        await self.run_shard(Shard.whole(job_id))
+
+    @typing.override
+    async def run_shard(self, shard: Shard) -> None:
+        files = shard.select(await self.the_storage_guy.load_files_metadata_from_db(shard.job_id))
+        sources = await asyncio.gather(*[self.prepare_single_file(f) for f in files])
+        await self.run_with_requeues(
+            shard.job_id,
+            [source for source in sources if source is not None],
+            self.run_sources
+        )
+
+    @typing.override
+    def streams_into(self) -> typing.Optional[Status]:
+        return Status.WaitingForDhscannerParsing
 
     @typing.override
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
-        for job_id in job_ids:
-            self.the_coordinator.set_status(
-                job_id,
-                Status.WaitingForDhscannerParsing
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
+        for shard in shards:
+            await self.the_coordinator.set_status(
+                shard,
+                Status.WaitingForDhscannerParsing,
+                self.the_coordinator.get_num_shards(shard.job_id)
             )
 
-    async def run_single_file(
-        self,
-        session: aiohttp.ClientSession,
-        f: FileMetadata
-    ) -> None:
+    # the source of a file that still needs parsing
+    async def prepare_single_file(self, f: FileMetadata) -> typing.Optional[batching.Source]:
+
+        # files uploaded before sources were content addressed are never cached
+        key = None
+        if f.content_hash is not None:
+            key = cache.native_ast_key(f.content_hash, f.language.value, f.original_filename)
+            if cached := await self.load_cached_native_ast(f, key):
+                await self.the_storage_guy.save_native_ast(cached, f, key)
+                await self.the_storage_guy.delete_file(f)
+                return None
+
+        if code := await self.the_storage_guy.load_file(f):
+            return batching.Source(f=f, code=code, key=key)
+
+        return None
 
-        if code := await self.read_source_file(f):
-            if content := await self.parse(session, code, f):
-                await self.the_storage_guy.save_native_ast(content, f)
+    # returns the sources to requeue
+    async def run_sources(self, sources: list[batching.Source], give_up: bool) -> list[batching.Source]:
+        batches = batching.batches(sources)
+        requeued = await asyncio.gather(*[self.run_batch(batch, give_up) for batch in batches])
+        return [source for of_batch in requeued for source in of_batch]
 
-            # either way - delete the source file ...
-            await self.the_storage_guy.delete_file(f)
+    # one request for the entire batch where the frontend supports it,
+    # otherwise ( or when it fails ) the batch fans out locally
+    async def run_batch(self, batch: list[batching.Source], give_up: bool) -> list[batching.Source]:
 
-    async def parse(
+        if url := batching.AST_BUILDER_BATCH_URL.get(batch[0].f.language):
+            if (native_asts := await self.parse_in_one_request(url, batch)) is not None:
+                for source, content in zip(batch, native_asts):
+                    await self.save_parsed(source, content)
+                return []
+
+        requeue = await asyncio.gather(*[self.run_single_source(source, give_up) for source in batch])
+        return [source for source, requeued in zip(batch, requeue) if requeued]
+
+    # returns whether to requeue the source
+    async def run_single_source(self, source: batching.Source, give_up: bool) -> bool:
+        try:
+            content = await self.parse(source, give_up)
+        except UpstreamUnavailable:
+            return True
+
+        await self.save_parsed(source, content)
+        return False
+
+    async def save_parsed(self, source: batching.Source, content: typing.Optional[str]) -> None:
+        if content:
+            await self.the_storage_guy.save_native_ast(content, source.f, source.key)
+            if source.key is not None:
+                await self.the_storage_guy.save_cached_artifact(
+                    cache.CachedStage.NATIVE_AST,
+                    source.key,
+                    content.encode('utf-8')
+                )
+
+        # either way - delete the source file ...
+        await self.the_storage_guy.delete_file(source.f)
+
+    async def parse_in_one_request(
         self,
-        session: aiohttp.ClientSession,
-        code: dict[str, typing.Tuple[str, bytes]],
-        f: FileMetadata
-    ) -> typing.Optional[str]:
+        url: str,
+        batch: list[batching.Source]
+    ) -> typing.Optional[list[typing.Optional[str]]]:
+        start = time.monotonic()
+        try:
+            form = aiohttp.FormData()
+            for source in batch:
+                form.add_field(
+                    'sources',
+                    source.code,
+                    filename=source.f.original_filename,
+                    content_type='application/octet-stream'
+                )
+            async with self.the_upstreams.post(url, NUM_SECONDS_PER_BATCH_REQUEST, data=form) as response:
+                if response.status != http.HTTPStatus.OK:
+                    return None
+                native_asts = await response.json(content_type=None)
+        except (aiohttp.ClientError, json.JSONDecodeError):
+            return None
+
+        if not isinstance(native_asts, list) or len(native_asts) != len(batch):
+            return None
+
+        end = time.monotonic()
+        delta = end - start
+        parsed: list[typing.Optional[str]] = []
+        for source, native_ast in zip(batch, native_asts):
+            context = Context.NATIVE_PARSING_SUCCEEDED
+            if not isinstance(native_ast, str):
+                context = Context.NATIVE_PARSING_FAILED
+            elif len(native_ast) == 0:
+                context = Context.NATIVE_PARSING_EMPTY_AST
+            # every file gets its share of the request
+            await self.the_logger_dude.info(
+                LogMessage(
+                    file_unique_id=source.f.file_unique_id,
+                    job_id=source.f.job_id,
+                    context=context,
+                    original_filename=source.f.original_filename,
+                    language=source.f.language,
+                    duration=timedelta(seconds=delta / len(batch)),
+                    more_details=f'batch of {len(batch)} files'
+                )
+            )
+            parsed.append(native_ast if context == Context.NATIVE_PARSING_SUCCEEDED else None)
+
+        return parsed
+
+    async def load_cached_native_ast(self, f: FileMetadata, key: str) -> typing.Optional[str]:
+        start = time.monotonic()
+        cached = await self.the_storage_guy.load_cached_artifact(cache.CachedStage.NATIVE_AST, key)
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=f.file_unique_id,
+                job_id=f.job_id,
+                context=Context.NATIVE_AST_CACHE_MISS if cached is None else Context.NATIVE_AST_CACHE_HIT,
+                original_filename=f.original_filename,
+                language=f.language,
+                duration=timedelta(seconds=delta),
+                corresponding_byte_size=0 if cached is None else len(cached)
+            )
+        )
+
+        if cached is None:
+            return None
+
+        return cached.decode('utf-8', errors='replace')
+
+    # an unavailable frontend says nothing about the file, which is
+    # requeued ( raised ) unless it is the last chance to parse it
+    async def parse(self, source: batching.Source, give_up: bool) -> typing.Optional[str]:
+        f = source.f
+        emessage = 'no exceptions'
         start = time.monotonic()
         url = AST_BUILDER_URL[f.language]
         try:
             form = aiohttp.FormData()
             form.add_field(
                 'source',
-                code['source'][1],
-                filename=code['source'][0],
+                source.code,
+                filename=f.original_filename,
                 content_type='application/octet-stream'
             )
-            async with session.post(url, data=form) as response:
+            async with self.the_upstreams.post(url, NUM_SECONDS_PER_REQUEST, data=form) as response:
                 if response.status == http.HTTPStatus.OK:
                     native_ast = await response.text()
                     context = Context.NATIVE_PARSING_SUCCEEDED
@@ -97,8 +234,13 @@ class NativeParser(AbstractWorker):
 
                     return native_ast
 
-        except aiohttp.ClientError:
-            pass
+        except UpstreamUnavailable as e:
+            if not give_up:
+                raise
+            emessage = str(e)
+
+        except aiohttp.ClientError as e:
+            emessage = str(e)
 
         end = time.monotonic()
         delta = end - start
@@ -109,15 +251,8 @@ class NativeParser(AbstractWorker):
                 context=Context.NATIVE_PARSING_FAILED,
                 original_filename=f.original_filename,
                 language=f.language,
-                duration=timedelta(seconds=delta)
+                duration=timedelta(seconds=delta),
+                more_details=f'exception(s): {emessage}'
             )
         )
         return None
-
-    async def read_source_file(
-        self, f: FileMetadata
-    ) -> typing.Optional[dict[str, typing.Tuple[str, bytes]]]:
-        if code := await self.the_storage_guy.load_file(f):
-            return { 'source': (f.original_filename, code) }
-
-        return None
@@ -1,156 +1,197 @@
+import os
 import http
 import json
 import time
 import typing
 import aiohttp
 import asyncio
-import aiofiles
 import dataclasses
 
 from datetime import timedelta
 
 from common.language import Language
-from coordinator.interface import Status
+from coordinator.interface import Shard, Status
 from storage.models import FactsMetadata
 from logger.models import Context, LogMessage
-from workers.interface import AbstractWorker
+from workers.interface import AbstractWorker, json_request
+from workers.upstream import OVERLOAD_HTTP_STATUSES, UpstreamUnavailable
 
 TO_QUERY_ENGINE_URL = 'http://queryengine:3000/querycheck'
 TO_QUERY_ENGINE_URL_UPLOAD_ONLY = 'http://queryengine:3000/uploadkb'
 
+# the queries of an entire job run in a single request
+NUM_SECONDS_PER_REQUEST: typing.Final[float] = float(os.getenv('QUERYENGINE_NUM_SECONDS_PER_REQUEST', '1800'))
+
+# that request is far too long to repeat on every failure: a timeout is its final answer,
+# an internal error is about the queries ( rather than an overloaded query engine ), and
+# a gateway timeout is how the query engine reports queries that timed out ( a result )
+MAX_NUM_ATTEMPTS_PER_REQUEST: typing.Final[int] = int(os.getenv('QUERYENGINE_MAX_NUM_ATTEMPTS_PER_REQUEST', '2'))
+OVERLOAD_HTTP_STATUSES_OF_QUERIES: typing.Final[frozenset[int]] = frozenset(
+    OVERLOAD_HTTP_STATUSES - {http.HTTPStatus.INTERNAL_SERVER_ERROR, http.HTTPStatus.GATEWAY_TIMEOUT}
+)
+
 @dataclasses.dataclass(frozen=True)
 class Queryengine(AbstractWorker):
 
     @typing.override
     async def run(self, job_id: str) -> None:
-        files = self.the_storage_guy.load_facts_metadata_from_db(job_id)
-        tasks = [self.read_facts_json(facts) for facts in files]
-        contents = await asyncio.gather(*tasks)
-        all_facts: list[dict] = []
-        for fact_list in contents:
-            all_facts.extend(fact_list)
-
+        files = await self.the_storage_guy.load_facts_metadata_from_db(job_id)
         if self.the_coordinator.get_agent_mode(job_id):
-            await self.run_with_agent_mode(job_id, all_facts)
-        else:
-            await self.run_without_agent(job_id, all_facts)
+            await self.run_with_agent_mode(job_id, await self.read_all_facts(files))
+            await self.delete_all_facts(files)
+            return
 
-    async def run_with_agent_mode(self, job_id: str, all_facts: list[dict]) -> None:
-        emessage = 'no exception'
-        start = time.monotonic()
+        await self.run_with_requeues(
+            job_id,
+            files,
+            lambda files, give_up: self.run_without_agent(job_id, files, give_up)
+        )
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(TO_QUERY_ENGINE_URL_UPLOAD_ONLY, json=all_facts) as response:
-                    if response.status == http.HTTPStatus.OK:
-                        result_json: dict[str, str] = await response.json()
-                        if kb_location := result_json.get('kb_location', None):
-                            self.the_coordinator.set_kb_location(job_id, kb_location)
-                            end = time.monotonic()
-                            delta = end - start
-                            await self.the_logger_dude.info(
-                                LogMessage(
-                                    file_unique_id=f'queries_{job_id}',
-                                    job_id=job_id,
-                                    context=Context.KBGEN_UPLOADED_FOR_AGENT,
-                                    original_filename='*',
-                                    language=Language.ALL,
-                                    duration=timedelta(seconds=delta)
-                                )
-                            )
-                            return
-
-                        # probably unreachable code since an ok response
-                        # means everything went well on the server side
-                        emessage = 'invalid json response without kb location'
-
-            except aiohttp.ClientError as e:
-                emessage = str(e)
-
-            end = time.monotonic()
-            delta = end - start
-            await self.the_logger_dude.info(
-                LogMessage(
-                    file_unique_id=f'queries_{job_id}',
-                    job_id=job_id,
-                    context=Context.KBGEN_UPLOAD_FOR_AGENT_FAILED,
-                    original_filename='*',
-                    language=Language.ALL,
-                    duration=timedelta(seconds=delta),
-                    more_details=f'exception(s): {emessage}'
-                )
-            )
-
-    # pylint: disable=too-many-locals
-    async def run_without_agent(self, job_id: str, all_facts: list[dict]) -> None:
+    async def run_with_agent_mode(self, job_id: str, all_facts: list[dict]) -> None:
         emessage = 'no exception'
         start = time.monotonic()
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(TO_QUERY_ENGINE_URL, json=all_facts) as response:
-                    if response.status == http.HTTPStatus.OK:
-                        result_json = await response.json()
-                        content = result_json.get('stdout', '')
-                        await self.the_storage_guy.save_results(content, job_id)
+        try:
+            async with self.the_upstreams.post(
+                TO_QUERY_ENGINE_URL_UPLOAD_ONLY,
+                NUM_SECONDS_PER_REQUEST,
+                **json_request(all_facts)
+            ) as response:
+                if response.status == http.HTTPStatus.OK:
+                    result_json: dict[str, str] = await response.json()
+                    if kb_location := result_json.get('kb_location', None):
+                        self.the_coordinator.set_kb_location(job_id, kb_location)
                         end = time.monotonic()
                         delta = end - start
                         await self.the_logger_dude.info(
                             LogMessage(
                                 file_unique_id=f'queries_{job_id}',
                                 job_id=job_id,
-                                context=Context.QUERYENGINE_SUCCEEDED,
+                                context=Context.KBGEN_UPLOADED_FOR_AGENT,
                                 original_filename='*',
                                 language=Language.ALL,
                                 duration=timedelta(seconds=delta)
                             )
                         )
                         return
-                    if response.status == http.HTTPStatus.GATEWAY_TIMEOUT:
-                        await self.the_storage_guy.save_results('TimeoutExpired', job_id)
-                        end = time.monotonic()
-                        delta = end - start
-                        await self.the_logger_dude.info(
-                            LogMessage(
-                                file_unique_id=f'queries_{job_id}',
-                                job_id=job_id,
-                                context=Context.QUERYENGINE_SUCCEEDED,
-                                original_filename='*',
-                                language=Language.ALL,
-                                duration=timedelta(seconds=delta),
-                                more_details='query engine timeout'
-                            )
-                        )
-                        return
 
-            except aiohttp.ClientError as e:
-                emessage = str(e)
-
-            end = time.monotonic()
-            delta = end - start
-            await self.the_logger_dude.info(
-                LogMessage(
-                    file_unique_id=f'queries_{job_id}',
-                    job_id=job_id,
-                    context=Context.QUERYENGINE_FAILED,
-                    original_filename='*',
-                    language=Language.ALL,
-                    duration=timedelta(seconds=delta),
-                    more_details=f'exception(s): {emessage}'
-                )
+                    # probably unreachable code since an ok response
+                    # means everything went well on the server side
+                    emessage = 'invalid json response without kb location'
+
+        except aiohttp.ClientError as e:
+            emessage = str(e)
+
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=f'queries_{job_id}',
+                job_id=job_id,
+                context=Context.KBGEN_UPLOAD_FOR_AGENT_FAILED,
+                original_filename='*',
+                language=Language.ALL,
+                duration=timedelta(seconds=delta),
+                more_details=f'exception(s): {emessage}'
             )
+        )
+
+    # returns the facts to requeue ( all of them, or none ): the facts are
+    # kept until the query engine answers, or until the job gives up on it
+    # ( a job without facts has nothing to requeue, so it gives up right away )
+    async def run_without_agent(self, job_id: str, files: list[FactsMetadata], give_up: bool) -> list[FactsMetadata]:
+        try:
+            await self.run_queries(job_id, await self.read_all_facts(files), give_up or not files)
+        except UpstreamUnavailable:
+            return files
+
+        await self.delete_all_facts(files)
+        return []
+
+    # pylint: disable=too-many-locals
+    async def run_queries(self, job_id: str, all_facts: list[dict], give_up: bool) -> None:
+        emessage = 'no exception'
+        start = time.monotonic()
+
+        try:
+            async with self.the_upstreams.post(
+                TO_QUERY_ENGINE_URL,
+                NUM_SECONDS_PER_REQUEST,
+                overload_statuses=OVERLOAD_HTTP_STATUSES_OF_QUERIES,
+                max_num_attempts=MAX_NUM_ATTEMPTS_PER_REQUEST,
+                retry_timeouts=False,
+                **json_request(all_facts)
+            ) as response:
+                if response.status == http.HTTPStatus.OK:
+                    result_json = await response.json()
+                    content = result_json.get('stdout', '')
+                    await self.the_storage_guy.save_results(content, job_id)
+                    end = time.monotonic()
+                    delta = end - start
+                    await self.the_logger_dude.info(
+                        LogMessage(
+                            file_unique_id=f'queries_{job_id}',
+                            job_id=job_id,
+                            context=Context.QUERYENGINE_SUCCEEDED,
+                            original_filename='*',
+                            language=Language.ALL,
+                            duration=timedelta(seconds=delta)
+                        )
+                    )
+                    return
+                if response.status == http.HTTPStatus.GATEWAY_TIMEOUT:
+                    await self.the_storage_guy.save_results('TimeoutExpired', job_id)
+                    end = time.monotonic()
+                    delta = end - start
+                    await self.the_logger_dude.info(
+                        LogMessage(
+                            file_unique_id=f'queries_{job_id}',
+                            job_id=job_id,
+                            context=Context.QUERYENGINE_SUCCEEDED,
+                            original_filename='*',
+                            language=Language.ALL,
+                            duration=timedelta(seconds=delta),
+                            more_details='query engine timeout'
+                        )
+                    )
+                    return
+
+                emessage = f'http status {response.status}'
+
+        except UpstreamUnavailable as e:
+            if not give_up:
+                raise
+            emessage = str(e)
+
+        except TimeoutError:
+            emessage = f'no answer within {NUM_SECONDS_PER_REQUEST} seconds'
+
+        except aiohttp.ClientError as e:
+            emessage = str(e)
+
+        end = time.monotonic()
+        delta = end - start
+        await self.the_logger_dude.info(
+            LogMessage(
+                file_unique_id=f'queries_{job_id}',
+                job_id=job_id,
+                context=Context.QUERYENGINE_FAILED,
+                original_filename='*',
+                language=Language.ALL,
+                duration=timedelta(seconds=delta),
+                more_details=f'exception(s): {emessage}'
+            )
+        )
 
     @typing.override
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
-        for job_id in job_ids:
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
+        for shard in shards:
+            job_id = shard.job_id
             if self.the_coordinator.get_agent_mode(job_id):
-                self.the_coordinator.set_status(
-                    job_id,
-                    Status.Finished
-                )
+                await self.finish_job(shard)
                 continue
 
-            if self.the_storage_guy.load_results_metadata_from_db(job_id) is None:
+            if await self.the_storage_guy.load_results_metadata_from_db(job_id) is None:
                 await self.the_logger_dude.info(
                     LogMessage(
                         file_unique_id=f'queries_{job_id}',
@@ -162,20 +203,25 @@ class Queryengine(AbstractWorker):
                         more_details='results metadata missing'
                     )
                 )
-                self.the_coordinator.set_status(
-                    job_id,
-                    Status.Finished
-                )
+                await self.finish_job(shard)
                 continue
 
-            self.the_coordinator.set_status(
-                job_id,
+            await self.the_coordinator.set_status(
+                shard,
                 Status.WaitingForResultsGeneration
             )
 
+    async def read_all_facts(self, files: list[FactsMetadata]) -> list[dict]:
+        contents = await asyncio.gather(*[self.read_facts_json(f) for f in files])
+        all_facts: list[dict] = []
+        for fact_list in contents:
+            all_facts.extend(fact_list)
+        return all_facts
+
+    # facts may be stored compressed, so they are read through the storage
     async def read_facts_json(self, f: FactsMetadata) -> list[dict]:
-        async with aiofiles.open(f.facts_unique_id, 'rt', encoding='utf-8') as fl:
-            content = await fl.read()
-            result = json.loads(content)
-        await self.the_storage_guy.delete_knowledge_base_facts(f)
-        return result
+        lines = await self.the_storage_guy.load_knowledge_base_facts(f)
+        return json.loads(''.join(lines))
+
+    async def delete_all_facts(self, files: list[FactsMetadata]) -> None:
+        await asyncio.gather(*[self.the_storage_guy.delete_knowledge_base_facts(f) for f in files])
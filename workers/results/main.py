@@ -2,8 +2,8 @@ import re
 import typing
 import dataclasses
 
+from coordinator.interface import Shard
 from workers.results import sarif
-from coordinator.interface import Status
 from workers.interface import AbstractWorker
 
 START = r'startloc_(\d+)_(\d+)'
@@ -20,7 +20,7 @@ class Results(AbstractWorker):
     # pylint: disable=too-many-locals
     @typing.override
     async def run(self, job_id: str) -> None:
-        key = self.the_storage_guy.load_results_metadata_from_db(job_id)
+        key = await self.the_storage_guy.load_results_metadata_from_db(job_id)
         content = await self.the_storage_guy.load_results(key)
         sarif_results = {'debug': content}
         if ': yes' in content:
@@ -31,12 +31,9 @@ class Results(AbstractWorker):
         await self.the_storage_guy.save_output(sarif_results, job_id)
 
     @typing.override
-    async def mark_jobs_finished(self, job_ids: list[str]) -> None:
-        for job_id in job_ids:
-            self.the_coordinator.set_status(
-                job_id,
-                Status.Finished
-            )
+    async def mark_jobs_finished(self, shards: list[Shard]) -> None:
+        for shard in shards:
+            await self.finish_job(shard)
 
     @staticmethod
     def parse_proper_path(content: str) -> list[sarif.Location]:
@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+import typing
+import enum
+import asyncio
+import aiohttp
+import contextlib
+import collections
+import dataclasses
+import urllib.parse
+
+from datetime import timedelta
+
+from common.language import Language
+from logger.client import Logger
+from logger.models import Context, LogMessage
+
+# every upstream ( parser, codegen, kbgen, queryengine ) starts with a few
+# requests in flight, and adapts from there ( additive increase for every
+# healthy round trip, multiplicative decrease on errors or growing latency )
+INITIAL_CONCURRENCY: typing.Final[int] = int(os.getenv('UPSTREAM_INITIAL_CONCURRENCY', '4'))
+MIN_CONCURRENCY: typing.Final[int] = int(os.getenv('UPSTREAM_MIN_CONCURRENCY', '1'))
+MAX_CONCURRENCY: typing.Final[int] = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '64'))
+DECREASE_RATIO_ON_ERRORS: typing.Final[float] = 0.5
+DECREASE_RATIO_ON_LATENCY: typing.Final[float] = 0.9
+
+# responses ( smoothed ) slower than that many times the baseline are a sign of queueing
+LATENCY_TOLERANCE: typing.Final[float] = 2.0
+LATENCY_SMOOTHING: typing.Final[float] = 0.2
+
+# the baseline ( the fastest recent response ) slowly drifts up, so it
+# follows an upstream that became slower for good ( like larger files )
+BASELINE_DRIFT_PER_RESPONSE: typing.Final[float] = 0.001
+
+# statuses of an overloaded upstream ( other errors are about the request itself )
+OVERLOAD_HTTP_STATUSES: typing.Final[set[int]] = {429, 500, 502, 503, 504}
+
+# transient failures ( connection errors, timeouts, overload statuses )
+# are retried with exponential backoff and full jitter, so the retries
+# of all the requests in flight spread out instead of arriving together
+MAX_NUM_ATTEMPTS: typing.Final[int] = int(os.getenv('UPSTREAM_MAX_NUM_ATTEMPTS', '4'))
+NUM_SECONDS_OF_FIRST_BACKOFF: typing.Final[float] = 0.5
+MAX_NUM_SECONDS_OF_BACKOFF: typing.Final[float] = 10
+
+# that many consecutive failures open the circuit: dispatch to the upstream
+# pauses for a cool down, and then a single probe request decides whether
+# to resume ( or to pause again, for twice as long )
+NUM_FAILURES_TO_OPEN_CIRCUIT: typing.Final[int] = 5
+MIN_NUM_SECONDS_OF_OPEN_CIRCUIT: typing.Final[float] = 5
+MAX_NUM_SECONDS_OF_OPEN_CIRCUIT: typing.Final[float] = 60
+
+NUM_SECONDS_TO_KEEP_CONNECTIONS_ALIVE: typing.Final[float] = 60
+NUM_SECONDS_BETWEEN_STATS_REPORTS: typing.Final[float] = 60
+NUM_LATENCIES_PER_STATS: typing.Final[int] = 1000
+
+class UpstreamUnavailable(aiohttp.ClientError):
+    '''
+    no answer from the upstream, even after retries
+
+    ---
+
+    unlike other failures, the request itself may well be fine,
+    so whatever it was about should be tried again later on
+    '''
+
+@dataclasses.dataclass
+class AdaptiveLimit:
+    '''
+    AIMD concurrency limit of a single upstream
+
+    ---
+
+    the requests already in flight report the same congestion,
+    so the limit is decreased at most once per round trip
+    '''
+
+    limit: float = INITIAL_CONCURRENCY
+    in_flight: int = 0
+    baseline_latency: typing.Optional[float] = None
+    smoothed_latency: typing.Optional[float] = None
+    last_decrease_at: float = 0.0
+    condition: asyncio.Condition = dataclasses.field(default_factory=asyncio.Condition)
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    # cancelled requests say nothing about the upstream ( no latency )
+    async def release(self, latency: typing.Optional[float], ok: bool) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self.adapt(latency, ok)
+            self.condition.notify_all()
+
+    def adapt(self, latency: float, ok: bool) -> None:
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency *= 1 + BASELINE_DRIFT_PER_RESPONSE
+
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency += LATENCY_SMOOTHING * (latency - self.smoothed_latency)
+
+        if ok and self.smoothed_latency <= self.baseline_latency * LATENCY_TOLERANCE:
+            self.limit = min(MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            return
+
+        now = time.monotonic()
+        if now - self.last_decrease_at >= self.smoothed_latency:
+            ratio = DECREASE_RATIO_ON_LATENCY if ok else DECREASE_RATIO_ON_ERRORS
+            self.limit = max(MIN_CONCURRENCY, self.limit * ratio)
+            self.last_decrease_at = now
+
+class Circuit(str, enum.Enum):
+
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+
+@dataclasses.dataclass
+class CircuitBreaker:
+    '''
+    pauses dispatch to an upstream that keeps failing
+
+    ---
+
+    - closed: requests flow
+    - open: requests wait for the cool down to pass, and then a single
+      one of them probes the upstream ( the others keep waiting, and
+      count it as a failed attempt of their own if the probe fails )
+    '''
+
+    num_consecutive_failures: int = 0
+    opened_at: typing.Optional[float] = None
+    num_seconds_open: float = MIN_NUM_SECONDS_OF_OPEN_CIRCUIT
+    probing: bool = False
+    condition: asyncio.Condition = dataclasses.field(default_factory=asyncio.Condition)
+
+    @property
+    def circuit(self) -> Circuit:
+        return Circuit.CLOSED if self.opened_at is None else Circuit.OPEN
+
+    # whether to dispatch as the probe ( or at all: the circuit
+    # reopened, since the probe failed, while waiting for it )
+    async def wait_until_dispatch_allowed(self) -> typing.Optional[bool]:
+        async with self.condition:
+            opened_at = self.opened_at
+            while self.opened_at is not None:
+                if self.opened_at != opened_at:
+                    return None
+                remaining = self.opened_at + self.num_seconds_open - time.monotonic()
+                if remaining <= 0 and not self.probing:
+                    self.probing = True
+                    return True
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=remaining if remaining > 0 else None)
+                except TimeoutError:
+                    pass
+            return False
+
+    # no outcome for cancelled requests, returns whether the circuit changed
+    async def record(self, ok: typing.Optional[bool], probe: bool) -> bool:
+        async with self.condition:
+            circuit = self.circuit
+            if probe:
+                self.probing = False
+            if ok:
+                self.num_consecutive_failures = 0
+                self.opened_at = None
+                self.num_seconds_open = MIN_NUM_SECONDS_OF_OPEN_CIRCUIT
+            elif ok is not None:
+                self.num_consecutive_failures += 1
+                if probe:
+                    self.opened_at = time.monotonic()
+                    self.num_seconds_open = min(MAX_NUM_SECONDS_OF_OPEN_CIRCUIT, 2 * self.num_seconds_open)
+                elif self.opened_at is None and self.num_consecutive_failures >= NUM_FAILURES_TO_OPEN_CIRCUIT:
+                    self.opened_at = time.monotonic()
+            self.condition.notify_all()
+            return circuit != self.circuit
+
+@dataclasses.dataclass
+class Upstream:
+
+    name: str
+    limit: AdaptiveLimit = dataclasses.field(default_factory=AdaptiveLimit)
+    breaker: CircuitBreaker = dataclasses.field(default_factory=CircuitBreaker)
+    num_requests: int = 0
+    num_failures: int = 0
+    num_retries: int = 0
+    latencies: collections.deque[float] = dataclasses.field(
+        default_factory=lambda: collections.deque(maxlen=NUM_LATENCIES_PER_STATS)
+    )
+
+    def stats(self) -> dict[str, typing.Any]:
+        latencies = sorted(self.latencies)
+        return {
+            'upstream': self.name,
+            'num_requests': self.num_requests,
+            'num_failures': self.num_failures,
+            'num_retries': self.num_retries,
+            'circuit': self.breaker.circuit.value,
+            'in_flight': self.limit.in_flight,
+            'concurrency_limit': int(self.limit.limit),
+            'baseline_seconds': self.limit.baseline_latency,
+            'smoothed_seconds': self.limit.smoothed_latency,
+            'p50_seconds': percentile(latencies, 0.50),
+            'p95_seconds': percentile(latencies, 0.95),
+            'p99_seconds': percentile(latencies, 0.99)
+        }
+
+@dataclasses.dataclass
+class Upstreams:
+    '''
+    shared client of all the requests a worker sends upstream
+
+    ---
+
+    - a single long lived session, whose connections are pooled per upstream
+    - every upstream ( scheme, host and port ) has its own adaptive limit and circuit breaker
+    - transient failures are retried, and `UpstreamUnavailable` is raised once retries run out
+    - the stats of every upstream are logged once in a while ( `UPSTREAM_STATS` )
+    '''
+
+    logger: Logger
+    upstreams: dict[str, Upstream] = dataclasses.field(default_factory=dict, init=False)
+    session: typing.Optional[aiohttp.ClientSession] = dataclasses.field(default=None, init=False)
+    last_stats_report_at: float = dataclasses.field(default_factory=time.monotonic, init=False)
+
+    def of(self, url: str) -> Upstream:
+        parsed = urllib.parse.urlsplit(url)
+        name = f'{parsed.scheme}://{parsed.netloc}'
+        if name not in self.upstreams:
+            self.upstreams[name] = Upstream(name=name)
+        return self.upstreams[name]
+
+    # created on first use, inside the event loop of the worker
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=MAX_CONCURRENCY,
+                keepalive_timeout=NUM_SECONDS_TO_KEEP_CONNECTIONS_ALIVE
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    # the response is read entirely before it is handed over, so a failure
+    # anywhere along the way is retried ( never half way through the caller ),
+    # and the timeout ( of every attempt ) covers the entire body as well.
+    # requests too long to repeat ( like all the queries of a job ) send
+    # fewer attempts, and may raise a timeout as is instead of retrying it
+    @contextlib.asynccontextmanager
+    async def post(
+        self,
+        url: str,
+        timeout: float,
+        overload_statuses: typing.AbstractSet[int] = frozenset(OVERLOAD_HTTP_STATUSES),
+        max_num_attempts: int = MAX_NUM_ATTEMPTS,
+        retry_timeouts: bool = True,
+        **kwargs: typing.Any
+    ) -> typing.AsyncIterator[aiohttp.ClientResponse]:
+        upstream = self.of(url)
+        reason = 'no attempts'
+        for attempt in range(max_num_attempts):
+            if attempt > 0:
+                upstream.num_retries += 1
+                await asyncio.sleep(backoff(attempt - 1, NUM_SECONDS_OF_FIRST_BACKOFF))
+
+            response, reason = await self.attempt(upstream, url, timeout, overload_statuses, retry_timeouts, kwargs)
+            if response is not None:
+                try:
+                    yield response
+                finally:
+                    response.release()
+                return
+
+        raise UpstreamUnavailable(f'{upstream.name} ( {max_num_attempts} attempts ): {reason}')
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    async def attempt(
+        self,
+        upstream: Upstream,
+        url: str,
+        timeout: float,
+        overload_statuses: typing.AbstractSet[int],
+        retry_timeouts: bool,
+        kwargs: dict[str, typing.Any]
+    ) -> tuple[typing.Optional[aiohttp.ClientResponse], str]:
+        probe = await upstream.breaker.wait_until_dispatch_allowed()
+        if probe is None:
+            return None, 'circuit open'
+
+        await upstream.limit.acquire()
+        start = time.monotonic()
+        response: typing.Optional[aiohttp.ClientResponse] = None
+        ok: typing.Optional[bool] = None
+        reason = ''
+        changed = False
+        timed_out: typing.Optional[TimeoutError] = None
+        try:
+            response = await self.get_session().post(url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs)
+            await response.read()
+            ok = response.status not in overload_statuses
+            reason = f'http status {response.status}'
+        except (aiohttp.ClientError, TimeoutError) as e:
+            ok = False
+            reason = f'{type(e).__name__} {e}'
+            if isinstance(e, TimeoutError) and not retry_timeouts:
+                timed_out = e
+        finally:
+            latency = None if ok is None else time.monotonic() - start
+            await upstream.limit.release(latency, bool(ok))
+            changed = await upstream.breaker.record(ok, probe)
+            if latency is not None:
+                upstream.num_requests += 1
+                upstream.num_failures += 0 if ok else 1
+                upstream.latencies.append(latency)
+
+        if changed:
+            await self.report_circuit(upstream, reason)
+        await self.report_stats_if_needed()
+
+        if timed_out is not None:
+            raise timed_out
+
+        if ok:
+            return response, reason
+
+        if response is not None:
+            response.release()
+        return None, reason
+
+    def stats(self) -> list[dict[str, typing.Any]]:
+        return [upstream.stats() for upstream in self.upstreams.values()]
+
+    async def report_circuit(self, upstream: Upstream, reason: str) -> None:
+        opened = upstream.breaker.circuit == Circuit.OPEN
+        await self.logger.warning(
+            LogMessage(
+                file_unique_id='*',
+                job_id='*',
+                context=Context.UPSTREAM_CIRCUIT_OPENED if opened else Context.UPSTREAM_CIRCUIT_CLOSED,
+                original_filename=upstream.name,
+                language=Language.ALL,
+                duration=timedelta(0),
+                more_details=f'paused for {upstream.breaker.num_seconds_open} seconds: {reason}' if opened else reason
+            )
+        )
+
+    async def report_stats_if_needed(self) -> None:
+        now = time.monotonic()
+        if now - self.last_stats_report_at < NUM_SECONDS_BETWEEN_STATS_REPORTS:
+            return
+
+        self.last_stats_report_at = now
+        for stats in self.stats():
+            await self.logger.info(
+                LogMessage(
+                    file_unique_id='*',
+                    job_id='*',
+                    context=Context.UPSTREAM_STATS,
+                    original_filename=stats['upstream'],
+                    language=Language.ALL,
+                    duration=timedelta(seconds=stats['p50_seconds'] or 0),
+                    more_details=json.dumps(stats)
+                )
+            )
+
+# full jitter
+def backoff(attempt: int, num_seconds_of_first_backoff: float) -> float:
+    return random.uniform(0, min(MAX_NUM_SECONDS_OF_BACKOFF, num_seconds_of_first_backoff * 2 ** attempt))
+
+def percentile(sorted_values: list[float], q: float) -> typing.Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]